@@ -1,15 +1,16 @@
 from django.contrib import admin
+from .inbox import mark_alerts_read, mark_alerts_resolved
 from .models import Alert
 
 @admin.register(Alert)
 class AlertAdmin(admin.ModelAdmin):
-    list_display = ['id', 'alert_type', 'priority', 'sensor', 'created_at', 'is_read', 'is_resolved']
+    list_display = ['id', 'alert_type', 'priority', 'sensor', 'created_at', 'last_seen_at', 'occurrence_count', 'is_read', 'is_resolved']
     list_filter = ['alert_type', 'priority', 'is_read', 'is_resolved', 'created_at']
     search_fields = ['message', 'sensor__device_id', 'sensor__location']
     actions = ['mark_as_read', 'mark_as_resolved']
     
     def mark_as_read(self, request, queryset):
-        queryset.update(is_read=True)
+        mark_alerts_read(queryset)
     
     def mark_as_resolved(self, request, queryset):
-        queryset.update(is_resolved=True)
\ No newline at end of file
+        mark_alerts_resolved(queryset)
\ No newline at end of file
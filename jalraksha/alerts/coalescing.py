@@ -0,0 +1,214 @@
+"""
+Alert coalescing.
+
+A condition that keeps firing for the same sensor should not raise a new
+alert (and leak) per reading. ``AlertCoalescer.record`` looks up the open
+alert for each (sensor, alert_type) and folds the occurrence into it: it
+bumps ``occurrence_count`` and ``last_seen_at``, keeps the peak loss rate
+and the highest priority, and refreshes the linked leak's estimate. Only
+the first occurrence inserts rows.
+
+An alert resolved less than ``QUIET_PERIOD`` seconds ago is reopened
+rather than replaced, so a flapping condition stays one incident.
+``observe_clean`` counts clean readings against open alerts and resolves
+an alert, with its untouched leak, after ``RESOLVE_AFTER_CLEAN`` of them
+in a row.
+"""
+from collections import namedtuple
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+COALESCING_SETTINGS = getattr(settings, 'ALERT_COALESCING', {})
+
+# One firing of an alert condition. ``leak`` is an unsaved LeakDetection
+# (or None); it is only saved if the occurrence opens a new alert.
+Occurrence = namedtuple('Occurrence', 'sensor alert_type priority message loss_rate leak')
+
+
+def rank(choices, value):
+    return [code for code, _ in choices].index(value)
+
+
+class AlertCoalescer:
+    def __init__(self, quiet_period=900, resolve_after_clean=20):
+        self.quiet_period = timedelta(seconds=quiet_period)
+        self.resolve_after_clean = resolve_after_clean
+
+    def record(self, occurrences, now=None):
+        """
+        Fold ``occurrences`` into open alerts, opening new ones where needed.
+
+        Returns (opened, updated): alerts that are new or were reopened, and
+        alerts that only absorbed a repeat.
+        """
+        if not occurrences:
+            return [], []
+        now = now or timezone.now()
+        try:
+            return self._record(occurrences, now)
+        except IntegrityError:
+            # Another worker opened one of these alerts first; fold into it.
+            # The rolled-back insert left pks on the leaks, so use fresh ones.
+            return self._record([
+                occurrence._replace(leak=self._fresh(occurrence.leak)) for occurrence in occurrences
+            ], now)
+
+    @staticmethod
+    def _fresh(leak):
+        """An unsaved copy of ``leak``"""
+        if leak is None:
+            return None
+        return type(leak)(**{
+            field.attname: getattr(leak, field.attname)
+            for field in leak._meta.concrete_fields if not field.primary_key
+        })
+
+    @transaction.atomic
+    def _record(self, occurrences, now):
+        from analytics.kpis import kpi_service
+        from analytics.models import LeakDetection
+        from .inbox import alert_counters
+        from .models import Alert
+
+        current = self._current_alerts(occurrences, now)
+        new_alerts, reopened, repeated = {}, [], {}
+        unread = unresolved = 0
+
+        for occurrence in occurrences:
+            key = (occurrence.sensor.id, occurrence.alert_type)
+            alert = current.get(key) or new_alerts.get(key)
+            if alert is None:
+                new_alerts[key] = Alert(
+                    alert_type=occurrence.alert_type,
+                    priority=occurrence.priority,
+                    sensor=occurrence.sensor,
+                    leak=occurrence.leak,
+                    message=occurrence.message,
+                    last_seen_at=now,
+                    peak_loss_rate=occurrence.loss_rate,
+                )
+                unread += 1
+                unresolved += 1
+                continue
+
+            if alert.is_resolved:
+                # Back within the quiet period: same incident, raise it again
+                unresolved += 1
+                unread += alert.is_read
+                alert.is_resolved = alert.is_read = False
+                alert.resolved_at = None
+                reopened.append(alert)
+            if alert.pk is not None:
+                repeated[alert.pk] = alert
+            alert.occurrence_count += 1
+            self._absorb(alert, occurrence, now)
+
+        if new_alerts:
+            # Only occurrences that open an alert keep their leak
+            leaks = [alert.leak for alert in new_alerts.values() if alert.leak is not None]
+            LeakDetection.objects.bulk_create(leaks)
+            Alert.objects.bulk_create(list(new_alerts.values()))
+        if repeated:
+            Alert.objects.bulk_update(repeated.values(), [
+                'priority', 'message', 'last_seen_at', 'occurrence_count', 'peak_loss_rate',
+                'clean_count', 'is_read', 'is_resolved', 'resolved_at',
+            ])
+            leaks = [alert.leak for alert in repeated.values() if alert.leak is not None]
+            LeakDetection.objects.bulk_update(leaks, [
+                'severity', 'status', 'estimated_loss_rate', 'confidence_score', 'resolved_at',
+            ])
+
+        # bulk writes skip post_save, so counters, KPIs and live dashboards
+        # are updated here; repeats are not pushed as new notifications
+        alert_counters.adjust(unread=unread, unresolved=unresolved)
+        kpi_service.invalidate()
+        opened = list(new_alerts.values()) + reopened
+        if opened:
+            transaction.on_commit(lambda: self._publish(opened))
+        return opened, [alert for alert in repeated.values() if alert not in reopened]
+
+    def _publish(self, opened):
+        from sensors import events
+
+        events.publish_many('leak', [events.leak_event(alert.leak) for alert in opened if alert.leak])
+        events.publish_many('alert', [events.alert_event(alert) for alert in opened])
+
+    def _current_alerts(self, occurrences, now):
+        """The open, or recently resolved, alert per (sensor_id, alert_type)"""
+        from .models import Alert
+
+        candidates = Alert.objects.select_for_update().select_related('leak').filter(
+            Q(is_resolved=False) | Q(resolved_at__gte=now - self.quiet_period),
+            sensor_id__in={o.sensor.id for o in occurrences},
+            alert_type__in={o.alert_type for o in occurrences},
+        ).order_by('is_resolved', '-resolved_at', '-id')
+        current = {}
+        for alert in candidates:
+            # Open alerts sort first, then the most recently resolved
+            current.setdefault((alert.sensor_id, alert.alert_type), alert)
+        return current
+
+    def _absorb(self, alert, occurrence, now):
+        from .models import Alert
+
+        alert.last_seen_at = now
+        alert.clean_count = 0
+        alert.message = occurrence.message
+        if rank(Alert.PRIORITY_LEVELS, occurrence.priority) > rank(Alert.PRIORITY_LEVELS, alert.priority):
+            alert.priority = occurrence.priority
+        if occurrence.loss_rate is not None:
+            alert.peak_loss_rate = max(alert.peak_loss_rate or 0, occurrence.loss_rate)
+
+        leak, update = alert.leak, occurrence.leak
+        if leak is None or update is None:
+            return
+        # The leak tracks the latest estimate, so active loss totals stay current
+        leak.estimated_loss_rate = update.estimated_loss_rate
+        leak.confidence_score = max(leak.confidence_score, update.confidence_score)
+        if rank(leak.SEVERITY_LEVELS, update.severity) > rank(leak.SEVERITY_LEVELS, leak.severity):
+            leak.severity = update.severity
+        if leak.resolved_at is not None and leak.status == 'REPAIRED':
+            leak.status = 'DETECTED'
+            leak.resolved_at = None
+
+    def observe_clean(self, clean_counts, alert_types=('LEAK',)):
+        """
+        Count clean readings ({sensor_id: n}) against open alerts and
+        resolve those that reached ``resolve_after_clean``. Returns the
+        number of alerts resolved.
+        """
+        from analytics.models import LeakDetection
+        from .inbox import mark_alerts_resolved
+        from .models import Alert
+
+        clean_counts = {sensor_id: n for sensor_id, n in clean_counts.items() if n}
+        if not clean_counts:
+            return 0
+        open_alerts = Alert.objects.filter(
+            is_resolved=False, alert_type__in=alert_types, sensor_id__in=clean_counts,
+        )
+        if not open_alerts.update(clean_count=F('clean_count') + Case(
+            *(When(sensor_id=sensor_id, then=Value(n)) for sensor_id, n in clean_counts.items()),
+            default=Value(0),
+        )):
+            return 0
+
+        now = timezone.now()
+        with transaction.atomic():
+            recovered = open_alerts.filter(clean_count__gte=self.resolve_after_clean)
+            leak_ids = list(recovered.exclude(leak=None).values_list('leak_id', flat=True))
+            resolved = mark_alerts_resolved(recovered)
+            # Leaks an operator has not picked up yet are closed with the alert
+            LeakDetection.objects.filter(id__in=leak_ids, status='DETECTED').update(
+                status='REPAIRED', resolved_at=now,
+            )
+        return resolved
+
+
+alert_coalescer = AlertCoalescer(
+    quiet_period=COALESCING_SETTINGS.get('QUIET_PERIOD', 900),
+    resolve_after_clean=COALESCING_SETTINGS.get('RESOLVE_AFTER_CLEAN', 20),
+)
@@ -0,0 +1,146 @@
+"""
+Alerts inbox: cached badge counters, bulk state changes and keyset paging.
+
+The unread/unresolved badge counts live in the cache and are adjusted as
+alerts are created, read, resolved or deleted, so rendering the inbox
+does not recount the table. A missing counter is recounted once (two
+index-only counts on the partial alert indexes). Counters also expire
+after ``COUNTER_TTL`` seconds so any drift from writes that bypass the ORM heals
+on its own.
+
+``mark_alerts_read`` and ``mark_alerts_resolved`` change any number of
+alerts with a single UPDATE. UPDATE skips the model signals, so they do
+the signal handlers' work themselves: once committed the counters are
+dropped (and recounted on the next read) and every changed alert is
+pushed to live dashboards.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from sensors.pagination import decode_position, encode_position
+
+INBOX_SETTINGS = getattr(settings, 'ALERT_INBOX', {})
+
+
+class AlertCounters:
+    KEYS = {
+        'unread': 'alerts:unread',
+        'unresolved': 'alerts:unresolved',
+    }
+
+    def __init__(self, cache_alias='default', ttl=300):
+        self.cache_alias = cache_alias
+        self.ttl = ttl
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def get(self):
+        """{'unread': n, 'unresolved': n}, recounting whichever is missing"""
+        cached = self.cache.get_many(self.KEYS.values())
+        counts = {}
+        for name, key in self.KEYS.items():
+            if key in cached:
+                counts[name] = cached[key]
+            else:
+                counts[name] = self.recount(name)
+        return counts
+
+    def recount(self, name):
+        from .models import Alert
+
+        if name == 'unread':
+            count = Alert.objects.filter(is_read=False).count()
+        else:
+            count = Alert.objects.filter(is_resolved=False).count()
+        self.cache.add(self.KEYS[name], count, timeout=self.ttl)
+        return count
+
+    def adjust(self, unread=0, unresolved=0):
+        """Shift the counters once the current transaction commits"""
+        if unread or unresolved:
+            transaction.on_commit(lambda: self._apply(unread=unread, unresolved=unresolved))
+
+    def _apply(self, **deltas):
+        for name, delta in deltas.items():
+            if not delta:
+                continue
+            try:
+                self.cache.incr(self.KEYS[name], delta)
+            except ValueError:
+                # Not cached; the next get() recounts it
+                pass
+
+    def reset(self):
+        self.cache.delete_many(self.KEYS.values())
+
+    def invalidate(self):
+        """Drop the counters once the current transaction commits"""
+        transaction.on_commit(self.reset)
+
+
+alert_counters = AlertCounters(
+    cache_alias=INBOX_SETTINGS.get('CACHE_ALIAS', 'default'),
+    ttl=INBOX_SETTINGS.get('COUNTER_TTL', 300),
+)
+
+
+def _publish(pks):
+    from sensors import events
+    from .models import Alert
+
+    events.publish_many('alert', [events.alert_event(alert) for alert in Alert.objects.filter(pk__in=pks)])
+
+
+@transaction.atomic
+def _mark(alerts, field, **values):
+    """Set ``field`` on the alerts where it is still False; returns how many changed"""
+    from .models import Alert
+
+    pks = list(alerts.filter(**{field: False}).values_list('pk', flat=True))
+    if not pks:
+        return 0
+    changed = Alert.objects.filter(pk__in=pks, **{field: False}).update(**{field: True}, **values)
+    alert_counters.invalidate()
+    transaction.on_commit(lambda: _publish(pks))
+    return changed
+
+
+def mark_alerts_read(alerts):
+    """Mark every alert in the queryset read with one UPDATE; returns how many changed"""
+    return _mark(alerts, 'is_read')
+
+
+def mark_alerts_resolved(alerts):
+    """Mark every alert in the queryset resolved with one UPDATE; returns how many changed"""
+    from analytics.kpis import kpi_service
+
+    changed = _mark(alerts, 'is_resolved', resolved_at=timezone.now())
+    if changed:
+        # Unresolved alerts are a dashboard KPI
+        kpi_service.invalidate()
+    return changed
+
+
+def page_alerts(alerts, cursor=None, page_size=None):
+    """
+    One page of alerts, newest first, keyed on (created_at, id).
+
+    Returns (alerts, next_cursor); next_cursor is None on the last page.
+    Raises ValueError for a malformed cursor.
+    """
+    page_size = page_size or INBOX_SETTINGS.get('PAGE_SIZE', 50)
+    alerts = alerts.order_by('-created_at', '-id')
+    if cursor:
+        created_at, pk = decode_position(cursor)
+        alerts = alerts.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+    # One extra row tells us whether there is a next page
+    page = list(alerts[:page_size + 1])
+    next_cursor = None
+    if len(page) > page_size:
+        page = page[:page_size]
+        next_cursor = encode_position(page[-1].created_at, page[-1].pk)
+    return page, next_cursor
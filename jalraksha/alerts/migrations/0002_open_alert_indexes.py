@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0001_initial'),
+        ('analytics', '0003_active_leak_indexes'),
+        ('sensors', '0004_reading_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='alert',
+            index=models.Index(condition=models.Q(('is_resolved', False)), fields=['-created_at'], name='alert_open_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='alert',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['-created_at'], name='alert_unread_created_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0002_open_alert_indexes'),
+        ('analytics', '0003_active_leak_indexes'),
+        ('sensors', '0004_reading_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='alert',
+            index=models.Index(fields=['-created_at', '-id'], name='alert_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:04
+
+from django.db import migrations, models
+from django.db.models import Count, F, Max, OuterRef, Subquery, Sum
+
+
+def coalesce_open_alerts(apps, schema_editor):
+    """
+    Backfill the coalescing fields and fold duplicate open alerts into the
+    oldest one per (sensor, alert_type) so the unique constraint can apply.
+    """
+    Alert = apps.get_model('alerts', 'Alert')
+    LeakDetection = apps.get_model('analytics', 'LeakDetection')
+
+    Alert.objects.filter(last_seen_at__isnull=True).update(last_seen_at=F('created_at'))
+    Alert.objects.filter(leak__isnull=False).update(peak_loss_rate=Subquery(
+        LeakDetection.objects.filter(id=OuterRef('leak_id')).values('estimated_loss_rate')[:1]
+    ))
+
+    groups = (
+        Alert.objects.filter(is_resolved=False).values('sensor_id', 'alert_type')
+        .annotate(alerts=Count('id'), occurrences=Sum('occurrence_count'),
+                  last_seen=Max('last_seen_at'), peak=Max('peak_loss_rate'))
+        .filter(alerts__gt=1).order_by()
+    )
+    for group in list(groups):
+        open_alerts = Alert.objects.filter(
+            is_resolved=False, sensor_id=group['sensor_id'], alert_type=group['alert_type'],
+        )
+        keep = open_alerts.order_by('created_at', 'id').first()
+        # No resolved_at: folded duplicates are never reopened by the quiet period
+        open_alerts.exclude(id=keep.id).update(is_resolved=True, is_read=True)
+        keep.occurrence_count = group['occurrences']
+        keep.last_seen_at = group['last_seen']
+        keep.peak_loss_rate = group['peak']
+        keep.save(update_fields=['occurrence_count', 'last_seen_at', 'peak_loss_rate'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0003_alert_keyset_index'),
+        ('analytics', '0003_active_leak_indexes'),
+        ('sensors', '0004_reading_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='alert',
+            name='clean_count',
+            field=models.PositiveIntegerField(default=0, help_text='Clean readings since the last occurrence'),
+        ),
+        migrations.AddField(
+            model_name='alert',
+            name='last_seen_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='alert',
+            name='occurrence_count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='alert',
+            name='peak_loss_rate',
+            field=models.FloatField(blank=True, help_text='Liters per hour', null=True),
+        ),
+        migrations.AddField(
+            model_name='alert',
+            name='resolved_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(coalesce_open_alerts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0004_alert_coalescing'),
+        ('sensors', '0004_reading_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='alert',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_resolved', False)), fields=('sensor', 'alert_type'), name='alert_one_open_per_type'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0005_alert_one_open_per_type'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='alert',
+            name='alert_type',
+            field=models.CharField(choices=[('LEAK', 'Leak Detected'), ('CONTINUOUS_FLOW', 'Continuous Flow'), ('HIGH_CONSUMPTION', 'High Consumption'), ('SENSOR_OFFLINE', 'Sensor Offline'), ('LOW_BATTERY', 'Low Battery'), ('LOW_PRESSURE', 'Low Pressure')], max_length=30),
+        ),
+    ]
@@ -8,6 +8,7 @@ class Alert(models.Model):
         ('CONTINUOUS_FLOW', 'Continuous Flow'),
         ('HIGH_CONSUMPTION', 'High Consumption'),
         ('SENSOR_OFFLINE', 'Sensor Offline'),
+        ('LOW_BATTERY', 'Low Battery'),
         ('LOW_PRESSURE', 'Low Pressure'),
     ]
     PRIORITY_LEVELS = [
@@ -25,9 +26,35 @@ class Alert(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
     is_resolved = models.BooleanField(default=False)
+    resolved_at = models.DateTimeField(null=True, blank=True)
+    # Coalescing: repeat occurrences update the open alert instead of adding rows
+    last_seen_at = models.DateTimeField(null=True, blank=True)
+    occurrence_count = models.PositiveIntegerField(default=1)
+    peak_loss_rate = models.FloatField(null=True, blank=True, help_text='Liters per hour')
+    clean_count = models.PositiveIntegerField(default=0, help_text='Clean readings since the last occurrence')
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination of the inbox orders on (created_at, id)
+            models.Index(fields=['-created_at', '-id'], name='alert_created_id_idx'),
+            # Partial: open and unread alerts are a small slice of the table
+            models.Index(
+                fields=['-created_at'], name='alert_open_created_idx',
+                condition=models.Q(is_resolved=False),
+            ),
+            models.Index(
+                fields=['-created_at'], name='alert_unread_created_idx',
+                condition=models.Q(is_read=False),
+            ),
+        ]
+        constraints = [
+            # At most one open alert per sensor and type; repeats coalesce into it
+            models.UniqueConstraint(
+                fields=['sensor', 'alert_type'], name='alert_one_open_per_type',
+                condition=models.Q(is_resolved=False),
+            ),
+        ]
     
     def __str__(self):
         return f"{self.alert_type} - {self.sensor.location}"
\ No newline at end of file
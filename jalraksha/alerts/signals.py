@@ -0,0 +1,47 @@
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+from sensors import events
+from analytics.kpis import kpi_service
+from .inbox import alert_counters
+from .models import Alert
+
+
+@receiver(post_save, sender=Alert)
+def publish_alert(sender, instance, **kwargs):
+    """Push new and updated alerts to live dashboards once committed"""
+    transaction.on_commit(lambda: events.publish('alert', events.alert_event(instance)))
+
+
+@receiver(post_save, sender=Alert)
+@receiver(post_delete, sender=Alert)
+def invalidate_alert_kpis(sender, **kwargs):
+    kpi_service.invalidate()
+
+
+def inbox_flags(alert):
+    # Deferred fields are left out (None) rather than loaded one query each
+    return alert.__dict__.get('is_read'), alert.__dict__.get('is_resolved')
+
+
+@receiver(post_init, sender=Alert)
+def remember_inbox_flags(sender, instance, **kwargs):
+    # Compared on save to tell which badge counters the save moved
+    instance._inbox_flags = inbox_flags(instance)
+
+
+@receiver(post_save, sender=Alert)
+def count_saved_alert(sender, instance, created, **kwargs):
+    before = (True, True) if created else instance._inbox_flags
+    after = inbox_flags(instance)
+    unread, unresolved = (
+        int(old) - int(new) if old is not None and new is not None else 0
+        for old, new in zip(before, after)
+    )
+    alert_counters.adjust(unread=unread, unresolved=unresolved)
+    instance._inbox_flags = after
+
+
+@receiver(post_delete, sender=Alert)
+def count_deleted_alert(sender, instance, **kwargs):
+    alert_counters.adjust(unread=-(not instance.is_read), unresolved=-(not instance.is_resolved))
@@ -1,3 +1,221 @@
+from datetime import timedelta
+from unittest import mock, skipUnless
+from django.core.cache import cache
+from django.db import IntegrityError, connection
 from django.test import TestCase
+from django.utils import timezone
+from analytics.kpis import kpi_service
+from analytics.models import LeakDetection
+from sensors.models import SensorDevice
+from .coalescing import AlertCoalescer, Occurrence
+from .inbox import alert_counters, mark_alerts_read, mark_alerts_resolved, page_alerts
+from .models import Alert
 
-# Create your tests here.
+
+class AlertCoalescingTests(TestCase):
+    def setUp(self):
+        # Alert counters and KPI generations live in the cache
+        cache.clear()
+        self.sensor = SensorDevice.objects.create(
+            device_id='A1', sensor_type='FLOW', deployment_type='RESIDENTIAL', location='Alert street',
+        )
+        self.coalescer = AlertCoalescer(quiet_period=900, resolve_after_clean=3)
+
+    def occurrence(self, loss_rate, priority='HIGH', severity='MEDIUM'):
+        leak = LeakDetection(
+            sensor=self.sensor, severity=severity, estimated_loss_rate=loss_rate, confidence_score=0.8,
+        )
+        return Occurrence(self.sensor, 'LEAK', priority, f'Leak of {loss_rate} L/hr', loss_rate, leak)
+
+    def test_repeats_fold_into_the_open_alert(self):
+        opened, _ = self.coalescer.record([self.occurrence(100)])
+        self.assertEqual(len(opened), 1)
+        opened, updated = self.coalescer.record([self.occurrence(250, priority='URGENT'), self.occurrence(50)])
+        self.assertEqual((opened, len(updated)), ([], 1))
+
+        alert = Alert.objects.get()
+        self.assertEqual(alert.occurrence_count, 3)
+        self.assertEqual(alert.peak_loss_rate, 250)
+        self.assertEqual(alert.priority, 'URGENT')
+        # Only the opening occurrence stores a leak, which tracks the latest estimate
+        self.assertEqual(LeakDetection.objects.get().estimated_loss_rate, 50)
+
+    def test_alert_resolved_within_quiet_period_is_reopened(self):
+        self.coalescer.record([self.occurrence(100)])
+        Alert.objects.update(is_resolved=True, resolved_at=timezone.now() - timedelta(minutes=5))
+        opened, _ = self.coalescer.record([self.occurrence(100)])
+        self.assertEqual(len(opened), 1)
+        alert = Alert.objects.get()
+        self.assertFalse(alert.is_resolved)
+        self.assertEqual(alert.occurrence_count, 2)
+
+    def test_alert_resolved_before_quiet_period_is_not_reopened(self):
+        self.coalescer.record([self.occurrence(100)])
+        Alert.objects.update(is_resolved=True, resolved_at=timezone.now() - timedelta(hours=1))
+        self.coalescer.record([self.occurrence(100)])
+        self.assertEqual(Alert.objects.count(), 2)
+
+    def test_clean_readings_resolve_the_alert_and_its_leak(self):
+        self.coalescer.record([self.occurrence(100)])
+        self.assertEqual(self.coalescer.observe_clean({self.sensor.id: 2}), 0)
+        self.assertEqual(self.coalescer.observe_clean({self.sensor.id: 1}), 1)
+        self.assertTrue(Alert.objects.get().is_resolved)
+        self.assertEqual(LeakDetection.objects.get().status, 'REPAIRED')
+
+    def test_repeat_resets_the_clean_count(self):
+        self.coalescer.record([self.occurrence(100)])
+        self.coalescer.observe_clean({self.sensor.id: 2})
+        self.coalescer.record([self.occurrence(100)])
+        self.assertEqual(self.coalescer.observe_clean({self.sensor.id: 2}), 0)
+        self.assertFalse(Alert.objects.get().is_resolved)
+
+    def test_lost_race_retries_with_unsaved_leaks(self):
+        real_alert_insert = Alert.objects.bulk_create
+        real_leak_insert = LeakDetection.objects.bulk_create
+        leak_pks = []
+
+        def alert_insert(alerts):
+            if not leak_pks[1:]:
+                # Another worker opened the alert between the lookup and the insert
+                raise IntegrityError('UNIQUE constraint failed')
+            return real_alert_insert(alerts)
+
+        def leak_insert(leaks):
+            leak_pks.append([leak.pk for leak in leaks])
+            return real_leak_insert(leaks)
+
+        with mock.patch.object(Alert.objects, 'bulk_create', side_effect=alert_insert), \
+                mock.patch.object(LeakDetection.objects, 'bulk_create', side_effect=leak_insert):
+            opened, _ = self.coalescer.record([self.occurrence(100)])
+
+        self.assertEqual(leak_pks, [[None], [None]])
+        self.assertEqual(len(opened), 1)
+        alert = Alert.objects.get()
+        self.assertEqual(alert.leak, LeakDetection.objects.get())
+
+
+
+class AlertInboxTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.sensor = SensorDevice.objects.create(
+            device_id='A1', sensor_type='FLOW', deployment_type='RESIDENTIAL', location='Alert street',
+        )
+        # One open alert per type, newest last
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alerts = [
+                Alert.objects.create(alert_type=alert_type, priority='HIGH', sensor=self.sensor, message=alert_type)
+                for alert_type, _ in Alert.ALERT_TYPES
+            ]
+
+    def counts(self):
+        with self.assertNumQueries(0):
+            return alert_counters.get()
+
+    def test_missing_counters_are_recounted_once(self):
+        with self.assertNumQueries(2):
+            self.assertEqual(alert_counters.get(), {'unread': 6, 'unresolved': 6})
+        self.assertEqual(self.counts(), {'unread': 6, 'unresolved': 6})
+
+    def test_saves_and_deletes_adjust_the_counters(self):
+        alert_counters.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            alert = Alert.objects.get(pk=self.alerts[0].pk)
+            alert.is_read = True
+            alert.save()
+            alert = Alert.objects.get(pk=self.alerts[1].pk)
+            alert.is_resolved = True
+            alert.save()
+        self.assertEqual(self.counts(), {'unread': 5, 'unresolved': 5})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            # Flags that were never loaded cannot have been changed
+            alert = Alert.objects.only('id', 'message').get(pk=self.alerts[2].pk)
+            alert.message = 'Edited'
+            alert.save()
+            self.alerts[3].delete()
+            Alert.objects.create(alert_type='LEAK', priority='LOW', sensor=self.sensor, message='Read',
+                                 is_read=True, is_resolved=True)
+        self.assertEqual(self.counts(), {'unread': 4, 'unresolved': 4})
+
+    def test_mark_read_updates_counters_and_dashboards(self):
+        alert_counters.get()
+        with mock.patch('sensors.events.publish_many') as publish_many:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(mark_alerts_read(Alert.objects.filter(pk__in=[a.pk for a in self.alerts[:3]])), 3)
+                self.assertEqual(mark_alerts_read(Alert.objects.filter(pk=self.alerts[0].pk)), 0)
+        self.assertEqual(alert_counters.get(), {'unread': 3, 'unresolved': 6})
+
+        publish_many.assert_called_once()
+        event_type, events = publish_many.call_args.args
+        self.assertEqual(event_type, 'alert')
+        self.assertEqual(sorted(event['id'] for event in events), sorted(a.pk for a in self.alerts[:3]))
+        self.assertTrue(all(event['is_read'] for event in events))
+
+    def test_mark_resolved_updates_counters_kpis_and_dashboards(self):
+        alert_counters.get()
+        generation = kpi_service.generation()
+        with mock.patch('sensors.events.publish_many') as publish_many:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(mark_alerts_resolved(Alert.objects.filter(alert_type='LEAK')), 1)
+        self.assertEqual(alert_counters.get(), {'unread': 6, 'unresolved': 5})
+        self.assertGreater(kpi_service.generation(), generation)
+        self.assertIsNotNone(Alert.objects.get(alert_type='LEAK').resolved_at)
+        [event] = publish_many.call_args.args[1]
+        self.assertTrue(event['is_resolved'])
+
+    def test_pages_walk_newest_first_across_equal_timestamps(self):
+        Alert.objects.update(created_at=timezone.now())
+        pages, cursor = [], None
+        while True:
+            page, cursor = page_alerts(Alert.objects.all(), cursor, page_size=4)
+            pages.append([alert.pk for alert in page])
+            if cursor is None:
+                break
+        self.assertEqual([len(page) for page in pages], [4, 2])
+        self.assertEqual(sum(pages, []), sorted((a.pk for a in self.alerts), reverse=True))
+
+    def test_malformed_cursor_is_rejected(self):
+        with self.assertRaises(ValueError):
+            page_alerts(Alert.objects.all(), 'not-a-cursor')
+
+
+@skipUnless(connection.vendor == 'sqlite', 'query plans are checked on SQLite')
+class AlertIndexTests(TestCase):
+    def setUp(self):
+        sensor = SensorDevice.objects.create(
+            device_id='A1', sensor_type='FLOW', deployment_type='RESIDENTIAL', location='Alert street',
+        )
+        # One open alert per sensor and type, so only the first is unresolved
+        Alert.objects.bulk_create([
+            Alert(alert_type='LEAK', priority='HIGH', sensor=sensor, message='Leak',
+                  is_read=i % 2 == 0, is_resolved=i > 0)
+            for i in range(20)
+        ])
+
+    def plan(self, run):
+        """EXPLAIN QUERY PLAN of the last statement run() executes, as one string"""
+        statements = []
+
+        def record(execute, sql, params, many, context):
+            statements.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            run()
+        sql, params = statements[-1]
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return ' '.join(row[-1] for row in cursor.fetchall())
+
+    def test_index_conditions_match_the_inbox_filters(self):
+        conditions = {index.name: index.condition for index in Alert._meta.indexes}
+        self.assertEqual(conditions['alert_open_created_idx'].children, [('is_resolved', False)])
+        self.assertEqual(conditions['alert_unread_created_idx'].children, [('is_read', False)])
+
+    def test_counts_use_the_partial_indexes(self):
+        self.assertIn('alert_unread_created_idx', self.plan(lambda: Alert.objects.filter(is_read=False).count()))
+        self.assertIn('alert_open_created_idx', self.plan(lambda: Alert.objects.filter(is_resolved=False).count()))
+
+    def test_open_alerts_page_uses_the_partial_index(self):
+        self.assertIn('alert_open_created_idx', self.plan(lambda: list(Alert.objects.filter(is_resolved=False)[:5])))
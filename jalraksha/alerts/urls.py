@@ -5,6 +5,7 @@ app_name = 'alerts'
 
 urlpatterns = [
     path('', views.alerts_list, name='alerts_list'),
+    path('bulk/', views.bulk_update, name='bulk_update'),
     path('<int:alert_id>/', views.alert_detail, name='alert_detail'),
     path('<int:alert_id>/resolve/', views.mark_resolved, name='mark_resolved'),
 ]
\ No newline at end of file
@@ -1,7 +1,13 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib import messages
+from django.http import Http404
+from django.urls import reverse
+from django.views.decorators.http import require_POST
+from .inbox import alert_counters, mark_alerts_read, mark_alerts_resolved, page_alerts
 from .models import Alert
 
+FILTERS = ('all', 'unread', 'unresolved')
+
 def alerts_list(request):
     filter_type = request.GET.get('type', 'all')
     
@@ -10,15 +16,25 @@ def alerts_list(request):
     elif filter_type == 'unresolved':
         alerts = Alert.objects.filter(is_resolved=False)
     else:
+        filter_type = 'all'
         alerts = Alert.objects.all()
     
     alerts = alerts.select_related('sensor', 'leak')
+    cursor = request.GET.get('cursor')
+    try:
+        page, next_cursor = page_alerts(alerts, cursor)
+    except ValueError:
+        raise Http404('Invalid cursor')
     
+    # Badge counts come from cached counters, not a COUNT(*) per request
+    counts = alert_counters.get()
     context = {
-        'alerts': alerts,
+        'alerts': page,
         'filter_type': filter_type,
-        'unread_count': Alert.objects.filter(is_read=False).count(),
-        'unresolved_count': Alert.objects.filter(is_resolved=False).count(),
+        'cursor': cursor,
+        'next_cursor': next_cursor,
+        'unread_count': counts['unread'],
+        'unresolved_count': counts['unresolved'],
     }
     return render(request, 'alerts/alerts_list.html', context)
 
@@ -27,15 +43,38 @@ def alert_detail(request, alert_id):
     
     # Mark as read
     if not alert.is_read:
+        mark_alerts_read(Alert.objects.filter(id=alert.id))
         alert.is_read = True
-        alert.save()
     
     context = {'alert': alert}
     return render(request, 'alerts/alert_detail.html', context)
 
 def mark_resolved(request, alert_id):
     alert = get_object_or_404(Alert, id=alert_id)
-    alert.is_resolved = True
-    alert.save()
+    mark_alerts_resolved(Alert.objects.filter(id=alert.id))
     messages.success(request, 'Alert marked as resolved.')
-    return redirect('alerts:alerts_list')
\ No newline at end of file
+    return redirect('alerts:alerts_list')
+
+@require_POST
+def bulk_update(request):
+    """Mark the selected alerts read or resolved with one UPDATE"""
+    action = request.POST.get('action')
+    ids = [int(pk) for pk in request.POST.getlist('ids') if pk.isdigit()]
+    alerts = Alert.objects.filter(id__in=ids)
+    
+    if not ids:
+        messages.error(request, 'No alerts selected.')
+    elif action == 'read':
+        changed = mark_alerts_read(alerts)
+        messages.success(request, f'{changed} alert(s) marked as read.')
+    elif action == 'resolve':
+        changed = mark_alerts_resolved(alerts)
+        messages.success(request, f'{changed} alert(s) marked as resolved.')
+    else:
+        messages.error(request, 'Unknown action.')
+    
+    filter_type = request.POST.get('type', 'all')
+    url = reverse('alerts:alerts_list')
+    if filter_type in FILTERS and filter_type != 'all':
+        url += f'?type={filter_type}'
+    return redirect(url)
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import LeakDetection, ConsumptionPattern
+from .models import LeakDetection, ConsumptionPattern, ReadingRollup, ReadingOutbox, ZoneBalance
 
 @admin.register(LeakDetection)
 class LeakDetectionAdmin(admin.ModelAdmin):
@@ -10,4 +10,27 @@ class LeakDetectionAdmin(admin.ModelAdmin):
 @admin.register(ConsumptionPattern)
 class ConsumptionPatternAdmin(admin.ModelAdmin):
     list_display = ['sensor', 'date', 'total_consumption', 'continuous_flow_detected']
-    list_filter = ['date', 'continuous_flow_detected']
\ No newline at end of file
+    list_filter = ['date', 'continuous_flow_detected']
+
+@admin.register(ReadingRollup)
+class ReadingRollupAdmin(admin.ModelAdmin):
+    list_display = ['sensor', 'resolution', 'bucket', 'count', 'flow_sum', 'flow_min', 'flow_max', 'battery_min']
+    list_filter = ['resolution', 'sensor']
+    date_hierarchy = 'bucket'
+
+@admin.register(ZoneBalance)
+class ZoneBalanceAdmin(admin.ModelAdmin):
+    list_display = ['zone', 'resolution', 'bucket', 'inflow_volume', 'outflow_volume', 'leak_loss_volume']
+    list_filter = ['resolution', 'zone']
+    date_hierarchy = 'bucket'
+
+@admin.register(ReadingOutbox)
+class ReadingOutboxAdmin(admin.ModelAdmin):
+    list_display = ['id', 'reading', 'created_at', 'attempts', 'claimed_until', 'failed_at']
+    list_filter = ['failed_at']
+    raw_id_fields = ['reading']
+    actions = ['retry']
+
+    @admin.action(description='Retry selected rows')
+    def retry(self, request, queryset):
+        queryset.update(failed_at=None, attempts=0, claim_token=None, claimed_until=None)
@@ -3,64 +3,101 @@ from sklearn.ensemble import IsolationForest
 from datetime import timedelta
 from django.utils import timezone
 
+MIN_TRAINING_ROWS = 100
+TRAINING_DAYS = 30
+
+def training_readings(queryset):
+    """Recent (flow_rate, pressure) rows usable for fitting"""
+    return queryset.filter(
+        timestamp__gte=timezone.now() - timedelta(days=TRAINING_DAYS),
+        flow_rate__isnull=False,
+        pressure__isnull=False,
+    ).values_list('flow_rate', 'pressure')
+
 class LeakDetectionAI:
-    def __init__(self):
-        self.model = IsolationForest(contamination=0.1, random_state=42)
-        self.is_trained = False
+    def __init__(self, model=None, score_mean=None, score_std=None):
+        self.model = model or IsolationForest(contamination=0.1, random_state=42)
+        self.is_trained = model is not None
+        # Distribution of training scores, used for drift detection
+        self.score_mean = score_mean
+        self.score_std = score_std
+    
+    def fit(self, X):
+        """Fit the forest on an (n, 2) array of flow_rate, pressure"""
+        self.model.fit(X)
+        scores = self.model.score_samples(X)
+        self.score_mean = float(scores.mean())
+        self.score_std = float(scores.std())
+        self.is_trained = True
     
     def train(self, sensor_id):
         """Train on historical data for a specific sensor"""
-        from sensors.models import SensorReading, SensorDevice
+        from sensors.registry import device_registry
         
-        sensor = SensorDevice.objects.get(id=sensor_id)
-        readings = sensor.readings.filter(
-            timestamp__gte=timezone.now() - timedelta(days=30)
-        ).values_list('flow_rate', 'pressure')
+        sensor = device_registry.get_by_id(sensor_id)
+        readings = training_readings(sensor.readings.all())
         
-        if len(readings) < 100:
+        if len(readings) < MIN_TRAINING_ROWS:
             return False
         
-        X = np.array(readings)
-        self.model.fit(X)
-        self.is_trained = True
+        self.fit(np.array(readings, dtype=np.float64))
         return True
     
+    def score_batch(self, X):
+        """
+        Score an (n, 2) array of flow_rate, pressure in one tree traversal.
+        
+        Returns (is_anomaly, confidence) arrays. The anomaly decision is the
+        one IsolationForest.predict makes (score below the fitted offset),
+        derived from the same score_samples call instead of a second pass.
+        """
+        scores = self.model.score_samples(X)
+        return scores < self.model.offset_, np.abs(scores)
+    
     def detect_anomaly(self, flow_rate, pressure):
         """Detect if current reading is anomalous"""
         if not self.is_trained:
             return False, 0.0
         
-        X = np.array([[flow_rate, pressure]])
-        prediction = self.model.predict(X)
-        score = self.model.score_samples(X)[0]
-        
-        is_anomaly = prediction[0] == -1
-        confidence = abs(score)
-        
-        return is_anomaly, confidence
+        is_anomaly, confidence = self.score_batch(np.array([[flow_rate, pressure]]))
+        return bool(is_anomaly[0]), float(confidence[0])
     
     def detect_continuous_flow(self, sensor_id, hours=24):
         """Detect continuous flow (potential leak)"""
-        from sensors.models import SensorReading, SensorDevice
+        from .streaming import flow_detector
+        
+        now = timezone.now()
+        if hours * 3600 == flow_detector.window:
+            verdict = flow_detector.verdict(sensor_id, now)
+            if verdict is not None:
+                return verdict
+        
+        # Cold or stale state: one values_list fetch, no model instances
+        from sensors.models import SensorReading
+        
+        since = now - timedelta(hours=hours)
+        samples = list(SensorReading.objects.filter(
+            sensor_id=sensor_id, timestamp__gte=since
+        ).order_by().values_list('timestamp', 'flow_rate'))
         
-        sensor = SensorDevice.objects.get(id=sensor_id)
-        since = timezone.now() - timedelta(hours=hours)
-        readings = sensor.readings.filter(timestamp__gte=since).order_by('timestamp')
+        if hours * 3600 == flow_detector.window:
+            state = flow_detector.seed(sensor_id, samples, now)
+            return flow_detector.evaluate(state, now.timestamp())
         
-        if readings.count() < 20:
+        if len(samples) < 20:
             return False, 0
         
-        flow_rates = [r.flow_rate for r in readings if r.flow_rate]
-        if not flow_rates:
+        flow_rates = np.array([f for _, f in samples if f], dtype=np.float64)
+        if not len(flow_rates):
             return False, 0
         
         # Check for continuous non-zero flow
-        avg_flow = np.mean(flow_rates)
-        std_flow = np.std(flow_rates)
+        avg_flow = flow_rates.mean()
+        std_flow = flow_rates.std()
         
         # Low variance + non-zero flow = potential leak
         if avg_flow > 0.5 and std_flow < (avg_flow * 0.2):
             estimated_loss = avg_flow * 60  # Convert to liters per hour
             return True, estimated_loss
         
-        return False, 0
\ No newline at end of file
+        return False, 0
@@ -0,0 +1,182 @@
+"""
+Downsampled chart series that keep their shape.
+
+``reading_series`` reduces a reading field over any time range to at
+most ``points`` points. A single sensor with few enough readings is
+downsampled from the raw rows. Anything larger is first bucketed from
+the rollups plus the raw tail that has not been rolled up yet, then
+downsampled. Two methods are available:
+
+* ``lttb``: Largest-Triangle-Three-Buckets keeps the points that carry
+  the most visual area, so peaks and troughs survive.
+* ``minmax``: keeps each bucket's extremes, which suits spiky signals.
+"""
+import numpy as np
+from .rollups import METRICS, RESOLUTION_SECONDS, not_rolled_up, series
+
+# A single sensor with at most this many readings in range is sampled raw
+MAX_RAW_POINTS = 50000
+# Finest rollup resolution whose bucket count over the range stays under this
+MAX_SOURCE_BUCKETS = 20000
+
+ROLLUP_PREFIX = {field: prefix for prefix, field in METRICS}
+
+
+def lttb(x, y, threshold):
+    """Indices of ``threshold`` points chosen by Largest-Triangle-Three-Buckets"""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # threshold - 2 buckets over the interior; the end points are always kept
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, stop = edges[i], edges[i + 1]
+        next_stop = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[stop:next_stop].mean()
+        avg_y = y[stop:next_stop].mean()
+        # Twice the triangle area between the last pick, each candidate and
+        # the next bucket's average; the constant factor does not matter
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:stop] - y[a])
+            - (x[a] - x[start:stop]) * (avg_y - y[a])
+        )
+        a = start + int(area.argmax())
+        indices[i + 1] = a
+    return indices
+
+
+def minmax(x, y, threshold):
+    """Indices of the minimum and maximum of each of threshold // 2 buckets"""
+    n = len(x)
+    if threshold >= n:
+        return np.arange(n)
+    edges = np.linspace(0, n, max(threshold // 2, 1) + 1).astype(np.int64)
+    picks = []
+    for start, stop in zip(edges[:-1], edges[1:]):
+        if stop > start:
+            segment = y[start:stop]
+            picks.append(start + int(segment.argmin()))
+            picks.append(start + int(segment.argmax()))
+    return np.unique(picks)
+
+
+METHODS = {
+    'lttb': lttb,
+    'minmax': minmax,
+}
+
+
+def choose_source_resolution(start, end):
+    span = (end - start).total_seconds()
+    for resolution in ('MINUTE', 'HOUR'):
+        if span / RESOLUTION_SECONDS[resolution] <= MAX_SOURCE_BUCKETS:
+            return resolution
+    return 'DAY'
+
+
+def _raw_points(readings, fields):
+    """Epoch seconds and one float array per field (NaN where null), oldest first"""
+    rows = np.array(
+        readings.order_by('timestamp', 'id').values_list('timestamp', *fields),
+        dtype=object,
+    ).reshape(-1, len(fields) + 1)
+    x = np.array([ts.timestamp() for ts in rows[:, 0]], dtype=np.float64)
+    # astype turns None into NaN
+    return x, {field: rows[:, column].astype(np.float64) for column, field in enumerate(fields, start=1)}
+
+
+def _bucketed(rollup_rows, tail_x, tail_y, field, resolution):
+    """
+    Per-bucket (bucket start, count, sum, min, max) across sensors, from the
+    rollups plus the readings past the rollup high-water mark.
+    """
+    prefix = ROLLUP_PREFIX[field]
+    rolled = np.array([
+        (row['bucket'].timestamp(), row[f'{prefix}_count'], row[f'{prefix}_sum'],
+         row[f'{prefix}_min'], row[f'{prefix}_max'])
+        for row in rollup_rows
+        if row[f'{prefix}_count']
+    ], dtype=np.float64).reshape(-1, 5)
+
+    present = ~np.isnan(tail_y)
+    tail_x, tail_y = tail_x[present], tail_y[present]
+    seconds = RESOLUTION_SECONDS[resolution]
+    tail = np.column_stack([
+        tail_x // seconds * seconds, np.ones_like(tail_y), tail_y, tail_y, tail_y,
+    ])
+
+    combined = np.concatenate([rolled, tail])
+    buckets, inverse = np.unique(combined[:, 0], return_inverse=True)
+    count = np.zeros(len(buckets))
+    total = np.zeros(len(buckets))
+    low = np.full(len(buckets), np.inf)
+    high = np.full(len(buckets), -np.inf)
+    np.add.at(count, inverse, combined[:, 1])
+    np.add.at(total, inverse, combined[:, 2])
+    np.minimum.at(low, inverse, combined[:, 3])
+    np.maximum.at(high, inverse, combined[:, 4])
+    return buckets, count, total, low, high
+
+
+def _downsample(x, y, points, method, source):
+    indices = METHODS[method](x, y, points)
+    return {
+        'source': source,
+        'timestamps': (x[indices] * 1000).astype(np.int64).tolist(),
+        'values': np.round(y[indices], 3).tolist(),
+    }
+
+
+def reading_series_many(fields, start, end, sensor_ids=None, points=300, method='lttb'):
+    """
+    ``reading_series`` for several fields at once, keyed by field.
+
+    The fields share one rollup query and one read of the raw tail, so
+    charting flow and pressure together costs no more than one of them.
+    """
+    from sensors.models import SensorReading
+
+    fields = list(fields)
+    readings = SensorReading.objects.filter(timestamp__gte=start, timestamp__lt=end)
+    if sensor_ids is not None:
+        readings = readings.filter(sensor_id__in=sensor_ids)
+
+    single_sensor = sensor_ids is not None and len(sensor_ids) == 1
+    if single_sensor and readings[:MAX_RAW_POINTS + 1].count() <= MAX_RAW_POINTS:
+        x, ys = _raw_points(readings, fields)
+        result = {}
+        for field in fields:
+            present = ~np.isnan(ys[field])
+            result[field] = _downsample(x[present], ys[field][present], points, method, 'raw')
+        return result
+
+    source = choose_source_resolution(start, end)
+    rollup_rows = list(series(start, end, sensor_ids=sensor_ids, resolution=source))
+    tail_x, tail_ys = _raw_points(readings.filter(not_rolled_up()), fields)
+    result = {}
+    for field in fields:
+        buckets, count, total, low, high = _bucketed(rollup_rows, tail_x, tail_ys[field], field, source)
+        if method == 'minmax':
+            # Pick from each bucket's extremes rather than its mean
+            x = np.repeat(buckets, 2)
+            y = np.column_stack([low, high]).ravel()
+        else:
+            x, y = buckets, total / count
+        result[field] = _downsample(x, y, points, method, source)
+    return result
+
+
+def reading_series(field, start, end, sensor_ids=None, points=300, method='lttb'):
+    """
+    Downsample ``field`` over [start, end) to at most ``points`` points.
+
+    With several sensors each point is the mean across them within a
+    bucket. Returns {'source', 'timestamps' (epoch ms), 'values'}.
+    """
+    return reading_series_many(
+        [field], start, end, sensor_ids=sensor_ids, points=points, method=method,
+    )[field]
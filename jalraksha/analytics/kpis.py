@@ -0,0 +1,192 @@
+"""
+Cached dashboard KPIs.
+
+``KPIService`` computes each KPI group with a few combined queries and
+keeps the result in Django's cache for ``TTL`` seconds. Leak and alert
+writes bump a generation counter through signals once they commit,
+which makes every cached group stale at once. A group that is missing or stale is rebuilt
+by a single caller holding a ``cache.add`` lock. Concurrent callers keep
+serving the stale copy meanwhile, or wait briefly when there is none.
+
+Flow and usage groups cover a time window and are read from the
+rollups plus the raw tail. New readings do not bump the generation, so
+these groups trail ingest by at most ``TTL`` seconds.
+
+Any cache backend works. With the local-memory backend both the cache
+and the lock are per process. With a shared backend (file, Redis,
+Memcached) one worker recomputes for all of them.
+"""
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+KPI_SETTINGS = getattr(settings, 'ANALYTICS_KPI_CACHE', {})
+
+
+def compute_leak_kpis():
+    from alerts.models import Alert
+    from .models import ACTIVE_LEAKS, LeakDetection
+
+    # One grouped pass gives the per-severity, per-sensor and overall counts
+    by_severity = dict.fromkeys((severity for severity, _ in LeakDetection.SEVERITY_LEVELS), 0)
+    by_sensor = {}
+    for sensor, severity, count in (
+        LeakDetection.objects.values('sensor', 'severity').annotate(count=Count('id'))
+        .order_by().values_list('sensor', 'severity', 'count')
+    ):
+        by_severity[severity] = by_severity.get(severity, 0) + count
+        by_sensor[sensor] = by_sensor.get(sensor, 0) + count
+    # Filtered rather than a FILTER clause so it runs off leak_active_loss_idx
+    active = LeakDetection.objects.filter(ACTIVE_LEAKS).aggregate(
+        count=Count('id'), loss=Sum('estimated_loss_rate'),
+    )
+    return {
+        'total_leaks': sum(by_severity.values()),
+        'active_leaks': active['count'],
+        'total_loss': active['loss'] or 0,
+        'leaks_by_severity': [
+            {'severity': severity, 'count': count}
+            for severity, count in by_severity.items() if count
+        ],
+        'leaks_by_sensor': by_sensor,
+        'unresolved_alerts': Alert.objects.filter(is_resolved=False).count(),
+    }
+
+
+def compute_sensor_kpis():
+    from sensors import health
+    from sensors.models import SensorDevice
+
+    # One pass over the device table using the last-seen fields ingest maintains
+    offline = ~Q(is_active=True) | health.offline_q(health.offline_cutoff())
+    counts = SensorDevice.objects.aggregate(
+        active=Count('id', filter=~offline),
+        warning=Count('id', filter=health.low_battery_q()),
+        offline=Count('id', filter=offline),
+    )
+    return {
+        'active_sensors': counts['active'],
+        'warning_sensors': counts['warning'],
+        'offline_sensors': counts['offline'],
+    }
+
+
+def compute_flow_kpis(start, end):
+    from . import rollups, water_balance
+    from .models import ZoneBalance
+
+    summary = rollups.summarize(start, end)
+    total_flow = summary['total_flow'] or 0
+    balance = water_balance.balance_totals(ZoneBalance.objects.filter(
+        resolution='HOUR', bucket__gte=rollups.floor_to_resolution(start, 'HOUR'), bucket__lt=end,
+    ))
+    return {
+        'total_flow': total_flow,
+        'avg_pressure': summary['avg_pressure'] or 0,
+        'zone_inflow': balance['inflow'],
+        'nrw_volume': balance['nrw'],
+        'nrw_percentage': balance['nrw_percentage'],
+    }
+
+
+def compute_usage_kpis(start, end):
+    from . import rollups
+
+    return {
+        'consumption_by_hour': {
+            f'{hour:02d}:00': total for hour, total in rollups.hourly_profile(start, end).items()
+        },
+        'per_sensor': rollups.sensor_summaries(start, end),
+    }
+
+
+class KPIService:
+    def __init__(self, cache_alias='default', ttl=30, lock_timeout=10, wait=2.0):
+        self.cache_alias = cache_alias
+        self.ttl = ttl
+        # How long a recompute may hold the lock before another caller retries
+        self.lock_timeout = lock_timeout
+        # How long a caller with no stale copy waits for someone else's recompute
+        self.wait = wait
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def generation(self):
+        return self.cache.get('kpis:generation', 0)
+
+    def invalidate(self):
+        """Mark every cached KPI group stale once the current transaction commits"""
+        # Bumped any earlier, a concurrent recompute could still read the
+        # old rows and cache them under the new generation
+        transaction.on_commit(self._bump_generation)
+
+    def _bump_generation(self):
+        try:
+            self.cache.incr('kpis:generation')
+        except ValueError:
+            self.cache.set('kpis:generation', 1, timeout=None)
+
+    def get(self, name, compute, *args):
+        """Return the cached value of KPI group ``name``, recomputing it under a lock when stale"""
+        key = f'kpis:{name}'
+        generation = self.generation()
+        entry = self.cache.get(key)
+        if entry is not None and entry['generation'] == generation and entry['expires'] > time.time():
+            return entry['value']
+
+        lock_key = f'{key}:lock'
+        if self.cache.add(lock_key, True, timeout=self.lock_timeout):
+            try:
+                return self._refresh(key, generation, compute, args)
+            finally:
+                self.cache.delete(lock_key)
+
+        if entry is not None:
+            # Someone else is recomputing; a slightly stale value beats a pile-up
+            return entry['value']
+
+        deadline = time.monotonic() + self.wait
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            entry = self.cache.get(key)
+            if entry is not None and entry['generation'] == generation:
+                return entry['value']
+        return self._refresh(key, generation, compute, args)
+
+    def _refresh(self, key, generation, compute, args):
+        value = compute(*args)
+        # Kept well past its TTL so it can be served stale during a recompute
+        self.cache.set(key, {
+            'generation': generation,
+            'expires': time.time() + self.ttl,
+            'value': value,
+        }, timeout=self.ttl * 20)
+        return value
+
+    def leak_kpis(self):
+        return self.get('leaks', compute_leak_kpis)
+
+    def sensor_kpis(self):
+        return self.get('sensors', compute_sensor_kpis)
+
+    def flow_kpis(self, range_key, delta):
+        """Flow KPIs over the last ``delta``; ``range_key`` names the cached window"""
+        end = timezone.now()
+        return self.get(f'flow:{range_key}', compute_flow_kpis, end - delta, end)
+
+    def usage_kpis(self, range_key, delta):
+        """Hour-of-day consumption and per-sensor figures over the last ``delta``"""
+        end = timezone.now()
+        return self.get(f'usage:{range_key}', compute_usage_kpis, end - delta, end)
+
+
+kpi_service = KPIService(
+    cache_alias=KPI_SETTINGS.get('CACHE_ALIAS', 'default'),
+    ttl=KPI_SETTINGS.get('TTL', 30),
+    lock_timeout=KPI_SETTINGS.get('LOCK_TIMEOUT', 10),
+)
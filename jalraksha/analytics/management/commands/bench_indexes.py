@@ -0,0 +1,198 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+from sensors.models import SensorDevice
+from analytics.models import ACTIVE_LEAK_STATUSES, ACTIVE_LEAKS, LeakDetection
+from alerts.models import Alert
+from datetime import timedelta
+import random
+import statistics
+import time
+
+# model -> names of the indexes under test
+BENCH_INDEXES = {
+    Alert: ['alert_open_created_idx', 'alert_unread_created_idx'],
+    LeakDetection: ['leak_active_detected_idx', 'leak_active_loss_idx'],
+}
+
+# (label, callable running the query the way the views do)
+BENCH_QUERIES = [
+    ('open alerts page', lambda: list(Alert.objects.filter(is_resolved=False)[:50])),
+    ('unread alert count', lambda: Alert.objects.filter(is_read=False).count()),
+    ('unresolved alert count', lambda: Alert.objects.filter(is_resolved=False).count()),
+    ('active leaks page', lambda: list(LeakDetection.objects.filter(ACTIVE_LEAKS)[:10])),
+    ('active leak loss', lambda: LeakDetection.objects.filter(ACTIVE_LEAKS).aggregate(
+        total=Sum('estimated_loss_rate'))),
+]
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Seed alerts and leaks, then show plans and timings of the hot dashboard queries with and without their indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--alerts', type=int, default=1000000, help='Alerts to seed')
+        parser.add_argument('--leaks', type=int, default=1000000, help='Leak detections to seed')
+        parser.add_argument('--sensors', type=int, default=200, help='Sensors to spread the seeded rows over')
+        parser.add_argument(
+            '--open-fraction',
+            type=float,
+            default=0.02,
+            help='Share of seeded alerts left unresolved/unread and of leaks left active'
+        )
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per query (the median is reported)')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Rows per seeding insert')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for reproducible runs')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--repeat and --batch-size must be at least 1')
+        self.rng = random.Random(options['seed'])
+        self.options = options
+
+        # Everything runs in one transaction that is rolled back, so the
+        # seeded rows and the dropped/recreated indexes never persist
+        try:
+            with transaction.atomic():
+                self.seed()
+                results = {}
+                self.drop_indexes()
+                results['before'] = self.run_queries('without indexes')
+                self.create_indexes()
+                results['after'] = self.run_queries('with indexes')
+                self.report(results)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self):
+        options = self.options
+        now = timezone.now()
+        SensorDevice.objects.bulk_create([
+            SensorDevice(
+                device_id=f'BENCH-{i:05d}',
+                sensor_type='FLOW',
+                deployment_type='MUNICIPAL',
+                location=f'Benchmark main {i}',
+            )
+            for i in range(options['sensors'])
+        ])
+        sensors = list(SensorDevice.objects.filter(device_id__startswith='BENCH-'))
+        open_fraction = options['open_fraction']
+        closed_statuses = ['REPAIRED', 'FALSE_ALARM']
+        severities = [severity for severity, _ in LeakDetection.SEVERITY_LEVELS]
+        priorities = [priority for priority, _ in Alert.PRIORITY_LEVELS]
+
+        def timestamp():
+            return now - timedelta(seconds=self.rng.uniform(0, 365 * 86400))
+
+        def leak(_):
+            active = self.rng.random() < open_fraction
+            return LeakDetection(
+                sensor=self.rng.choice(sensors),
+                detected_at=timestamp(),
+                severity=self.rng.choice(severities),
+                status=self.rng.choice(ACTIVE_LEAK_STATUSES if active else closed_statuses),
+                estimated_loss_rate=self.rng.uniform(10, 500),
+                confidence_score=self.rng.random(),
+            )
+
+        def alert(_):
+            return Alert(
+                alert_type='LEAK',
+                priority=self.rng.choice(priorities),
+                sensor=self.rng.choice(sensors),
+                message='Benchmark alert',
+                created_at=timestamp(),
+                is_read=self.rng.random() >= open_fraction,
+                is_resolved=self.rng.random() >= open_fraction,
+            )
+
+        self.bulk_seed(LeakDetection, 'detected_at', leak, options['leaks'])
+        self.bulk_seed(Alert, 'created_at', alert, options['alerts'])
+        self.analyze()
+
+    def bulk_seed(self, model, timestamp_field, build, count):
+        # auto_now_add would stamp every seeded row with the same time
+        field = model._meta.get_field(timestamp_field)
+        field.auto_now_add = False
+        started = time.perf_counter()
+        try:
+            for offset in range(0, count, self.options['batch_size']):
+                size = min(self.options['batch_size'], count - offset)
+                model.objects.bulk_create([build(i) for i in range(size)])
+        finally:
+            field.auto_now_add = True
+        self.stdout.write(
+            f'Seeded {count} {model._meta.verbose_name_plural} in {time.perf_counter() - started:.1f}s'
+        )
+
+    def analyze(self):
+        with connection.cursor() as cursor:
+            for model in BENCH_INDEXES:
+                cursor.execute(f'ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
+
+    def existing_indexes(self, model):
+        with connection.cursor() as cursor:
+            return set(connection.introspection.get_constraints(cursor, model._meta.db_table))
+
+    def bench_indexes(self, model):
+        return [index for index in model._meta.indexes if index.name in BENCH_INDEXES[model]]
+
+    def drop_indexes(self):
+        with connection.cursor() as cursor:
+            for model in BENCH_INDEXES:
+                existing = self.existing_indexes(model)
+                for index in self.bench_indexes(model):
+                    if index.name in existing:
+                        cursor.execute(f'DROP INDEX {connection.ops.quote_name(index.name)}')
+        self.analyze()
+
+    def create_indexes(self):
+        # The schema editor only renders the SQL; on SQLite it cannot be
+        # entered inside a transaction
+        editor = connection.schema_editor(atomic=False)
+        with connection.cursor() as cursor:
+            for model in BENCH_INDEXES:
+                for index in self.bench_indexes(model):
+                    cursor.execute(str(index.create_sql(model, editor)))
+        self.analyze()
+
+    def run_queries(self, title):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'\n{title}'))
+        timings = {}
+        for label, run in BENCH_QUERIES:
+            statements = []
+
+            def record(execute, sql, params, many, context):
+                statements.append((sql, params))
+                return execute(sql, params, many, context)
+
+            with connection.execute_wrapper(record):
+                run()  # also warms the page cache
+            samples = []
+            for _ in range(self.options['repeat']):
+                started = time.perf_counter()
+                run()
+                samples.append((time.perf_counter() - started) * 1000)
+            timings[label] = statistics.median(samples)
+
+            self.stdout.write(f'{label}: {timings[label]:.2f} ms')
+            sql, params = statements[-1]
+            with connection.cursor() as cursor:
+                cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+                for row in cursor.fetchall():
+                    self.stdout.write(f'    {row[-1]}')
+        return timings
+
+    def report(self, results):
+        self.stdout.write(self.style.MIGRATE_HEADING('\nSummary (median ms)'))
+        self.stdout.write(f'{"query":<24} {"before":>10} {"after":>10}')
+        for label, _ in BENCH_QUERIES:
+            before, after = results['before'][label], results['after'][label]
+            speedup = before / after if after else float('inf')
+            self.stdout.write(f'{label:<24} {before:>10.2f} {after:>10.2f}   x{speedup:.1f}')
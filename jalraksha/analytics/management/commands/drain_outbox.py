@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+from analytics.models import ReadingOutbox
+from analytics.outbox import reading_outbox
+import signal
+
+
+class Command(BaseCommand):
+    help = 'Score ingested readings from the reading outbox, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain what is queued now, then exit')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Reading ids per scoring call (default: READING_OUTBOX BATCH_SIZE)'
+        )
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to sleep when the outbox is empty')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] is not None:
+            if options['batch_size'] < 1:
+                raise CommandError('--batch-size must be at least 1')
+            reading_outbox.batch_size = options['batch_size']
+
+        if options['once']:
+            handled = reading_outbox.drain()
+            self.stdout.write(self.style.SUCCESS(f'Drained {handled} readings.'))
+            self.report_failed()
+            return
+
+        # Stop cleanly on SIGTERM; an interrupted batch is rolled back or its lease expires
+        signal.signal(signal.SIGTERM, self.interrupt)
+        self.stdout.write(self.style.SUCCESS(
+            f'Draining the reading outbox in batches of {reading_outbox.batch_size}'
+        ))
+        try:
+            reading_outbox.run(interval=options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write('\nDrainer stopped.')
+        self.report_failed()
+
+    def interrupt(self, signum, frame):
+        raise KeyboardInterrupt
+
+    def report_failed(self):
+        failed = ReadingOutbox.objects.filter(failed_at__isnull=False).count()
+        if failed:
+            self.stdout.write(self.style.WARNING(
+                f'{failed} readings are set aside after repeated failures (see the admin)'
+            ))
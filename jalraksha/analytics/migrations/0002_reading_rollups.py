@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0001_initial'),
+        ('sensors', '0003_reading_device_ts_seq'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_reading_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ReadingRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('MINUTE', '1 minute'), ('HOUR', '1 hour'), ('DAY', '1 day')], max_length=10)),
+                ('bucket', models.DateTimeField(help_text='Bucket start (UTC)')),
+                ('count', models.IntegerField(default=0)),
+                ('flow_count', models.IntegerField(default=0)),
+                ('flow_sum', models.FloatField(default=0.0)),
+                ('flow_sumsq', models.FloatField(default=0.0)),
+                ('flow_min', models.FloatField(blank=True, null=True)),
+                ('flow_max', models.FloatField(blank=True, null=True)),
+                ('pressure_count', models.IntegerField(default=0)),
+                ('pressure_sum', models.FloatField(default=0.0)),
+                ('pressure_sumsq', models.FloatField(default=0.0)),
+                ('pressure_min', models.FloatField(blank=True, null=True)),
+                ('pressure_max', models.FloatField(blank=True, null=True)),
+                ('temperature_count', models.IntegerField(default=0)),
+                ('temperature_sum', models.FloatField(default=0.0)),
+                ('temperature_sumsq', models.FloatField(default=0.0)),
+                ('temperature_min', models.FloatField(blank=True, null=True)),
+                ('temperature_max', models.FloatField(blank=True, null=True)),
+                ('battery_min', models.IntegerField(blank=True, null=True)),
+                ('sensor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='sensors.sensordevice')),
+            ],
+            options={
+                'ordering': ['-bucket'],
+                'indexes': [models.Index(fields=['resolution', 'bucket'], name='analytics_r_resolut_5973dd_idx')],
+                'unique_together': {('sensor', 'resolution', 'bucket')},
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0002_reading_rollups'),
+        ('sensors', '0004_reading_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='leakdetection',
+            index=models.Index(condition=models.Q(('status', 'DETECTED'), ('status', 'INVESTIGATING'), ('status', 'CONFIRMED'), _connector='OR'), fields=['-detected_at'], name='leak_active_detected_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='leakdetection',
+            index=models.Index(condition=models.Q(('status', 'DETECTED'), ('status', 'INVESTIGATING'), ('status', 'CONFIRMED'), _connector='OR'), fields=['status', 'estimated_loss_rate'], name='leak_active_loss_idx'),
+        ),
+    ]
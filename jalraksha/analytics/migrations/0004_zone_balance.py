@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0003_active_leak_indexes'),
+        ('sensors', '0005_device_last_seen'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ZoneBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('HOUR', '1 hour'), ('DAY', '1 day')], max_length=10)),
+                ('bucket', models.DateTimeField(help_text='Bucket start (UTC)')),
+                ('inflow_volume', models.FloatField(default=0.0, help_text='Liters metered into the zone')),
+                ('outflow_volume', models.FloatField(default=0.0, help_text='Liters metered at consumers')),
+                ('leak_loss_volume', models.FloatField(default=0.0, help_text='Liters lost to detected leaks')),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('zone', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balances', to='sensors.waterconsumptionzone')),
+            ],
+            options={
+                'ordering': ['-bucket'],
+                'indexes': [models.Index(fields=['resolution', 'bucket'], name='analytics_z_resolut_d8c673_idx')],
+                'unique_together': {('zone', 'resolution', 'bucket')},
+            },
+        ),
+    ]
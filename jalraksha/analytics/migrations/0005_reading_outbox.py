@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0004_zone_balance'),
+        ('sensors', '0005_device_last_seen'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReadingOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('claim_token', models.UUIDField(blank=True, null=True)),
+                ('claimed_until', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.IntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('failed_at', models.DateTimeField(blank=True, null=True)),
+                ('reading', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='sensors.sensorreading')),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['claim_token'], name='outbox_claim_token_idx')],
+            },
+        ),
+    ]
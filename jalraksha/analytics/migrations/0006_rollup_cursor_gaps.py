@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0005_reading_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rollupcursor',
+            name='pending_gaps',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
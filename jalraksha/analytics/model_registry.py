@@ -0,0 +1,174 @@
+"""
+Persisted IsolationForest models, one per sensor with a per-deployment-type
+fallback for sensors that do not have enough history yet.
+
+Models are trained by the ``train_*`` Celery tasks, written to
+``ANALYTICS_MODEL_DIR`` with joblib and loaded memory-mapped into a small
+LRU inside each worker. Scoring never trains: a reading for a sensor with
+no model on disk is simply not scored until the next training run.
+"""
+import os
+import threading
+from collections import OrderedDict
+import joblib
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from .ai_models import LeakDetectionAI, MIN_TRAINING_ROWS, training_readings
+
+REGISTRY_SETTINGS = getattr(settings, 'ANALYTICS_MODEL_REGISTRY', {})
+
+# Cap on rows used to fit a pooled deployment-type model
+MAX_POOLED_ROWS = 100000
+
+
+def sensor_key(sensor_id):
+    return f'sensor-{sensor_id}'
+
+
+def deployment_key(deployment_type):
+    return f'deployment-{deployment_type}'
+
+
+class ModelRegistry:
+    """Per-worker LRU of trained LeakDetectionAI instances backed by joblib files"""
+
+    def __init__(self, directory, max_size=256, drift_z=3.0, drift_alpha=0.05):
+        self.directory = str(directory)
+        self.max_size = max_size
+        # Drift fires when the EWMA of live scores leaves the training
+        # score distribution by more than drift_z standard deviations
+        self.drift_z = drift_z
+        self.drift_alpha = drift_alpha
+        self._models = OrderedDict()
+        self._ewma = {}
+        self._lock = threading.Lock()
+
+    def path(self, key):
+        return os.path.join(self.directory, f'{key}.joblib')
+
+    def _load(self, key):
+        """Return the model for key, reloading it when the file changed on disk"""
+        path = self.path(key)
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            with self._lock:
+                self._models.pop(key, None)
+            return None
+
+        with self._lock:
+            cached = self._models.get(key)
+            if cached is not None and cached[1] == mtime:
+                self._models.move_to_end(key)
+                return cached[0]
+
+        payload = joblib.load(path, mmap_mode='r')
+        ai = LeakDetectionAI(
+            model=payload['model'],
+            score_mean=payload['score_mean'],
+            score_std=payload['score_std'],
+        )
+        with self._lock:
+            self._models[key] = (ai, mtime)
+            self._models.move_to_end(key)
+            self._ewma.pop(key, None)
+            while len(self._models) > self.max_size:
+                self._models.popitem(last=False)
+        return ai
+
+    def get(self, sensor):
+        """Return (key, ai) for the best model available for ``sensor``, or (None, None)"""
+        for key in (sensor_key(sensor.id), deployment_key(sensor.deployment_type)):
+            ai = self._load(key)
+            if ai is not None:
+                return key, ai
+        return None, None
+
+    def warm(self):
+        """Memory-map the most recently trained models into the LRU"""
+        if not os.path.isdir(self.directory):
+            return 0
+        files = [
+            entry for entry in os.scandir(self.directory)
+            if entry.name.endswith('.joblib')
+        ]
+        files.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+        for entry in files[:self.max_size]:
+            self._load(entry.name[:-len('.joblib')])
+        return len(self._models)
+
+    def save(self, key, ai, n_samples):
+        """Atomically write a trained model so other workers pick it up"""
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f'{self.path(key)}.{os.getpid()}.tmp'
+        joblib.dump({
+            'model': ai.model,
+            'score_mean': ai.score_mean,
+            'score_std': ai.score_std,
+            'n_samples': n_samples,
+            'trained_at': timezone.now().isoformat(),
+        }, tmp_path)
+        os.replace(tmp_path, self.path(key))
+
+    def train_sensor(self, sensor):
+        """Fit and persist a per-sensor model. Returns False if history is too short."""
+        X = np.array(training_readings(sensor.readings.all()), dtype=np.float64)
+        if len(X) < MIN_TRAINING_ROWS:
+            return False
+        ai = LeakDetectionAI()
+        ai.fit(X)
+        self.save(sensor_key(sensor.id), ai, len(X))
+        return True
+
+    def train_deployment(self, deployment_type):
+        """Fit and persist the pooled fallback model for a deployment type"""
+        from sensors.models import SensorReading
+
+        readings = training_readings(
+            SensorReading.objects.filter(sensor__deployment_type=deployment_type, sensor__is_active=True)
+        ).order_by('-timestamp')[:MAX_POOLED_ROWS]
+        X = np.array(readings, dtype=np.float64)
+        if len(X) < MIN_TRAINING_ROWS:
+            return False
+        ai = LeakDetectionAI()
+        ai.fit(X)
+        self.save(deployment_key(deployment_type), ai, len(X))
+        return True
+
+    def observe(self, key, scores):
+        """
+        Track live scores for a model and report drift.
+
+        Returns True (once per model load) when the exponentially weighted
+        mean of the scores drifts away from the training distribution.
+        """
+        with self._lock:
+            cached = self._models.get(key)
+            if cached is None:
+                return False
+            ai = cached[0]
+            if not ai.score_std:
+                return False
+            ewma, flagged = self._ewma.get(key, (ai.score_mean, False))
+            for score in np.atleast_1d(scores):
+                ewma += self.drift_alpha * (float(score) - ewma)
+            drifted = abs(ewma - ai.score_mean) > self.drift_z * ai.score_std
+            self._ewma[key] = (ewma, flagged or drifted)
+            return drifted and not flagged
+
+    def stats(self):
+        with self._lock:
+            return {
+                'loaded': len(self._models),
+                'max_size': self.max_size,
+                'directory': self.directory,
+            }
+
+
+model_registry = ModelRegistry(
+    directory=getattr(settings, 'ANALYTICS_MODEL_DIR', os.path.join(settings.BASE_DIR, 'ml_models')),
+    max_size=REGISTRY_SETTINGS.get('LRU_SIZE', 256),
+    drift_z=REGISTRY_SETTINGS.get('DRIFT_Z', 3.0),
+    drift_alpha=REGISTRY_SETTINGS.get('DRIFT_ALPHA', 0.05),
+)
@@ -1,5 +1,14 @@
+from functools import reduce
+import operator
 from django.db import models
-from sensors.models import SensorDevice
+from sensors.models import SensorDevice, SensorReading
+
+# Leaks that still need attention; the dashboards total their loss
+ACTIVE_LEAK_STATUSES = ['DETECTED', 'INVESTIGATING', 'CONFIRMED']
+# Filter for active leaks. ORed equalities rather than status__in: SQLite
+# matches bound parameters against a partial index condition term by term
+# but not inside IN lists, so status__in would never use the indexes below.
+ACTIVE_LEAKS = reduce(operator.or_, (models.Q(status=status) for status in ACTIVE_LEAK_STATUSES))
 
 class LeakDetection(models.Model):
     SEVERITY_LEVELS = [
@@ -27,6 +36,18 @@ class LeakDetection(models.Model):
     
     class Meta:
         ordering = ['-detected_at']
+        indexes = [
+            # Partial: most leaks end up repaired or false alarms
+            models.Index(
+                fields=['-detected_at'], name='leak_active_detected_idx',
+                condition=ACTIVE_LEAKS,
+            ),
+            # Covers the active loss total without touching the table
+            models.Index(
+                fields=['status', 'estimated_loss_rate'], name='leak_active_loss_idx',
+                condition=ACTIVE_LEAKS,
+            ),
+        ]
     
     def __str__(self):
         return f"Leak {self.id} - {self.sensor.location} ({self.severity})"
@@ -44,4 +65,112 @@ class ConsumptionPattern(models.Model):
         ordering = ['-date']
     
     def __str__(self):
-        return f"{self.sensor.device_id} - {self.date}"
\ No newline at end of file
+        return f"{self.sensor.device_id} - {self.date}"
+
+class ReadingRollup(models.Model):
+    """Per-sensor SensorReading aggregates for one time bucket"""
+    RESOLUTIONS = [
+        ('MINUTE', '1 minute'),
+        ('HOUR', '1 hour'),
+        ('DAY', '1 day'),
+    ]
+    
+    sensor = models.ForeignKey(SensorDevice, on_delete=models.CASCADE, related_name='rollups')
+    resolution = models.CharField(max_length=10, choices=RESOLUTIONS)
+    bucket = models.DateTimeField(help_text='Bucket start (UTC)')
+    count = models.IntegerField(default=0)
+    flow_count = models.IntegerField(default=0)
+    flow_sum = models.FloatField(default=0.0)
+    flow_sumsq = models.FloatField(default=0.0)
+    flow_min = models.FloatField(null=True, blank=True)
+    flow_max = models.FloatField(null=True, blank=True)
+    pressure_count = models.IntegerField(default=0)
+    pressure_sum = models.FloatField(default=0.0)
+    pressure_sumsq = models.FloatField(default=0.0)
+    pressure_min = models.FloatField(null=True, blank=True)
+    pressure_max = models.FloatField(null=True, blank=True)
+    temperature_count = models.IntegerField(default=0)
+    temperature_sum = models.FloatField(default=0.0)
+    temperature_sumsq = models.FloatField(default=0.0)
+    temperature_min = models.FloatField(null=True, blank=True)
+    temperature_max = models.FloatField(null=True, blank=True)
+    battery_min = models.IntegerField(null=True, blank=True)
+    
+    class Meta:
+        unique_together = ['sensor', 'resolution', 'bucket']
+        ordering = ['-bucket']
+        indexes = [
+            models.Index(fields=['resolution', 'bucket']),
+        ]
+    
+    def __str__(self):
+        return f"{self.sensor.device_id} - {self.resolution} {self.bucket}"
+
+class RollupCursor(models.Model):
+    """High-water mark of SensorReading ids already folded into the rollups"""
+    name = models.CharField(max_length=50, unique=True)
+    last_reading_id = models.BigIntegerField(default=0)
+    # [first id, last id, epoch seconds first seen] ranges under the mark
+    # whose readings had not committed yet when it moved past them
+    pending_gaps = models.JSONField(default=list, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.name} @ {self.last_reading_id}"
+
+class ZoneBalance(models.Model):
+    """Water balance of one zone over one time bucket, in liters"""
+    RESOLUTIONS = [
+        ('HOUR', '1 hour'),
+        ('DAY', '1 day'),
+    ]
+    
+    zone = models.ForeignKey('sensors.WaterConsumptionZone', on_delete=models.CASCADE, related_name='balances')
+    resolution = models.CharField(max_length=10, choices=RESOLUTIONS)
+    bucket = models.DateTimeField(help_text='Bucket start (UTC)')
+    inflow_volume = models.FloatField(default=0.0, help_text='Liters metered into the zone')
+    outflow_volume = models.FloatField(default=0.0, help_text='Liters metered at consumers')
+    leak_loss_volume = models.FloatField(default=0.0, help_text='Liters lost to detected leaks')
+    computed_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ['zone', 'resolution', 'bucket']
+        ordering = ['-bucket']
+        indexes = [
+            models.Index(fields=['resolution', 'bucket']),
+        ]
+    
+    @property
+    def nrw_volume(self):
+        """Non-revenue water: supplied but not delivered to a consumer meter"""
+        return max(self.inflow_volume - self.outflow_volume, 0.0)
+    
+    @property
+    def nrw_percentage(self):
+        if not self.inflow_volume:
+            return None
+        return self.nrw_volume / self.inflow_volume * 100
+    
+    def __str__(self):
+        return f"{self.zone.name} - {self.resolution} {self.bucket}"
+
+class ReadingOutbox(models.Model):
+    """A stored reading waiting for analysis, written in the ingest transaction"""
+    reading = models.ForeignKey(SensorReading, on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Lease taken by a drainer on databases without SKIP LOCKED
+    claim_token = models.UUIDField(null=True, blank=True)
+    claimed_until = models.DateTimeField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    # Set once MAX_ATTEMPTS batches have failed; such rows are no longer claimed
+    failed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['claim_token'], name='outbox_claim_token_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Outbox {self.id} - reading {self.reading_id}"
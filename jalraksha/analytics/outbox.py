@@ -0,0 +1,169 @@
+"""
+Transactional outbox between ingest and anomaly scoring.
+
+``store_readings`` calls ``reading_outbox.enqueue`` inside its own
+transaction, so a reading is stored together with its outbox row or not
+at all, and ingest never waits on analytics. Drainers (the
+``drain_outbox`` command or the ``drain_reading_outbox`` task) claim rows
+in id order, fold new readings into the continuous-flow state
+(``analytics.streaming``), pass each batch of reading ids to
+``score_readings`` and delete the rows once it has committed.
+
+On PostgreSQL a batch is claimed with ``SELECT ... FOR UPDATE SKIP
+LOCKED`` and scored in the same transaction, so parallel drainers take
+disjoint batches and a crashed drainer's batch is released by its
+rollback. Databases without SKIP LOCKED (SQLite) claim a batch by
+stamping it with a lease in one UPDATE; a crashed drainer's lease
+expires after ``LEASE`` seconds and the batch is claimed again.
+
+A batch whose scoring raises is split in half and each half retried,
+down to the single readings that fail, so one bad reading does not hold
+back the rest of its batch. A failing reading is left in the outbox with
+the error and is not claimed again for ``RETRY_DELAY`` seconds, doubled
+on each further failure; after ``MAX_ATTEMPTS`` failures it is set
+aside with ``failed_at``. With ``MODE = 'inline'`` every committed batch is drained
+in-process right away, which needs no worker or broker (tests, local
+development). ``MODE = 'off'`` writes no outbox rows.
+"""
+import time
+import traceback
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+OUTBOX_SETTINGS = getattr(settings, 'READING_OUTBOX', {})
+
+
+class ReadingOutboxDrainer:
+    def __init__(self, mode='worker', batch_size=500, lease=60, max_attempts=5, retry_delay=30):
+        self.mode = mode
+        self.batch_size = batch_size
+        self.lease = timedelta(seconds=lease)
+        self.max_attempts = max_attempts
+        # Backoff before a failed reading's first retry; doubles per attempt
+        self.retry_delay = timedelta(seconds=retry_delay)
+
+    def handle(self, reading_ids):
+        from .scoring import score_readings
+
+        return score_readings(reading_ids)
+
+    def observe(self, reading_ids):
+        """Fold readings into the continuous-flow state ahead of scoring them"""
+        from sensors.models import SensorReading
+        from .streaming import flow_detector
+
+        if reading_ids:
+            flow_detector.update(
+                SensorReading.objects.filter(id__in=reading_ids).values_list('sensor_id', 'timestamp', 'flow_rate')
+            )
+
+    def enqueue(self, reading_ids):
+        """Queue readings for analysis; call inside the transaction that stores them"""
+        from .models import ReadingOutbox
+
+        if self.mode == 'off' or not reading_ids:
+            return
+        ReadingOutbox.objects.bulk_create([ReadingOutbox(reading_id=pk) for pk in reading_ids])
+        if self.mode == 'inline':
+            transaction.on_commit(self.drain)
+
+    def drain(self, max_batches=None):
+        """Process batches until the outbox is empty (or ``max_batches``); returns rows handled"""
+        handled = batches = 0
+        while max_batches is None or batches < max_batches:
+            count = self.drain_batch()
+            handled += count
+            batches += 1
+            if count < self.batch_size:
+                break
+        return handled
+
+    def drain_batch(self):
+        """Claim and process one batch; returns how many rows it held"""
+        if connection.features.has_select_for_update_skip_locked:
+            with transaction.atomic():
+                rows = list(
+                    self._claimable().select_for_update(skip_locked=True)
+                    .values_list('id', 'reading_id', 'attempts')[:self.batch_size]
+                )
+                self._claimed(rows)
+            return len(rows)
+
+        from .models import ReadingOutbox
+
+        # One UPDATE both selects and stamps the batch, so two drainers
+        # can never lease the same rows
+        token = uuid.uuid4()
+        ReadingOutbox.objects.filter(
+            id__in=self._claimable().values('id')[:self.batch_size]
+        ).update(claim_token=token, claimed_until=timezone.now() + self.lease)
+        rows = list(
+            ReadingOutbox.objects.filter(claim_token=token).values_list('id', 'reading_id', 'attempts')
+        )
+        with transaction.atomic():
+            self._claimed(rows)
+        return len(rows)
+
+    def _claimed(self, rows):
+        # Retried rows were folded into the flow state on their first attempt
+        self.observe([reading_id for _, reading_id, attempts in rows if not attempts])
+        self._process([(outbox_id, reading_id) for outbox_id, reading_id, _ in rows])
+
+    def _claimable(self):
+        from .models import ReadingOutbox
+
+        return ReadingOutbox.objects.filter(
+            Q(claimed_until__isnull=True) | Q(claimed_until__lt=timezone.now()),
+            failed_at__isnull=True,
+        ).order_by('id')
+
+    def _process(self, rows):
+        from .models import ReadingOutbox
+
+        if not rows:
+            return
+        outbox_ids = [outbox_id for outbox_id, _ in rows]
+        try:
+            # A savepoint, so a failed batch rolls back its own writes only
+            with transaction.atomic():
+                self.handle([reading_id for _, reading_id in rows])
+        except Exception:
+            if len(rows) > 1:
+                # Bisect down to the readings that fail
+                middle = len(rows) // 2
+                self._process(rows[:middle])
+                self._process(rows[middle:])
+                return
+            entry = ReadingOutbox.objects.filter(id__in=outbox_ids)
+            attempts = entry.values_list('attempts', flat=True).get() + 1
+            now = timezone.now()
+            # Not claimable again until the backoff runs out, so the
+            # drain loop that just failed it does not retry it at once
+            entry.update(
+                attempts=attempts,
+                last_error=traceback.format_exc(limit=5),
+                claim_token=None,
+                claimed_until=now + self.retry_delay * 2 ** (attempts - 1),
+                failed_at=now if attempts >= self.max_attempts else None,
+            )
+        else:
+            ReadingOutbox.objects.filter(id__in=outbox_ids).delete()
+
+    def run(self, interval=1.0):
+        """Drain forever, sleeping ``interval`` seconds whenever the outbox is empty"""
+        while True:
+            if not self.drain():
+                time.sleep(interval)
+
+
+reading_outbox = ReadingOutboxDrainer(
+    mode=OUTBOX_SETTINGS.get('MODE', 'worker'),
+    batch_size=OUTBOX_SETTINGS.get('BATCH_SIZE', 500),
+    lease=OUTBOX_SETTINGS.get('LEASE', 60),
+    max_attempts=OUTBOX_SETTINGS.get('MAX_ATTEMPTS', 5),
+    retry_delay=OUTBOX_SETTINGS.get('RETRY_DELAY', 30),
+)
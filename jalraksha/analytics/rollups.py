@@ -0,0 +1,470 @@
+"""
+Time-bucketed SensorReading rollups.
+
+New readings are folded into per-sensor MINUTE/HOUR/DAY buckets by
+``process_new_readings``, which walks SensorReading ids past a stored
+high-water mark so every reading is counted exactly once. Ids commit out
+of order under concurrent ingest, so ids the mark skips are kept as
+pending gaps and folded in when their readings show up; a gap that is
+still empty after ``GAP_TTL`` seconds belonged to a rolled-back or
+conflicting insert and is dropped. With ``MAX_GAPS`` gaps open the mark
+stops advancing until some close, rather than forget any. Query helpers
+read the rollups at the coarsest resolution that still gives enough
+buckets for the requested range, plus the small raw tail of readings
+that has not been rolled up yet (past the mark or in a gap).
+"""
+import logging
+import math
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from functools import reduce
+from operator import or_
+import pandas as pd
+from django.db import transaction
+from django.db.models import F, Q, Sum, Min, Max, Count
+from django.db.models.functions import ExtractHour
+from django.utils import timezone
+from .models import ReadingRollup, RollupCursor, ConsumptionPattern
+
+logger = logging.getLogger(__name__)
+
+CURSOR_NAME = 'readings'
+
+# Longest an ingest transaction may stay open; skipped ids are watched this long
+GAP_TTL = 600
+# Open gaps per cursor (each is an OR in the tail query). With this many
+# open, the high-water mark waits below the next gap until some close.
+MAX_GAPS = 200
+
+READING_COLUMNS = ('id', 'sensor_id', 'timestamp', 'flow_rate', 'pressure', 'temperature', 'battery_level')
+
+RESOLUTION_SECONDS = {
+    'MINUTE': 60,
+    'HOUR': 3600,
+    'DAY': 86400,
+}
+PANDAS_FREQ = {
+    'MINUTE': 'min',
+    'HOUR': 'h',
+    'DAY': 'D',
+}
+
+# Pick the coarsest resolution that still yields this many buckets
+MIN_BUCKETS = 24
+
+# (rollup prefix, SensorReading field)
+METRICS = [
+    ('flow', 'flow_rate'),
+    ('pressure', 'pressure'),
+    ('temperature', 'temperature'),
+]
+
+# A day counts as continuous flow when every covered hour stayed above this
+CONTINUOUS_FLOW_MIN_LPM = 0.5
+CONTINUOUS_FLOW_MIN_HOURS = 20
+
+
+def choose_resolution(start, end):
+    """Coarsest resolution giving at least MIN_BUCKETS buckets over [start, end)"""
+    span = (end - start).total_seconds()
+    for resolution in ('DAY', 'HOUR'):
+        if span / RESOLUTION_SECONDS[resolution] >= MIN_BUCKETS:
+            return resolution
+    return 'MINUTE'
+
+
+def floor_to_resolution(value, resolution):
+    seconds = RESOLUTION_SECONDS[resolution]
+    return datetime.fromtimestamp(int(value.timestamp()) // seconds * seconds, tz=dt_timezone.utc)
+
+
+def _none_if_nan(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return value
+
+
+def _aggregate_frame(df, resolution):
+    """Group a readings frame into (sensor_id, bucket) aggregates"""
+    frame = df.assign(bucket=df['timestamp'].dt.floor(PANDAS_FREQ[resolution]))
+    spec = {'count': ('id', 'size'), 'battery_min': ('battery_level', 'min')}
+    for prefix, field in METRICS:
+        spec[f'{prefix}_count'] = (field, 'count')
+        spec[f'{prefix}_sum'] = (field, 'sum')
+        spec[f'{prefix}_sumsq'] = (f'{field}_sq', 'sum')
+        spec[f'{prefix}_min'] = (field, 'min')
+        spec[f'{prefix}_max'] = (field, 'max')
+    return frame.groupby(['sensor_id', 'bucket']).agg(**spec)
+
+
+def _merge(rollup, row):
+    """Fold one aggregate row into an existing ReadingRollup"""
+    rollup.count += int(row['count'])
+    for prefix, _ in METRICS:
+        count = int(row[f'{prefix}_count'])
+        if not count:
+            continue
+        setattr(rollup, f'{prefix}_count', getattr(rollup, f'{prefix}_count') + count)
+        setattr(rollup, f'{prefix}_sum', getattr(rollup, f'{prefix}_sum') + float(row[f'{prefix}_sum']))
+        setattr(rollup, f'{prefix}_sumsq', getattr(rollup, f'{prefix}_sumsq') + float(row[f'{prefix}_sumsq']))
+        current_min = getattr(rollup, f'{prefix}_min')
+        current_max = getattr(rollup, f'{prefix}_max')
+        new_min = float(row[f'{prefix}_min'])
+        new_max = float(row[f'{prefix}_max'])
+        setattr(rollup, f'{prefix}_min', new_min if current_min is None else min(current_min, new_min))
+        setattr(rollup, f'{prefix}_max', new_max if current_max is None else max(current_max, new_max))
+    battery = _none_if_nan(row['battery_min'])
+    if battery is not None:
+        battery = int(battery)
+        rollup.battery_min = battery if rollup.battery_min is None else min(rollup.battery_min, battery)
+
+
+MERGE_FIELDS = ['count', 'battery_min'] + [
+    f'{prefix}_{part}'
+    for prefix, _ in METRICS
+    for part in ('count', 'sum', 'sumsq', 'min', 'max')
+]
+
+
+def apply_rows(rows):
+    """
+    Fold raw reading rows into the rollup tables.
+
+    ``rows`` are (id, sensor_id, timestamp, flow_rate, pressure,
+    temperature, battery_level) tuples. Each resolution costs one SELECT
+    for the touched buckets, one bulk_update and one bulk_create.
+    """
+    if not rows:
+        return
+    df = pd.DataFrame(rows, columns=[
+        'id', 'sensor_id', 'timestamp', 'flow_rate', 'pressure', 'temperature', 'battery_level'
+    ])
+    df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
+    for _, field in METRICS:
+        df[field] = df[field].astype('float64')
+        df[f'{field}_sq'] = df[field] ** 2
+
+    for resolution in RESOLUTION_SECONDS:
+        grouped = _aggregate_frame(df, resolution)
+        keys = [(int(sensor_id), bucket.to_pydatetime()) for sensor_id, bucket in grouped.index]
+
+        existing = {
+            (r.sensor_id, r.bucket): r
+            for r in ReadingRollup.objects.filter(
+                resolution=resolution,
+                sensor_id__in={k[0] for k in keys},
+                bucket__in={k[1] for k in keys},
+            )
+        }
+
+        to_create, to_update = [], []
+        for key, (_, row) in zip(keys, grouped.iterrows()):
+            rollup = existing.get(key)
+            if rollup is None:
+                rollup = ReadingRollup(sensor_id=key[0], resolution=resolution, bucket=key[1])
+                to_create.append(rollup)
+            else:
+                to_update.append(rollup)
+            _merge(rollup, row)
+
+        if to_update:
+            ReadingRollup.objects.bulk_update(to_update, MERGE_FIELDS)
+        if to_create:
+            ReadingRollup.objects.bulk_create(to_create)
+
+
+def gaps_between(ids, after, upto, seen_at):
+    """[first, last, seen_at] ranges of ids in (after, upto] missing from sorted ``ids``"""
+    gaps = []
+    previous = after
+    for reading_id in ids:
+        if reading_id > previous + 1:
+            gaps.append([previous + 1, reading_id - 1, seen_at])
+        previous = reading_id
+    if upto > previous:
+        gaps.append([previous + 1, upto, seen_at])
+    return gaps
+
+
+def _gaps_q(gaps):
+    return reduce(or_, (Q(id__range=(first, last)) for first, last, _ in gaps))
+
+
+def process_new_readings(batch_size=50000):
+    """
+    Roll up readings that committed in a pending gap, then readings past
+    the high-water mark. Returns rows processed.
+    """
+    from sensors.models import SensorReading
+
+    now = timezone.now().timestamp()
+    with transaction.atomic():
+        cursor, _ = RollupCursor.objects.select_for_update().get_or_create(name=CURSOR_NAME)
+        gaps = [gap for gap in cursor.pending_gaps if now - gap[2] < GAP_TTL]
+
+        late = []
+        if gaps:
+            late = list(SensorReading.objects.filter(_gaps_q(gaps)).order_by('id').values_list(*READING_COLUMNS))
+            arrived = [row[0] for row in late]
+            # Split each gap around the ids that have arrived in it
+            gaps = [
+                narrower
+                for first, last, seen_at in gaps
+                for narrower in gaps_between(
+                    [i for i in arrived if first <= i <= last], first - 1, last, seen_at
+                )
+            ]
+
+        rows = list(
+            SensorReading.objects.filter(id__gt=cursor.last_reading_id)
+            .order_by('id')
+            .values_list(*READING_COLUMNS)[:batch_size]
+        )
+        if rows:
+            new_gaps = gaps_between([row[0] for row in rows], cursor.last_reading_id, rows[-1][0], now)
+            room = max(MAX_GAPS - len(gaps), 0)
+            if len(new_gaps) > room:
+                # Dropping a gap would lose any reading that commits into
+                # it later, so roll up only to the first gap with no room.
+                # The rest stay in the raw tail until gaps fill or expire.
+                held_from = new_gaps[room][0]
+                rows = [row for row in rows if row[0] < held_from]
+                new_gaps = new_gaps[:room]
+                logger.warning(
+                    'Rollup mark held below id %d: %d gaps open (MAX_GAPS=%d)',
+                    held_from, len(gaps) + len(new_gaps), MAX_GAPS,
+                )
+            gaps += new_gaps
+            if rows:
+                cursor.last_reading_id = rows[-1][0]
+
+        apply_rows(late + rows)
+        if late or rows or gaps != cursor.pending_gaps:
+            cursor.pending_gaps = gaps
+            cursor.save(update_fields=['last_reading_id', 'pending_gaps', 'updated_at'])
+    return len(late) + len(rows)
+
+
+def not_rolled_up():
+    """Q matching the SensorReading rows not yet included in the rollups"""
+    cursor = RollupCursor.objects.filter(name=CURSOR_NAME).values_list('last_reading_id', 'pending_gaps').first()
+    if cursor is None:
+        return Q()
+    last_reading_id, gaps = cursor
+    pending = Q(id__gt=last_reading_id)
+    return pending | _gaps_q(gaps) if gaps else pending
+
+
+def summarize(start, end=None, sensor_ids=None, resolution=None):
+    """
+    Aggregate readings in [start, end) from the rollups plus the raw tail.
+
+    Buckets are selected by their start time, so the edges of the range
+    are accurate to one bucket of the chosen resolution. Readings that are
+    not rolled up yet are aggregated directly from SensorReading.
+    """
+    from sensors.models import SensorReading
+
+    end = end or timezone.now()
+    resolution = resolution or choose_resolution(start, end)
+
+    rollups = ReadingRollup.objects.filter(
+        resolution=resolution,
+        bucket__gte=floor_to_resolution(start, resolution),
+        bucket__lt=end,
+    )
+    tail = SensorReading.objects.filter(not_rolled_up(), timestamp__gte=start, timestamp__lt=end)
+    if sensor_ids is not None:
+        rollups = rollups.filter(sensor_id__in=sensor_ids)
+        tail = tail.filter(sensor_id__in=sensor_ids)
+
+    rolled = rollups.aggregate(
+        count=Sum('count'),
+        flow_count=Sum('flow_count'), flow_sum=Sum('flow_sum'), flow_sumsq=Sum('flow_sumsq'),
+        flow_min=Min('flow_min'), flow_max=Max('flow_max'),
+        pressure_count=Sum('pressure_count'), pressure_sum=Sum('pressure_sum'),
+        pressure_min=Min('pressure_min'), pressure_max=Max('pressure_max'),
+        temperature_count=Sum('temperature_count'), temperature_sum=Sum('temperature_sum'),
+        battery_min=Min('battery_min'),
+    )
+    raw = tail.aggregate(
+        count=Count('id'),
+        flow_count=Count('flow_rate'), flow_sum=Sum('flow_rate'),
+        flow_sumsq=Sum(F('flow_rate') * F('flow_rate')),
+        flow_min=Min('flow_rate'), flow_max=Max('flow_rate'),
+        pressure_count=Count('pressure'), pressure_sum=Sum('pressure'),
+        pressure_min=Min('pressure'), pressure_max=Max('pressure'),
+        temperature_count=Count('temperature'), temperature_sum=Sum('temperature'),
+        battery_min=Min('battery_level'),
+    )
+
+    def total(key):
+        return (rolled[key] or 0) + (raw.get(key) or 0)
+
+    def extreme(func, key):
+        values = [v for v in (rolled[key], raw[key]) if v is not None]
+        return func(values) if values else None
+
+    flow_count = total('flow_count')
+    pressure_count = total('pressure_count')
+    temperature_count = total('temperature_count')
+    avg_flow = total('flow_sum') / flow_count if flow_count else None
+    std_flow = None
+    if flow_count:
+        variance = total('flow_sumsq') / flow_count - avg_flow * avg_flow
+        std_flow = math.sqrt(max(variance, 0.0))
+
+    return {
+        'resolution': resolution,
+        'total_readings': total('count'),
+        'avg_flow': avg_flow,
+        'std_flow': std_flow,
+        'min_flow': extreme(min, 'flow_min'),
+        'max_flow': extreme(max, 'flow_max'),
+        'total_flow': total('flow_sum'),
+        'avg_pressure': total('pressure_sum') / pressure_count if pressure_count else None,
+        'min_pressure': extreme(min, 'pressure_min'),
+        'max_pressure': extreme(max, 'pressure_max'),
+        'avg_temperature': total('temperature_sum') / temperature_count if temperature_count else None,
+        'min_battery': extreme(min, 'battery_min'),
+    }
+
+
+def series(start, end=None, sensor_ids=None, resolution=None):
+    """Per-bucket aggregates over [start, end), summed across the given sensors"""
+    end = end or timezone.now()
+    resolution = resolution or choose_resolution(start, end)
+    rollups = ReadingRollup.objects.filter(
+        resolution=resolution,
+        bucket__gte=floor_to_resolution(start, resolution),
+        bucket__lt=end,
+    )
+    if sensor_ids is not None:
+        rollups = rollups.filter(sensor_id__in=sensor_ids)
+    return rollups.values('bucket').annotate(
+        count=Sum('count'),
+        flow_count=Sum('flow_count'),
+        flow_sum=Sum('flow_sum'),
+        flow_min=Min('flow_min'),
+        flow_max=Max('flow_max'),
+        pressure_count=Sum('pressure_count'),
+        pressure_sum=Sum('pressure_sum'),
+        pressure_min=Min('pressure_min'),
+        pressure_max=Max('pressure_max'),
+    ).order_by('bucket')
+
+
+def hourly_profile(start, end=None, sensor_ids=None):
+    """
+    Summed flow rate per hour of day over [start, end), as {hour: total},
+    from the HOUR rollups plus the raw tail.
+    """
+    from sensors.models import SensorReading
+
+    end = end or timezone.now()
+    rollups = ReadingRollup.objects.filter(
+        resolution='HOUR',
+        bucket__gte=floor_to_resolution(start, 'HOUR'),
+        bucket__lt=end,
+    )
+    tail = SensorReading.objects.filter(not_rolled_up(), timestamp__gte=start, timestamp__lt=end)
+    if sensor_ids is not None:
+        rollups = rollups.filter(sensor_id__in=sensor_ids)
+        tail = tail.filter(sensor_id__in=sensor_ids)
+
+    totals = {}
+    for queryset, timestamp, flow_sum in ((rollups, 'bucket', 'flow_sum'), (tail, 'timestamp', 'flow_rate')):
+        for hour, total in (
+            queryset.annotate(hour=ExtractHour(timestamp)).values('hour')
+            .annotate(total=Sum(flow_sum)).order_by().values_list('hour', 'total')
+        ):
+            totals[hour] = totals.get(hour, 0) + (total or 0)
+    return dict(sorted(totals.items()))
+
+
+def sensor_summaries(start, end=None, resolution=None):
+    """
+    Per-sensor flow, pressure and battery figures over [start, end), keyed
+    by sensor id, from the rollups plus the raw tail. Sensors with no
+    readings in the range are left out.
+    """
+    from sensors.models import SensorReading
+
+    end = end or timezone.now()
+    resolution = resolution or choose_resolution(start, end)
+    rolled = ReadingRollup.objects.filter(
+        resolution=resolution,
+        bucket__gte=floor_to_resolution(start, resolution),
+        bucket__lt=end,
+    ).values('sensor').annotate(
+        flow_count=Sum('flow_count'), flow_sum=Sum('flow_sum'), flow_max=Max('flow_max'),
+        pressure_count=Sum('pressure_count'), pressure_sum=Sum('pressure_sum'),
+        battery_min=Min('battery_min'),
+    ).order_by()
+    raw = SensorReading.objects.filter(
+        not_rolled_up(), timestamp__gte=start, timestamp__lt=end,
+    ).values('sensor').annotate(
+        flow_count=Count('flow_rate'), flow_sum=Sum('flow_rate'), flow_max=Max('flow_rate'),
+        pressure_count=Count('pressure'), pressure_sum=Sum('pressure'),
+        battery_min=Min('battery_level'),
+    ).order_by()
+
+    merged = {}
+    for row in list(rolled) + list(raw):
+        current = merged.setdefault(row['sensor'], {
+            'flow_count': 0, 'flow_sum': 0.0, 'flow_max': None,
+            'pressure_count': 0, 'pressure_sum': 0.0, 'battery_min': None,
+        })
+        for key in ('flow_count', 'flow_sum', 'pressure_count', 'pressure_sum'):
+            current[key] += row[key] or 0
+        for key, func in (('flow_max', max), ('battery_min', min)):
+            values = [v for v in (current[key], row[key]) if v is not None]
+            current[key] = func(values) if values else None
+
+    return {
+        sensor_id: {
+            'avg_flow': row['flow_sum'] / row['flow_count'] if row['flow_count'] else None,
+            'peak_flow': row['flow_max'],
+            'avg_pressure': row['pressure_sum'] / row['pressure_count'] if row['pressure_count'] else None,
+            'min_battery': row['battery_min'],
+        }
+        for sensor_id, row in merged.items()
+    }
+
+
+def refresh_consumption_patterns(day):
+    """Fill ConsumptionPattern rows for ``day`` (a date) from the hourly rollups"""
+    start = datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+    hourly = ReadingRollup.objects.filter(
+        resolution='HOUR',
+        bucket__gte=start,
+        bucket__lt=start + timedelta(days=1),
+        flow_count__gt=0,
+    ).values_list('sensor_id', 'bucket', 'flow_sum', 'flow_count', 'flow_min')
+
+    per_sensor = {}
+    for sensor_id, bucket, flow_sum, flow_count, flow_min in hourly:
+        # Mean L/min over the hour, times 60 minutes, is the hour's volume
+        per_sensor.setdefault(sensor_id, []).append((bucket.hour, flow_sum / flow_count * 60, flow_min))
+
+    patterns = []
+    for sensor_id, hours in per_sensor.items():
+        peak_hour = max(hours, key=lambda h: h[1])[0]
+        continuous = (
+            len(hours) >= CONTINUOUS_FLOW_MIN_HOURS
+            and all(h[2] is not None and h[2] > CONTINUOUS_FLOW_MIN_LPM for h in hours)
+        )
+        patterns.append(ConsumptionPattern(
+            sensor_id=sensor_id,
+            date=day,
+            total_consumption=sum(h[1] for h in hours),
+            peak_hour=peak_hour,
+            continuous_flow_detected=continuous,
+        ))
+
+    ConsumptionPattern.objects.bulk_create(
+        patterns,
+        update_conflicts=True,
+        unique_fields=['sensor', 'date'],
+        update_fields=['total_consumption', 'peak_hour', 'continuous_flow_detected'],
+    )
+    return len(patterns)
@@ -0,0 +1,18 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from sensors import events
+from .kpis import kpi_service
+from .models import LeakDetection
+
+
+@receiver(post_save, sender=LeakDetection)
+def publish_leak(sender, instance, **kwargs):
+    """Push leak detections to live dashboards once committed"""
+    transaction.on_commit(lambda: events.publish('leak', events.leak_event(instance)))
+
+
+@receiver(post_save, sender=LeakDetection)
+@receiver(post_delete, sender=LeakDetection)
+def invalidate_leak_kpis(sender, **kwargs):
+    kpi_service.invalidate()
@@ -0,0 +1,198 @@
+"""
+Streaming continuous-flow detection.
+
+Each sensor keeps a small rolling state in Django's cache: the window is
+split into fixed time buckets, each holding a reading count and a
+Welford (count, mean, M2) triple over the non-zero flow rates. Zero and
+missing flow rates count towards ``MIN_SAMPLES`` but stay out of the
+flow statistics, as in the batch check of ``LeakDetectionAI``, so both
+give the same verdict on the same readings. The reading outbox drainer
+folds new readings in just before scoring them, and a verdict combines
+at most ``buckets`` buckets, so it is O(1) per reading and per check no
+matter how many readings the window holds.
+
+A batch is folded into a sensor's state under a ``cache.add`` lock, so
+concurrent drainers never overwrite each other's samples. Ingest
+requests never touch the state or wait on its locks. A state that no
+update has touched for ``MAX_STALENESS`` seconds gets no verdict, and
+the caller reseeds it from the database. With a shared cache (Redis,
+Memcached) every drainer keeps one state warm. With the default
+local-memory cache each process has its own, and one that drains no
+batches rebuilds it from the database at most every ``MAX_STALENESS``
+seconds.
+"""
+import math
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+STREAMING_SETTINGS = getattr(settings, 'CONTINUOUS_FLOW_DETECTOR', {})
+
+# Mean flow (L/min) a continuous-flow leak must exceed
+ZERO_FLOW_LPM = 0.5
+MIN_SAMPLES = 20
+
+
+def _merge(n_a, mean_a, m2_a, n_b, mean_b, m2_b):
+    """Chan et al. parallel combination of two Welford accumulators"""
+    n = n_a + n_b
+    if not n:
+        return 0, 0.0, 0.0
+    delta = mean_b - mean_a
+    mean = mean_a + delta * n_b / n
+    m2 = m2_a + m2_b + delta * delta * n_a * n_b / n
+    return n, mean, m2
+
+
+class ContinuousFlowDetector:
+    def __init__(self, cache_alias='default', window_hours=24, buckets=24,
+                 max_staleness=300, lock_timeout=5, wait=1.0):
+        self.cache_alias = cache_alias
+        self.window = window_hours * 3600
+        self.bucket_seconds = self.window / buckets
+        # Seconds a state may go without an update before verdicts ignore it
+        self.max_staleness = max_staleness
+        # How long one update may hold a sensor's lock before another caller takes it
+        self.lock_timeout = lock_timeout
+        # How long an update waits for locks held by concurrent batches
+        self.wait = wait
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def key(self, sensor_id):
+        # Versioned, so states cached in an older layout are never read back
+        return f'flowstate:v2:{sensor_id}'
+
+    def _new_state(self, started_at, updated_at):
+        # buckets: [[bucket index, readings, n, mean, M2], ...] oldest first
+        return {'started_at': started_at, 'updated_at': updated_at, 'buckets': []}
+
+    def _observe(self, state, ts, flow):
+        """Fold one (epoch seconds, flow_rate or None) sample into a state"""
+        index = int(ts // self.bucket_seconds)
+        buckets = state['buckets']
+        for bucket in reversed(buckets):
+            if bucket[0] == index:
+                break
+            if bucket[0] < index:
+                bucket = None
+                break
+        else:
+            bucket = None
+
+        if bucket is None:
+            bucket = [index, 0, 0, 0.0, 0.0]
+            buckets.append(bucket)
+            buckets.sort(key=lambda b: b[0])
+
+        bucket[1] += 1
+        if flow:
+            # Welford update
+            bucket[2] += 1
+            delta = flow - bucket[3]
+            bucket[3] += delta / bucket[2]
+            bucket[4] += delta * (flow - bucket[3])
+
+        # Drop buckets that fell out of the window
+        newest = buckets[-1][0]
+        horizon = newest - int(self.window // self.bucket_seconds)
+        while buckets and buckets[0][0] <= horizon:
+            buckets.pop(0)
+
+    def _lock(self, key):
+        return self.cache.add(f'{key}:lock', True, timeout=self.lock_timeout)
+
+    def update(self, samples):
+        """Fold (sensor_id, timestamp, flow_rate) samples into the shared state"""
+        by_sensor = {}
+        for sensor_id, ts, flow in samples:
+            by_sensor.setdefault(sensor_id, []).append((ts.timestamp(), flow))
+        if not by_sensor:
+            return
+
+        pending = {self.key(sensor_id): sensor_id for sensor_id in by_sensor}
+        deadline = time.monotonic() + self.wait
+        while pending:
+            held = [key for key in pending if self._lock(key)]
+            if held:
+                states = self.cache.get_many(held)
+                now = timezone.now().timestamp()
+                for key in held:
+                    state = states.get(key) or self._new_state(now, now)
+                    for ts, flow in by_sensor[pending.pop(key)]:
+                        self._observe(state, ts, flow)
+                    state['updated_at'] = now
+                    states[key] = state
+                self.cache.set_many(states, timeout=self.window * 2)
+                self.cache.delete_many([f'{key}:lock' for key in held])
+            elif time.monotonic() > deadline:
+                # These samples cannot be folded in, so drop the states they
+                # belong to; the next verdict reseeds them from the database
+                self.cache.delete_many(pending)
+                return
+            else:
+                time.sleep(0.01)
+
+    def seed(self, sensor_id, samples, now=None):
+        """Replace a sensor's state with a full window of (timestamp, flow) samples"""
+        now = (now or timezone.now()).timestamp()
+        state = self._new_state(now - self.window, now)
+        for ts, flow in samples:
+            self._observe(state, ts.timestamp(), flow)
+        key = self.key(sensor_id)
+        # An update holding the lock may be folding in readings this
+        # snapshot missed; keep its state rather than overwrite it
+        if self._lock(key):
+            self.cache.set(key, state, timeout=self.window * 2)
+            self.cache.delete(f'{key}:lock')
+        return state
+
+    def summarize(self, state, now):
+        """Return (readings, n, mean, std) over buckets still inside the window"""
+        horizon = int((now - self.window) // self.bucket_seconds)
+        readings, n, mean, m2 = 0, 0, 0.0, 0.0
+        for index, b_readings, b_n, b_mean, b_m2 in state['buckets']:
+            if index > horizon:
+                readings += b_readings
+                n, mean, m2 = _merge(n, mean, m2, b_n, b_mean, b_m2)
+        return readings, n, mean, math.sqrt(m2 / n) if n else 0.0
+
+    def verdict(self, sensor_id, now=None):
+        """
+        O(1) continuous-flow verdict as (has_leak, loss_rate L/hr), or None
+        while the state has not yet covered a full window or has gone
+        ``max_staleness`` seconds without an update.
+        """
+        state = self.cache.get(self.key(sensor_id))
+        now = (now or timezone.now()).timestamp()
+        if state is None or state['started_at'] > now - self.window:
+            return None
+        if state.get('updated_at', 0) < now - self.max_staleness:
+            return None
+        return self.evaluate(state, now)
+
+    def evaluate(self, state, now):
+        readings, n, mean, std = self.summarize(state, now)
+        if readings < MIN_SAMPLES or not n:
+            return False, 0
+
+        # Low variance + non-zero flow = potential leak
+        if mean > ZERO_FLOW_LPM and std < (mean * 0.2):
+            return True, mean * 60  # Convert to liters per hour
+        return False, 0
+
+    def window_start(self, now=None):
+        return (now or timezone.now()) - timedelta(seconds=self.window)
+
+
+flow_detector = ContinuousFlowDetector(
+    cache_alias=STREAMING_SETTINGS.get('CACHE_ALIAS', 'default'),
+    window_hours=STREAMING_SETTINGS.get('WINDOW_HOURS', 24),
+    buckets=STREAMING_SETTINGS.get('BUCKETS', 24),
+    max_staleness=STREAMING_SETTINGS.get('MAX_STALENESS', 300),
+    lock_timeout=STREAMING_SETTINGS.get('LOCK_TIMEOUT', 5),
+)
@@ -1,61 +1,74 @@
+from datetime import timedelta
 from celery import shared_task
-from .ai_models import LeakDetectionAI
-from .models import LeakDetection
-from sensors.models import SensorReading
-from alerts.models import Alert
+from celery.signals import worker_process_init
+from django.utils import timezone
+from . import rollups, scoring, water_balance
+from .outbox import reading_outbox
+from .model_registry import model_registry
+from sensors.models import SensorDevice
+from sensors.registry import device_registry
+
+@worker_process_init.connect
+def warm_model_registry(**kwargs):
+    """Memory-map trained models once per worker process"""
+    model_registry.warm()
 
 @shared_task
 def analyze_sensor_reading(reading_id):
     """Analyze sensor reading for anomalies"""
-    reading = SensorReading.objects.get(id=reading_id)
-    sensor = reading.sensor
-    
-    ai = LeakDetectionAI()
-    
-    # Train model if needed
-    if not ai.is_trained:
-        ai.train(sensor.id)
-    
-    # Check for anomaly
-    is_anomaly, confidence = ai.detect_anomaly(reading.flow_rate, reading.pressure)
-    
-    if is_anomaly and confidence > 0.7:
-        # Check for continuous flow
-        has_leak, loss_rate = ai.detect_continuous_flow(sensor.id)
-        
-        if has_leak:
-            # Determine severity
-            if loss_rate > 1000:
-                severity = 'CRITICAL'
-                priority = 'URGENT'
-            elif loss_rate > 500:
-                severity = 'HIGH'
-                priority = 'HIGH'
-            elif loss_rate > 100:
-                severity = 'MEDIUM'
-                priority = 'MEDIUM'
-            else:
-                severity = 'LOW'
-                priority = 'LOW'
-            
-            # Create leak detection record
-            leak = LeakDetection.objects.create(
-                sensor=sensor,
-                severity=severity,
-                estimated_loss_rate=loss_rate,
-                confidence_score=confidence
-            )
-            
-            # Create alert
-            if sensor.deployment_type == 'MUNICIPAL':
-                message = f"Major leak detected at {sensor.location}. Estimated loss: {loss_rate:.1f} L/hr"
-            else:
-                message = f"Continuous flow detected for 24 hours. Check for leaks. Estimated loss: {loss_rate:.1f} L/hr"
-            
-            Alert.objects.create(
-                alert_type='LEAK',
-                priority=priority,
-                sensor=sensor,
-                leak=leak,
-                message=message
-            )
\ No newline at end of file
+    return scoring.score_readings([reading_id])
+
+@shared_task
+def score_reading_batch(reading_ids):
+    """Score a micro-batch of readings with one model call per sensor"""
+    return scoring.score_readings(reading_ids)
+
+@shared_task
+def drain_reading_outbox(max_batches=20):
+    """Score readings waiting in the ingest outbox"""
+    return reading_outbox.drain(max_batches=max_batches)
+
+@shared_task
+def train_sensor_model(sensor_id):
+    """Retrain one sensor's model, falling back to its deployment type's pool"""
+    sensor = device_registry.get_by_id(sensor_id)
+    if model_registry.train_sensor(sensor):
+        return 'sensor'
+    if model_registry.train_deployment(sensor.deployment_type):
+        return 'deployment'
+    return None
+
+@shared_task
+def train_all_models():
+    """Scheduled retrain of pooled deployment models and per-sensor models"""
+    trained = 0
+    for deployment_type, _ in SensorDevice.DEPLOYMENT_TYPES:
+        trained += model_registry.train_deployment(deployment_type)
+    for sensor in SensorDevice.objects.filter(is_active=True).iterator():
+        trained += model_registry.train_sensor(sensor)
+    return trained
+
+@shared_task
+def update_rollups(batch_size=50000, max_batches=20):
+    """Fold newly ingested readings into the minute/hour/day rollups"""
+    processed = 0
+    for _ in range(max_batches):
+        count = rollups.process_new_readings(batch_size=batch_size)
+        processed += count
+        if count < batch_size:
+            break
+    return processed
+
+@shared_task
+def refresh_consumption_patterns():
+    """Rebuild today's and yesterday's ConsumptionPattern rows from hourly rollups"""
+    today = timezone.now().date()
+    return sum(
+        rollups.refresh_consumption_patterns(day)
+        for day in (today - timedelta(days=1), today)
+    )
+
+@shared_task
+def update_zone_balances(hours=48):
+    """Recompute per-zone water balances over the last ``hours`` hours"""
+    return water_balance.compute_zone_balances(timezone.now() - timedelta(hours=hours))
@@ -1,3 +1,720 @@
+import io
+import os
+import subprocess
+import sys
+from datetime import timedelta
+from unittest import mock, skipUnless
+import numpy as np
+from celery.signals import worker_init
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from alerts.models import Alert
+from jalraksha.celery import app
+from sensors.models import SensorDevice, SensorReading, WaterConsumptionZone
+from sensors.registry import device_registry
+from . import rollups, water_balance
+from .kpis import KPIService, compute_leak_kpis, compute_usage_kpis, kpi_service
+from .ai_models import LeakDetectionAI
+from .downsampling import lttb, minmax
+from .model_registry import model_registry
+from .scoring import score_readings
+from .streaming import ContinuousFlowDetector, flow_detector
+from .tasks import train_sensor_model
+from .models import ACTIVE_LEAKS, LeakDetection, ReadingOutbox, ReadingRollup, RollupCursor, ZoneBalance
+from .outbox import ReadingOutboxDrainer
 
-# Create your tests here.
+
+class AdvancedDashboardQueryCountTests(TestCase):
+    # Generous ceiling for a cold KPI cache; what matters is that it does
+    # not grow with the fleet
+    MAX_QUERIES = 20
+
+    def setUp(self):
+        # Dashboard KPIs are cached across requests
+        cache.clear()
+
+    def add_sensors(self, count):
+        start = SensorDevice.objects.count()
+        for i in range(start, start + count):
+            sensor = SensorDevice.objects.create(
+                device_id=f'SENSOR{i:04d}',
+                sensor_type='FLOW',
+                deployment_type='MUNICIPAL',
+                location=f'Location {i}',
+            )
+            SensorReading.objects.bulk_create([
+                SensorReading(sensor=sensor, flow_rate=20.0 + j, pressure=45.0, battery_level=25 + j)
+                for j in range(3)
+            ])
+            LeakDetection.objects.create(
+                sensor=sensor,
+                severity='LOW',
+                estimated_loss_rate=60.0,
+                confidence_score=0.8,
+            )
+
+    def count_queries(self):
+        # Measured cold: a warm KPI cache would hide the per-sensor queries
+        cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('analytics:advanced_dashboard'))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response
+
+    def test_query_count_does_not_depend_on_sensor_count(self):
+        self.add_sensors(2)
+        small_fleet, _ = self.count_queries()
+
+        self.add_sensors(25)
+        large_fleet, response = self.count_queries()
+
+        self.assertEqual(small_fleet, large_fleet)
+        self.assertLessEqual(large_fleet, self.MAX_QUERIES)
+        self.assertEqual(len(response.context['sensor_stats']), 27)
+
+    def test_sensor_stats_match_readings(self):
+        self.add_sensors(1)
+        _, response = self.count_queries()
+
+        stats = response.context['sensor_stats'][0]
+        self.assertEqual(stats['device_id'], 'SENSOR0000')
+        self.assertAlmostEqual(stats['avg_flow'], 21.0)
+        self.assertAlmostEqual(stats['peak_flow'], 22.0)
+        self.assertEqual(stats['alert_count'], 1)
+
+
+class KPICacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.service = KPIService(ttl=30, wait=0)
+        self.compute = mock.Mock(side_effect=lambda: {'computed': self.compute.call_count})
+
+    def test_fresh_value_is_served_from_the_cache(self):
+        self.assertEqual(self.service.get('test', self.compute), {'computed': 1})
+        self.assertEqual(self.service.get('test', self.compute), {'computed': 1})
+        self.assertEqual(self.compute.call_count, 1)
+
+    def test_generation_bump_recomputes_once_committed(self):
+        self.service.get('test', self.compute)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.service.invalidate()
+            # Still inside the writing transaction: the old value stands
+            self.assertEqual(self.service.get('test', self.compute), {'computed': 1})
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.service.get('test', self.compute), {'computed': 2})
+
+    def test_leak_write_bumps_the_generation_on_commit(self):
+        sensor = SensorDevice.objects.create(
+            device_id='K1', sensor_type='FLOW', deployment_type='RESIDENTIAL', location='KPI street',
+        )
+        generation = kpi_service.generation()
+        with self.captureOnCommitCallbacks(execute=True):
+            LeakDetection.objects.create(
+                sensor=sensor, severity='LOW', estimated_loss_rate=60.0, confidence_score=0.8,
+            )
+            self.assertEqual(kpi_service.generation(), generation)
+        self.assertGreater(kpi_service.generation(), generation)
+
+    def test_stale_value_is_served_while_another_caller_recomputes(self):
+        self.service.get('test', self.compute)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.service.invalidate()
+        cache.add('kpis:test:lock', True)
+        self.assertEqual(self.service.get('test', self.compute), {'computed': 1})
+        self.assertEqual(self.compute.call_count, 1)
+
+    def test_caller_without_a_copy_waits_for_the_lock_holder(self):
+        service = KPIService(ttl=30, wait=1.0)
+        cache.add('kpis:test:lock', True)
+
+        def other_worker_finishes(seconds):
+            service._refresh('kpis:test', service.generation(), lambda: {'computed': 'elsewhere'}, ())
+
+        with mock.patch('analytics.kpis.time.sleep', side_effect=other_worker_finishes):
+            self.assertEqual(service.get('test', self.compute), {'computed': 'elsewhere'})
+        self.compute.assert_not_called()
+
+
+class UsageKPITests(TestCase):
+    def test_rollups_and_raw_tail_give_the_raw_figures(self):
+        sensor = SensorDevice.objects.create(
+            device_id='U1', sensor_type='FLOW', deployment_type='RESIDENTIAL', location='Usage street',
+        )
+        hour = rollups.floor_to_resolution(timezone.now() - timedelta(hours=3), 'HOUR')
+        readings = [
+            SensorReading(sensor=sensor, timestamp=hour + timedelta(minutes=10 * i), flow_rate=float(i),
+                          pressure=40.0 + i, battery_level=90 - i)
+            for i in range(6)
+        ]
+        SensorReading.objects.bulk_create(readings[:4])
+        rollups.process_new_readings()
+        # Not rolled up yet: served from the raw tail
+        SensorReading.objects.bulk_create(readings[4:])
+
+        usage = compute_usage_kpis(hour - timedelta(hours=1), timezone.now())
+        self.assertEqual(usage['consumption_by_hour'], {f'{hour.hour:02d}:00': 15.0})
+        self.assertEqual(usage['per_sensor'], {sensor.id: {
+            'avg_flow': 2.5, 'peak_flow': 5.0, 'avg_pressure': 42.5, 'min_battery': 85,
+        }})
+
+
+class RollupWatermarkTests(TestCase):
+    def setUp(self):
+        self.sensor = SensorDevice.objects.create(
+            device_id='R1', sensor_type='FLOW', deployment_type='RESIDENTIAL', location='Rollup street',
+        )
+        self.at = rollups.floor_to_resolution(timezone.now() - timedelta(hours=2), 'HOUR')
+
+    def add_reading(self, pk, flow=10.0):
+        return SensorReading.objects.create(id=pk, sensor=self.sensor, timestamp=self.at, flow_rate=flow)
+
+    def hourly_count(self):
+        return ReadingRollup.objects.get(resolution='HOUR', bucket=self.at).count
+
+    def summary_count(self):
+        return rollups.summarize(self.at, self.at + timedelta(hours=1), resolution='HOUR')['total_readings']
+
+    def test_late_commit_below_the_mark_is_rolled_up(self):
+        self.add_reading(1)
+        # Id 2 belongs to a transaction that has not committed yet
+        self.add_reading(3)
+        self.assertEqual(rollups.process_new_readings(), 2)
+        self.assertEqual(RollupCursor.objects.get().pending_gaps[0][:2], [2, 2])
+
+        self.add_reading(2)
+        # Before the next run the gap reading is served from the raw tail
+        self.assertEqual(self.summary_count(), 3)
+        self.assertEqual(rollups.process_new_readings(), 1)
+        self.assertEqual(self.hourly_count(), 3)
+        self.assertEqual(RollupCursor.objects.get().pending_gaps, [])
+        self.assertEqual(self.summary_count(), 3)
+
+    def test_partly_filled_gap_is_narrowed(self):
+        self.add_reading(1)
+        self.add_reading(6)
+        rollups.process_new_readings()
+        self.add_reading(3)
+        rollups.process_new_readings()
+        self.assertEqual([gap[:2] for gap in RollupCursor.objects.get().pending_gaps], [[2, 2], [4, 5]])
+        self.assertEqual(self.hourly_count(), 3)
+
+    def test_mark_waits_rather_than_forget_gaps(self):
+        for pk in (1, 3, 5, 7, 9):
+            self.add_reading(pk)
+        with mock.patch.object(rollups, 'MAX_GAPS', 2), self.assertLogs('analytics.rollups', 'WARNING'):
+            self.assertEqual(rollups.process_new_readings(), 3)
+        cursor = RollupCursor.objects.get()
+        self.assertEqual(cursor.last_reading_id, 5)
+        self.assertEqual([gap[:2] for gap in cursor.pending_gaps], [[2, 2], [4, 4]])
+        # Readings above the mark are still counted, from the raw tail
+        self.assertEqual(self.summary_count(), 5)
+
+        self.add_reading(2)
+        self.add_reading(4)
+        with mock.patch.object(rollups, 'MAX_GAPS', 2):
+            self.assertEqual(rollups.process_new_readings(), 4)
+        self.assertEqual(self.hourly_count(), 7)
+        self.assertEqual([gap[:2] for gap in RollupCursor.objects.get().pending_gaps], [[6, 6], [8, 8]])
+
+    def test_expired_gap_is_dropped(self):
+        self.add_reading(1)
+        self.add_reading(3)
+        rollups.process_new_readings()
+        cursor = RollupCursor.objects.get()
+        cursor.pending_gaps = [[2, 2, timezone.now().timestamp() - rollups.GAP_TTL - 1]]
+        cursor.save()
+
+        self.add_reading(2)
+        self.assertEqual(rollups.process_new_readings(), 0)
+        self.assertEqual(RollupCursor.objects.get().pending_gaps, [])
+        self.assertEqual(self.hourly_count(), 2)
+
+
+class DriftRetrainTests(TestCase):
+    def setUp(self):
+        sensor = SensorDevice.objects.create(
+            device_id='S1', sensor_type='FLOW', deployment_type='RESIDENTIAL', location='Scoring street',
+        )
+        self.reading_ids = [
+            SensorReading.objects.create(sensor=sensor, flow_rate=20.0 + i % 3, pressure=45.0).pk
+            for i in range(5)
+        ]
+        ai = LeakDetectionAI()
+        ai.fit(np.random.default_rng(0).normal([20.0, 45.0], 1.0, size=(200, 2)))
+        for patcher in (
+            mock.patch.object(model_registry, 'get', return_value=('sensor:S1', ai)),
+            # Every batch looks drifted
+            mock.patch.object(model_registry, 'observe', return_value=True),
+            mock.patch.object(train_sensor_model, 'delay'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        conf = train_sensor_model.app.conf
+        self.addCleanup(conf.update, CELERY_TASK_ALWAYS_EAGER=conf.task_always_eager)
+
+    def test_retrain_is_queued_after_commit(self):
+        train_sensor_model.app.conf.update(CELERY_TASK_ALWAYS_EAGER=False)
+        with self.captureOnCommitCallbacks() as callbacks:
+            summary = score_readings(self.reading_ids)
+        self.assertEqual(summary['drifted'], 1)
+        train_sensor_model.delay.assert_not_called()
+        for callback in callbacks:
+            callback()
+        train_sensor_model.delay.assert_called_once()
+
+    def test_eager_tasks_never_fit_inside_scoring(self):
+        train_sensor_model.app.conf.update(CELERY_TASK_ALWAYS_EAGER=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            score_readings(self.reading_ids)
+        train_sensor_model.delay.assert_not_called()
+
+
+class TrainSensorModelTests(TestCase):
+    def test_sensor_comes_from_the_device_registry(self):
+        device_registry.invalidate()
+        sensor = SensorDevice.objects.create(
+            device_id='T1', sensor_type='FLOW', deployment_type='RESIDENTIAL', location='Training street',
+        )
+        device_registry.get_by_id(sensor.pk)
+        with mock.patch.object(model_registry, 'train_sensor', return_value=True) as train, \
+                self.assertNumQueries(0):
+            self.assertEqual(train_sensor_model(sensor.pk), 'sensor')
+        self.assertEqual(train.call_args.args[0].pk, sensor.pk)
+
+
+class StreamingStateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.sensor = SensorDevice.objects.create(
+            device_id='F1', sensor_type='FLOW', deployment_type='RESIDENTIAL', location='Flow street',
+        )
+        self.now = timezone.now()
+        self.detector = ContinuousFlowDetector(window_hours=1, buckets=4, max_staleness=60, wait=0)
+
+    def samples(self, flow, count=30):
+        step = self.detector.window / count
+        return [(self.now - timedelta(seconds=step * i), flow) for i in range(count)]
+
+    def test_update_keeps_seeded_state_warm(self):
+        self.detector.seed(self.sensor.id, self.samples(0.0), self.now)
+        self.detector.update([(self.sensor.id, self.now, 0.0)])
+        self.assertEqual(self.detector.verdict(self.sensor.id), (False, 0))
+
+    def test_stale_state_gets_no_verdict(self):
+        self.detector.seed(self.sensor.id, self.samples(0.0), self.now)
+        later = self.now + timedelta(seconds=61)
+        self.assertIsNone(self.detector.verdict(self.sensor.id, later))
+
+    def test_locked_update_drops_the_state(self):
+        self.detector.seed(self.sensor.id, self.samples(0.0), self.now)
+        key = self.detector.key(self.sensor.id)
+        cache.add(f'{key}:lock', True)
+        # A concurrent batch holds the lock: rather than lose this sample,
+        # the state is dropped and the next verdict reseeds from the database
+        self.detector.update([(self.sensor.id, self.now, 5.0)])
+        self.assertIsNone(cache.get(key))
+
+    def test_seed_does_not_overwrite_a_locked_state(self):
+        key = self.detector.key(self.sensor.id)
+        cache.add(f'{key}:lock', True)
+        self.detector.seed(self.sensor.id, self.samples(0.0), self.now)
+        self.assertIsNone(cache.get(key))
+
+    def test_stale_state_falls_back_to_the_database(self):
+        # Seeded by a process that saw no flow, then never updated
+        flow_detector.seed(self.sensor.id, [], self.now - timedelta(seconds=flow_detector.max_staleness + 1))
+        SensorReading.objects.bulk_create([
+            SensorReading(sensor=self.sensor, flow_rate=6.0, timestamp=self.now - timedelta(minutes=10 * i))
+            for i in range(30)
+        ])
+        has_leak, loss_rate = LeakDetectionAI().detect_continuous_flow(self.sensor.id)
+        self.assertTrue(has_leak)
+        self.assertAlmostEqual(loss_rate, 360.0)
+
+    def test_streaming_verdict_matches_the_batch_check(self):
+        cases = {
+            'steady': [6.0] * 30,
+            'steady with idle readings': [6.0, 6.1, 0.0, 5.9, None] * 6,
+            'idle': [0.0] * 30,
+            'unmeasured': [None] * 30,
+            'variable': [1.0, 12.0, 4.0, 0.0, 9.0] * 6,
+            'too few readings': [6.0] * 19,
+        }
+        for name, flows in cases.items():
+            with self.subTest(name):
+                cache.clear()
+                SensorReading.objects.all().delete()
+                # Half the window, one minute apart, so both paths see every reading
+                samples = [(self.now - timedelta(minutes=i), flow) for i, flow in enumerate(flows)]
+                SensorReading.objects.bulk_create([
+                    SensorReading(sensor=self.sensor, flow_rate=flow, timestamp=ts) for ts, flow in samples
+                ])
+                # A window other than the shared detector's takes the batch path
+                batch = LeakDetectionAI().detect_continuous_flow(self.sensor.id, hours=1)
+
+                seeded = self.detector.seed(self.sensor.id, samples, self.now)
+                cache.clear()
+                self.detector.update([(self.sensor.id, ts, flow) for ts, flow in samples])
+                folded = cache.get(self.detector.key(self.sensor.id))
+                for state in (seeded, folded):
+                    has_leak, loss_rate = self.detector.evaluate(state, self.now.timestamp())
+                    self.assertEqual(has_leak, batch[0])
+                    self.assertAlmostEqual(loss_rate, batch[1])
+
+
+class SeriesTimeParamTests(TestCase):
+    def test_out_of_range_times_are_rejected(self):
+        for value in ('nan', 'inf', '1e20', '-1e20'):
+            with self.subTest(since=value):
+                response = self.client.get(reverse('analytics:series_data'), {'since': value})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('since', response.json())
+
+    def test_window_before_year_one_is_rejected(self):
+        response = self.client.get(reverse('analytics:series_data'), {'until': '0001-01-01T00:00:00Z'})
+        self.assertEqual(response.status_code, 400)
+
+
+class DownsamplingTests(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        self.x = np.arange(1000, dtype=np.float64)
+        self.y = rng.normal(size=1000)
+        # Extremes in the middle of the series
+        self.y[333], self.y[666] = 50.0, -50.0
+
+    def test_lttb_keeps_the_end_points_and_the_threshold(self):
+        indices = lttb(self.x, self.y, 50)
+        self.assertEqual(len(indices), 50)
+        self.assertEqual((indices[0], indices[-1]), (0, 999))
+        self.assertTrue((np.diff(indices) > 0).all())
+        self.assertIn(333, indices)
+        self.assertIn(666, indices)
+
+    def test_minmax_keeps_the_extremes(self):
+        indices = minmax(self.x, self.y, 50)
+        self.assertEqual(len(indices), 50)
+        self.assertTrue((np.diff(indices) > 0).all())
+        self.assertIn(333, indices)
+        self.assertIn(666, indices)
+
+    def test_short_series_is_returned_whole(self):
+        for method in (lttb, minmax):
+            with self.subTest(method.__name__):
+                np.testing.assert_array_equal(method(self.x[:50], self.y[:50], 50), np.arange(50))
+                np.testing.assert_array_equal(method(self.x[:10], self.y[:10], 50), np.arange(10))
+
+
+class SeriesDataTests(TestCase):
+    def setUp(self):
+        device_registry.invalidate()
+        self.sensor = SensorDevice.objects.create(
+            device_id='S1', sensor_type='FLOW', deployment_type='RESIDENTIAL', location='Series street',
+        )
+        self.start = rollups.floor_to_resolution(timezone.now() - timedelta(hours=2), 'MINUTE')
+        SensorReading.objects.bulk_create([
+            SensorReading(sensor=self.sensor, timestamp=self.start + timedelta(minutes=i),
+                          flow_rate=float(i % 10), pressure=45.0)
+            for i in range(100)
+        ])
+
+    def get(self, **params):
+        params.setdefault('since', self.start.isoformat())
+        params.setdefault('until', (self.start + timedelta(minutes=100)).isoformat())
+        response = self.client.get(reverse('analytics:series_data'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_single_sensor_is_downsampled_from_raw_readings(self):
+        data = self.get(sensor='S1', points=20)
+        self.assertEqual((data['source'], data['field'], data['method']), ('raw', 'flow_rate', 'lttb'))
+        self.assertEqual(len(data['timestamps']), 20)
+        self.assertEqual(len(data['values']), 20)
+        self.assertEqual(data['timestamps'][0], int(self.start.timestamp() * 1000))
+        self.assertEqual(data['timestamps'][-1], int((self.start + timedelta(minutes=99)).timestamp() * 1000))
+        self.assertEqual((min(data['values']), max(data['values'])), (0.0, 9.0))
+
+    def test_fleet_is_downsampled_from_rollups_and_the_raw_tail(self):
+        rollups.process_new_readings()
+        SensorReading.objects.create(
+            sensor=self.sensor, timestamp=self.start + timedelta(minutes=99, seconds=30), flow_rate=20.0,
+        )
+        data = self.get(method='minmax', points=300)
+        self.assertEqual((data['source'], data['field'], data['method']), ('MINUTE', 'flow_rate', 'minmax'))
+        # Fewer buckets than points: the min and max of every bucket
+        self.assertEqual(len(data['timestamps']), 200)
+        # The last bucket's max comes from the reading not rolled up yet
+        self.assertEqual(data['values'][-2:], [9.0, 20.0])
+
+
+class OutboxDrainTests(TestCase):
+    def setUp(self):
+        sensor = SensorDevice.objects.create(
+            device_id='O1', sensor_type='FLOW', deployment_type='RESIDENTIAL', location='Outbox street',
+        )
+        self.reading_ids = [
+            SensorReading.objects.create(sensor=sensor, flow_rate=float(i)).pk for i in range(7)
+        ]
+        self.poison = self.reading_ids[4]
+        self.drainer = ReadingOutboxDrainer(batch_size=100, max_attempts=2)
+        self.drainer.enqueue(self.reading_ids)
+        self.handled = []
+        self.drainer.handle = self.handle
+
+    def handle(self, reading_ids):
+        if self.poison in reading_ids:
+            raise ValueError('unscorable reading')
+        self.handled.extend(reading_ids)
+
+    def test_drain_delivers_every_reading(self):
+        self.poison = None
+        self.assertEqual(self.drainer.drain(), 7)
+        self.assertEqual(self.handled, self.reading_ids)
+        self.assertFalse(ReadingOutbox.objects.exists())
+
+    def test_failing_reading_is_isolated_from_its_batch(self):
+        self.drainer.drain()
+        self.assertCountEqual(self.handled, [pk for pk in self.reading_ids if pk != self.poison])
+        entry = ReadingOutbox.objects.get()
+        self.assertEqual((entry.reading_id, entry.attempts), (self.poison, 1))
+        self.assertIn('unscorable reading', entry.last_error)
+        self.assertIsNone(entry.failed_at)
+
+    def test_failed_reading_backs_off_before_its_retry(self):
+        self.drainer.drain()
+        entry = ReadingOutbox.objects.get()
+        self.assertGreater(entry.claimed_until, timezone.now() + timedelta(seconds=25))
+        self.assertEqual(self.drainer.drain(), 0)
+
+    def test_reading_is_set_aside_after_max_attempts(self):
+        self.drainer.drain()
+        # Let the backoff run out
+        ReadingOutbox.objects.update(claimed_until=timezone.now() - timedelta(seconds=1))
+        self.drainer.drain()
+        entry = ReadingOutbox.objects.get()
+        self.assertEqual(entry.attempts, 2)
+        self.assertIsNotNone(entry.failed_at)
+        # No longer claimed
+        ReadingOutbox.objects.update(claimed_until=None)
+        self.assertEqual(self.drainer.drain(), 0)
+
+    def test_new_readings_are_folded_into_the_flow_state_once(self):
+        with mock.patch.object(flow_detector, 'update') as update:
+            self.drainer.drain()
+            ReadingOutbox.objects.update(claimed_until=None)
+            self.drainer.drain()
+        update.assert_called_once()
+        samples = list(update.call_args.args[0])
+        self.assertEqual(sorted(flow for _, _, flow in samples), [float(i) for i in range(7)])
+
+
+class LeakIndexTests(TestCase):
+    def setUp(self):
+        sensor = SensorDevice.objects.create(
+            device_id='IDX1', sensor_type='FLOW', deployment_type='MUNICIPAL', location='Index main',
+        )
+        statuses = ['DETECTED', 'INVESTIGATING', 'CONFIRMED', 'REPAIRED', 'FALSE_ALARM']
+        LeakDetection.objects.bulk_create([
+            LeakDetection(sensor=sensor, severity='LOW', status=statuses[i % 5],
+                          estimated_loss_rate=10.0 * i, confidence_score=0.5)
+            for i in range(20)
+        ])
+
+    def test_index_conditions_are_the_active_leaks_filter(self):
+        conditions = {index.name: index.condition for index in LeakDetection._meta.indexes}
+        self.assertEqual(conditions['leak_active_detected_idx'], ACTIVE_LEAKS)
+        self.assertEqual(conditions['leak_active_loss_idx'], ACTIVE_LEAKS)
+
+    def test_migrations_match_the_models(self):
+        # A changed ACTIVE_LEAK_STATUSES needs a migration for the index conditions
+        call_command('makemigrations', 'analytics', 'alerts', check=True, dry_run=True, stdout=io.StringIO())
+
+    @skipUnless(connection.vendor == 'sqlite', 'query plans are checked on SQLite')
+    def test_active_loss_kpi_uses_the_partial_index(self):
+        statements = []
+
+        def record(execute, sql, params, many, context):
+            statements.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            kpis = compute_leak_kpis()
+        # The first three of every five statuses are active
+        expected_loss = sum(10.0 * i for i in range(20) if i % 5 < 3)
+        self.assertEqual((kpis['active_leaks'], kpis['total_loss']), (12, expected_loss))
+        sql, params = next((sql, params) for sql, params in statements if 'SUM' in sql)
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = ' '.join(row[-1] for row in cursor.fetchall())
+        self.assertIn('COVERING INDEX leak_active_loss_idx', plan)
+
+
+class BenchIndexesCommandTests(TestCase):
+    def test_runs_and_leaves_nothing_behind(self):
+        out = io.StringIO()
+        call_command('bench_indexes', alerts=30, leaks=30, sensors=3, repeat=1, batch_size=10, seed=1, stdout=out)
+        output = out.getvalue()
+        self.assertIn('Summary (median ms)', output)
+        self.assertIn('active leak loss', output)
+        # Seeded rows and the dropped and recreated indexes are rolled back
+        self.assertFalse(SensorDevice.objects.exists())
+        self.assertFalse(Alert.objects.exists() or LeakDetection.objects.exists())
+        with connection.cursor() as cursor:
+            indexes = connection.introspection.get_constraints(cursor, LeakDetection._meta.db_table)
+        self.assertIn('leak_active_loss_idx', indexes)
+
+
+class FlowIntegrationTests(TestCase):
+    def test_constant_flow_fills_each_bucket(self):
+        timestamps = np.arange(0, 7201, 600, dtype=np.float64)
+        volumes = water_balance.integrate_flow(timestamps, np.full(len(timestamps), 60.0), 0, 3600, 2)
+        np.testing.assert_allclose(volumes, [3600.0, 3600.0])
+
+    def test_segment_is_split_at_the_bucket_edge(self):
+        # 0 -> 60 L/min across the edge at 3600s, so 30 L/min at the edge
+        volumes = water_balance.integrate_flow(np.array([3300.0, 3900.0]), np.array([0.0, 60.0]), 0, 3600, 2)
+        np.testing.assert_allclose(volumes, [75.0, 225.0])
+
+    def test_gap_longer_than_max_gap_contributes_nothing(self):
+        timestamps = np.array([0.0, 600.0, 2600.0, 3000.0])
+        volumes = water_balance.integrate_flow(timestamps, np.full(4, 60.0), 0, 3600, 1, max_gap=900)
+        np.testing.assert_allclose(volumes, [1000.0])
+
+    def test_leak_loss_covers_the_time_each_leak_was_open(self):
+        origin = timezone.now().replace(minute=0, second=0, microsecond=0)
+        leaks = [
+            # 120 L/hr for the second half of hour 0 and the first half of hour 1
+            (origin + timedelta(minutes=30), origin + timedelta(minutes=90), 120.0),
+            # Still open at now, 30 minutes into hour 1
+            (origin + timedelta(hours=1), None, 60.0),
+        ]
+        volumes = water_balance.leak_losses(
+            leaks, origin.timestamp(), 3600, 2, origin + timedelta(minutes=90),
+        )
+        np.testing.assert_allclose(volumes, [60.0, 90.0])
+
+
+class ZoneBalanceTests(TestCase):
+    def setUp(self):
+        self.hour = rollups.floor_to_resolution(timezone.now() - timedelta(hours=3), 'HOUR')
+        self.zone = WaterConsumptionZone.objects.create(
+            name='Zone', zone_type='RESIDENTIAL', contact_person='Operator',
+            contact_email='operator@example.com', contact_phone='0000000000',
+        )
+        self.main = self.add_meter('MAIN1', 'MUNICIPAL', 30.0)
+        self.homes = [self.add_meter(f'HOME{i}', 'RESIDENTIAL', 10.0) for i in range(2)]
+        leak = LeakDetection.objects.create(
+            sensor=self.homes[0], severity='LOW', estimated_loss_rate=60.0, confidence_score=0.8,
+        )
+        # Open for the second half of the first hour and the first half of the next
+        LeakDetection.objects.filter(pk=leak.pk).update(
+            detected_at=self.hour + timedelta(minutes=30), resolved_at=self.hour + timedelta(minutes=90),
+        )
+
+    def add_meter(self, device_id, deployment_type, flow):
+        sensor = SensorDevice.objects.create(
+            device_id=device_id, sensor_type='FLOW', deployment_type=deployment_type, location='Zone street',
+        )
+        self.zone.sensors.add(sensor)
+        # Every 10 minutes across the first hour, edges included
+        SensorReading.objects.bulk_create([
+            SensorReading(sensor=sensor, flow_rate=flow, timestamp=self.hour + timedelta(minutes=10 * i))
+            for i in range(7)
+        ])
+        return sensor
+
+    def balances(self, resolution='HOUR'):
+        return list(ZoneBalance.objects.filter(zone=self.zone, resolution=resolution).order_by('bucket').values_list(
+            'bucket', 'inflow_volume', 'outflow_volume', 'leak_loss_volume',
+        ))
+
+    def compute(self):
+        return water_balance.compute_zone_balances(self.hour, self.hour + timedelta(hours=2))
+
+    def test_meters_and_leaks_are_attributed_to_their_buckets(self):
+        # One sensor per query, so the readings of each batch are split correctly
+        with mock.patch.object(water_balance, 'SENSOR_BATCH', 1):
+            self.assertEqual(self.compute(), 2)
+        self.assertEqual(self.balances(), [
+            (self.hour, 1800.0, 1200.0, 30.0),
+            (self.hour + timedelta(hours=1), 0.0, 0.0, 30.0),
+        ])
+        days = self.balances('DAY')
+        self.assertEqual([sum(day[i] for day in days) for i in (1, 2, 3)], [1800.0, 1200.0, 60.0])
+
+    def test_recompute_replaces_totals_and_drops_emptied_buckets(self):
+        self.compute()
+        LeakDetection.objects.all().delete()
+        SensorReading.objects.filter(sensor=self.main).update(flow_rate=60.0)
+
+        self.assertEqual(self.compute(), 1)
+        self.assertEqual(self.balances(), [(self.hour, 3600.0, 1200.0, 0.0)])
+        self.assertEqual(ZoneBalance.objects.filter(resolution='HOUR').count(), 1)
+        totals = water_balance.zone_totals(self.hour, self.hour + timedelta(hours=2))[self.zone.id]
+        self.assertEqual((totals['nrw'], totals['nrw_percentage']), (2400.0, 2400.0 / 3600.0 * 100))
+
+    def test_concurrent_run_is_upserted(self):
+        # A row another run wrote between this run's delete and insert
+        ZoneBalance.objects.create(zone=self.zone, resolution='HOUR', bucket=self.hour, inflow_volume=1.0)
+        water_balance._upsert([ZoneBalance(
+            zone=self.zone, resolution='HOUR', bucket=self.hour,
+            inflow_volume=1800.0, outflow_volume=1200.0, leak_loss_volume=30.0,
+        )])
+        self.assertEqual(self.balances(), [(self.hour, 1800.0, 1200.0, 30.0)])
+
+
+class CeleryConfigTests(TestCase):
+    def queue(self, task_name):
+        return app.amqp.router.route({}, task_name)['queue'].name
+
+    def test_tasks_are_routed_to_their_queues(self):
+        routes = {
+            'analytics.tasks.drain_reading_outbox': 'scoring',
+            'analytics.tasks.score_reading_batch': 'scoring',
+            'analytics.tasks.train_sensor_model': 'training',
+            'analytics.tasks.train_all_models': 'training',
+            'analytics.tasks.update_rollups': 'reports',
+            'analytics.tasks.update_zone_balances': 'reports',
+            'sensors.tasks.sweep_fleet_health': 'reports',
+        }
+        for task_name, queue in routes.items():
+            with self.subTest(task_name):
+                self.assertEqual(self.queue(task_name), queue)
+
+    def worker(self, *queues):
+        # Sized by the -c/--prefetch-multiplier flags
+        worker = mock.Mock(concurrency=8, prefetch_multiplier=4)
+        worker.app.amqp.queues.consume_from = {queue: None for queue in queues}
+        return worker
+
+    def test_single_queue_worker_takes_its_profile(self):
+        for queue, profile in settings.CELERY_WORKER_PROFILES.items():
+            with self.subTest(queue):
+                worker = self.worker(queue)
+                worker_init.send(sender=worker)
+                self.assertEqual(
+                    (worker.concurrency, worker.prefetch_multiplier),
+                    (profile['concurrency'], profile['prefetch_multiplier']),
+                )
+
+    def test_multi_queue_worker_keeps_its_flags(self):
+        worker = self.worker('scoring', 'reports')
+        worker_init.send(sender=worker)
+        self.assertEqual((worker.concurrency, worker.prefetch_multiplier), (8, 4))
+
+    def test_settings_refuse_a_queued_setup_without_a_broker(self):
+        env = {key: value for key, value in os.environ.items() if key != 'CELERY_BROKER_URL'}
+        env['CELERY_TASK_ALWAYS_EAGER'] = '0'
+        result = subprocess.run(
+            [sys.executable, '-c', 'import jalraksha.settings'],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn('CELERY_BROKER_URL must be set', result.stderr)
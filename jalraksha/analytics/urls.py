@@ -5,6 +5,8 @@ app_name = 'analytics'
 
 urlpatterns = [
     path('', views.analytics_dashboard, name='dashboard'),
+    path('advanced/', views.advanced_dashboard, name='advanced_dashboard'),
+    path('series/', views.series_data, name='series_data'),
     path('leaks/', views.leak_list, name='leak_list'),
     path('consumption/', views.consumption_patterns, name='consumption_patterns'),
 ]
\ No newline at end of file
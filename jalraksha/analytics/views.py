@@ -1,35 +1,49 @@
 from django.shortcuts import render, get_object_or_404
-from django.db.models import Count, Avg, Sum, Max, Min
+from django.http import JsonResponse
 from django.utils import timezone
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone as dt_timezone
+from rest_framework.exceptions import ValidationError
 from .models import LeakDetection, ConsumptionPattern
-from sensors.models import SensorDevice, SensorReading
+from .kpis import kpi_service
+from .downsampling import METHODS, ROLLUP_PREFIX, reading_series, reading_series_many
+from sensors.models import SensorDevice
+from sensors.filters import parse_time_param, split_param
+from sensors.registry import device_registry
 import json
 
+MAX_SERIES_POINTS = 5000
+# Points per line on the advanced dashboard charts
+DASHBOARD_POINTS = 200
+
 def analytics_dashboard(request):
-    total_leaks = LeakDetection.objects.count()
-    active_leaks = LeakDetection.objects.filter(status__in=['DETECTED', 'INVESTIGATING', 'CONFIRMED']).count()
-    
-    # Leaks by severity
-    leaks_by_severity = LeakDetection.objects.values('severity').annotate(count=Count('id'))
+    kpis = kpi_service.leak_kpis()
     
     # Recent leaks
     recent_leaks = LeakDetection.objects.select_related('sensor').all()[:10]
     
-    # Total water loss
-    total_loss = LeakDetection.objects.filter(
-        status__in=['DETECTED', 'INVESTIGATING', 'CONFIRMED']
-    ).aggregate(total=Sum('estimated_loss_rate'))['total'] or 0
-    
     context = {
-        'total_leaks': total_leaks,
-        'active_leaks': active_leaks,
-        'leaks_by_severity': leaks_by_severity,
+        'total_leaks': kpis['total_leaks'],
+        'active_leaks': kpis['active_leaks'],
+        'leaks_by_severity': kpis['leaks_by_severity'],
         'recent_leaks': recent_leaks,
-        'total_loss': total_loss,
+        'total_loss': kpis['total_loss'],
     }
     return render(request, 'analytics/dashboard.html', context)
 
+def chart_series(fields, start, end):
+    """Chart.js labels/values for downsampled reading series, one per field"""
+    label_format = '%H:%M' if end - start <= timedelta(days=1) else '%d %b %H:%M'
+    charts = {}
+    for field, data in reading_series_many(fields, start, end, points=DASHBOARD_POINTS).items():
+        charts[field] = {
+            'labels': [
+                timezone.localtime(datetime.fromtimestamp(ms / 1000, tz=dt_timezone.utc)).strftime(label_format)
+                for ms in data['timestamps']
+            ],
+            'values': data['values'],
+        }
+    return charts
+
 def advanced_dashboard(request):
     """Advanced Analytics Dashboard with real sensor data"""
     
@@ -38,134 +52,78 @@ def advanced_dashboard(request):
     
     # Time range filter (default: 24 hours)
     time_range = request.GET.get('range', '24h')
-    if time_range == '24h':
-        time_delta = timedelta(hours=24)
-    elif time_range == '7d':
+    if time_range == '7d':
         time_delta = timedelta(days=7)
     elif time_range == '30d':
         time_delta = timedelta(days=30)
     else:
+        time_range = '24h'
         time_delta = timedelta(hours=24)
     
     start_time = timezone.now() - time_delta
     
-    # Get readings for all sensors
-    readings = SensorReading.objects.filter(
-        timestamp__gte=start_time
-    ).select_related('sensor')
-    
-    # Calculate KPIs
-    total_flow = readings.aggregate(
-        total=Sum('flow_rate')
-    )['total'] or 0
-    
-    avg_pressure = readings.aggregate(
-        avg=Avg('pressure')
-    )['avg'] or 0
+    # Cached KPIs: leak totals are invalidated on writes, flow totals expire
+    leak_kpis = kpi_service.leak_kpis()
+    flow_kpis = kpi_service.flow_kpis(time_range, time_delta)
+    total_flow = flow_kpis['total_flow']
+    active_leaks_count = leak_kpis['active_leaks']
+    total_loss = leak_kpis['total_loss']
     
-    # Get active leaks
-    active_leaks_count = LeakDetection.objects.filter(
-        status__in=['DETECTED', 'INVESTIGATING', 'CONFIRMED']
-    ).count()
-    
-    total_loss = LeakDetection.objects.filter(
-        status__in=['DETECTED', 'INVESTIGATING', 'CONFIRMED']
-    ).aggregate(total=Sum('estimated_loss_rate'))['total'] or 0
-    
-    # Calculate NRW percentage (Non-Revenue Water)
-    nrw_percentage = (total_loss / total_flow * 100) if total_flow > 0 else 0
+    # Non-Revenue Water from the per-zone balances: metered inflow that
+    # never reached a consumer meter
+    nrw_percentage = flow_kpis['nrw_percentage'] or 0
     
     # Calculate efficiency score
     efficiency_score = max(0, 100 - nrw_percentage) if nrw_percentage > 0 else 95
     
-    # Prepare chart data for Flow Rate (last 24 hours)
-    flow_readings = list(readings.filter(
-        timestamp__gte=timezone.now() - timedelta(hours=24)
-    ).order_by('timestamp')[:24])
+    # Flow and pressure over the whole selected range, downsampled so the
+    # payload stays small however many readings the range holds
+    charts = chart_series(('flow_rate', 'pressure'), start_time, start_time + time_delta)
+    flow_rate_data = charts['flow_rate']
+    pressure_data = charts['pressure']
     
-    # If no readings, generate sample data for visualization
-    if not flow_readings:
-        flow_rate_data = {
-            'labels': [f'{i}:00' for i in range(24)],
-            'values': [20 + (i % 5) * 2 for i in range(24)]
-        }
-        pressure_data = {
-            'labels': [f'{i}:00' for i in range(24)],
-            'values': [40 + (i % 5) * 3 for i in range(24)]
-        }
-    else:
-        flow_rate_data = {
-            'labels': [r.timestamp.strftime('%H:%M') for r in flow_readings],
-            'values': [float(r.flow_rate) if r.flow_rate else 0 for r in flow_readings]
-        }
-        
-        # Prepare chart data for Pressure
-        pressure_data = {
-            'labels': [r.timestamp.strftime('%H:%M') for r in flow_readings],
-            'values': [float(r.pressure) if r.pressure else 0 for r in flow_readings]
-        }
-    
-    # Consumption pattern by hour
-    consumption_by_hour = {}
-    for reading in readings:
-        hour = reading.timestamp.hour
-        hour_key = f"{hour:02d}:00"
-        if hour_key not in consumption_by_hour:
-            consumption_by_hour[hour_key] = 0
-        consumption_by_hour[hour_key] += reading.flow_rate if reading.flow_rate else 0
+    # Consumption by hour of day and per-sensor statistics come from the
+    # hourly rollups, cached with the other KPIs for the selected range
+    usage_kpis = kpi_service.usage_kpis(time_range, time_delta)
+    consumption_by_hour = usage_kpis['consumption_by_hour']
     
     consumption_data = {
         'labels': list(consumption_by_hour.keys()),
         'values': list(consumption_by_hour.values())
     }
     
-    # Leak detection data by severity
-    leak_severity_data = LeakDetection.objects.values('severity').annotate(
-        count=Count('id')
-    )
-    
     leak_data = {
-        'labels': [item['severity'] for item in leak_severity_data],
-        'values': [item['count'] for item in leak_severity_data]
+        'labels': [item['severity'] for item in leak_kpis['leaks_by_severity']],
+        'values': [item['count'] for item in leak_kpis['leaks_by_severity']]
     }
     
-    # Sensor status data
-    active_sensors = sensors.filter(is_active=True).count()
-    warning_sensors = sensors.filter(
-        readings__battery_level__lt=30,
-        is_active=True
-    ).distinct().count()
-    offline_sensors = sensors.filter(is_active=False).count()
-    
+    sensor_kpis = kpi_service.sensor_kpis()
     sensor_status_data = {
         'labels': ['Active', 'Warning', 'Offline'],
-        'values': [active_sensors, warning_sensors, offline_sensors]
+        'values': [sensor_kpis['active_sensors'], sensor_kpis['warning_sensors'], sensor_kpis['offline_sensors']]
     }
     
-    # Sensor statistics
+    # Sensor statistics and leak counts both come cached
+    per_sensor = usage_kpis['per_sensor']
+    leak_counts = leak_kpis['leaks_by_sensor']
+    
     sensor_stats = []
     for sensor in sensors:
-        sensor_readings = readings.filter(sensor=sensor)
+        stats = per_sensor.get(sensor.id)
+        if stats is None:
+            continue
         
-        if sensor_readings.exists():
-            stats = sensor_readings.aggregate(
-                avg_flow=Avg('flow_rate'),
-                peak_flow=Max('flow_rate'),
-                avg_pressure=Avg('pressure'),
-                min_battery=Min('battery_level')
-            )
-            
-            sensor_stats.append({
-                'device_id': sensor.device_id,
-                'location': sensor.location,
-                'avg_flow': stats['avg_flow'] or 0,
-                'peak_flow': stats['peak_flow'] or 0,
-                'avg_pressure': stats['avg_pressure'] or 0,
-                'uptime': 98.5,  # Calculate based on readings frequency
-                'reliability': 95,  # Calculate based on data quality
-                'alert_count': LeakDetection.objects.filter(sensor=sensor).count(),
-                'is_active': sensor.is_active
-            })
+        sensor_stats.append({
+            'device_id': sensor.device_id,
+            'location': sensor.location,
+            'avg_flow': stats['avg_flow'] or 0,
+            'peak_flow': stats['peak_flow'] or 0,
+            'avg_pressure': stats['avg_pressure'] or 0,
+            'uptime': 98.5,  # Calculate based on readings frequency
+            'reliability': 95,  # Calculate based on data quality
+            'alert_count': leak_counts.get(sensor.id, 0),
+            'is_active': sensor.is_active
+        })
     
     context = {
         'sensors': sensors,
@@ -182,7 +140,49 @@ def advanced_dashboard(request):
         'sensor_status_data': json.dumps(sensor_status_data),
     }
     
-    return render(request, 'analytics/advanced_dashboard.html', context)
+    return render(request, 'analytics/dashboard.html', context)
+
+def series_data(request):
+    """
+    Downsampled reading series for charts as JSON.
+    
+    Query parameters (all optional):
+      field   flow_rate (default), pressure or temperature
+      sensor  comma list of device ids (default: all sensors)
+      since   ISO-8601 or epoch seconds (default: 24 hours ago)
+      until   ISO-8601 or epoch seconds (default: now)
+      points  maximum points returned (default 300, at most MAX_SERIES_POINTS)
+      method  lttb (default) or minmax
+    """
+    field = request.GET.get('field', 'flow_rate')
+    if field not in ROLLUP_PREFIX:
+        return JsonResponse({'field': [f'Must be one of {", ".join(ROLLUP_PREFIX)}.']}, status=400)
+    method = request.GET.get('method', 'lttb')
+    if method not in METHODS:
+        return JsonResponse({'method': [f'Must be one of {", ".join(METHODS)}.']}, status=400)
+    try:
+        points = min(max(int(request.GET.get('points', 300)), 3), MAX_SERIES_POINTS)
+    except ValueError:
+        return JsonResponse({'points': ['A valid integer is required.']}, status=400)
+    
+    try:
+        end = parse_time_param(request.GET, 'until') or timezone.now()
+        start = parse_time_param(request.GET, 'since') or end - timedelta(hours=24)
+    except ValidationError as e:
+        return JsonResponse(e.detail, status=400)
+    except OverflowError:
+        return JsonResponse({'until': ['Too early for the default 24 hour window.']}, status=400)
+    if start >= end:
+        return JsonResponse({'until': ['Must be later than since.']}, status=400)
+    
+    sensor_ids = None
+    device_ids = split_param(request.GET.get('sensor'))
+    if device_ids:
+        sensor_ids = [sensor.pk for sensor in device_registry.get_many(device_ids).values()]
+    
+    data = reading_series(field, start, end, sensor_ids=sensor_ids, points=points, method=method)
+    data.update(field=field, method=method)
+    return JsonResponse(data)
 
 def leak_list(request):
     leaks = LeakDetection.objects.select_related('sensor').all()
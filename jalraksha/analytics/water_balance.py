@@ -0,0 +1,268 @@
+"""
+Zone water balance and non-revenue water (NRW).
+
+Each zone's sensors are split by role: municipal flow sensors meter water
+into the zone, residential flow sensors meter what consumers draw. For
+every hour bucket ``compute_zone_balances`` integrates the flow-rate
+samples of each meter over time (trapezoids, split at the bucket edges,
+never bridging a gap longer than ``MAX_GAP``), sums them per zone, and adds
+the loss of the zone's detected leaks over the time each was open. Days
+are summed from the hours.
+
+Readings are fetched a batch of sensors at a time as plain tuples and
+integrated with NumPy, and the results are upserted into ZoneBalance so
+dashboards and ``zones_list`` never read raw readings.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.db.models.functions import TruncDay
+from django.utils import timezone
+from .models import ACTIVE_LEAKS, LeakDetection, ZoneBalance
+from .rollups import RESOLUTION_SECONDS, floor_to_resolution
+
+BALANCE_SETTINGS = getattr(settings, 'ZONE_BALANCE', {})
+
+# Samples further apart than this (seconds) are treated as an outage
+MAX_GAP = BALANCE_SETTINGS.get('MAX_GAP', 900)
+# Sensors whose readings are fetched per query
+SENSOR_BATCH = BALANCE_SETTINGS.get('SENSOR_BATCH', 50)
+
+# deployment_type -> side of the balance a flow sensor meters
+METER_ROLES = {
+    'MUNICIPAL': 'inflow',
+    'RESIDENTIAL': 'outflow',
+}
+
+VOLUME_FIELDS = ['inflow_volume', 'outflow_volume', 'leak_loss_volume']
+
+
+def integrate_flow(timestamps, flow_rates, origin, bucket_seconds, buckets, max_gap=MAX_GAP):
+    """
+    Liters per bucket from a flow-rate series.
+
+    ``timestamps`` are epoch seconds in ascending order and ``flow_rates``
+    are in L/min. Bucket i covers [origin + i * bucket_seconds, +bucket_seconds).
+    Each segment between consecutive samples contributes its trapezoid area,
+    cut at bucket edges by linear interpolation; segments longer than
+    ``max_gap`` contribute nothing. Returns an array of length ``buckets``.
+    """
+    volumes = np.zeros(buckets)
+    if len(timestamps) < 2:
+        return volumes
+    end = origin + buckets * bucket_seconds
+    edges = origin + bucket_seconds * np.arange(1, buckets)
+    edges = edges[(edges > timestamps[0]) & (edges < timestamps[-1])]
+
+    # Sample times plus bucket edges; flow at an edge is interpolated
+    points = np.union1d(timestamps, edges)
+    rates = np.interp(points, timestamps, flow_rates)
+    # The raw segment each sub-segment falls in, to apply the gap rule
+    segment = np.searchsorted(timestamps, points[:-1], side='right') - 1
+    gaps = timestamps[segment + 1] - timestamps[segment]
+
+    starts = points[:-1]
+    liters = np.diff(points) * (rates[:-1] + rates[1:]) / 2 / 60
+    keep = (gaps <= max_gap) & (starts >= origin) & (starts < end)
+    index = ((starts[keep] - origin) // bucket_seconds).astype(int)
+    np.add.at(volumes, index, liters[keep])
+    return volumes
+
+
+def leak_losses(leaks, origin, bucket_seconds, buckets, now):
+    """
+    Liters per bucket lost to ``leaks``, given as (detected_at, resolved_at,
+    loss L/hr) tuples; a leak without resolved_at is still losing at ``now``.
+    """
+    if not leaks:
+        return np.zeros(buckets)
+    opened = np.array([detected.timestamp() for detected, _, _ in leaks])
+    closed = np.array([(resolved or now).timestamp() for _, resolved, _ in leaks])
+    rates = np.array([rate or 0.0 for _, _, rate in leaks])
+
+    bucket_starts = origin + bucket_seconds * np.arange(buckets)
+    overlap = (
+        np.minimum(closed[:, None], bucket_starts + bucket_seconds)
+        - np.maximum(opened[:, None], bucket_starts)
+    ).clip(min=0)
+    return rates @ overlap / 3600
+
+
+def _zone_meters():
+    """{zone_id: {'inflow': [sensor ids], 'outflow': [...], 'all': [...]}}"""
+    from sensors.models import WaterConsumptionZone
+
+    meters = {}
+    for zone_id, sensor_id, sensor_type, deployment_type in (
+        WaterConsumptionZone.sensors.through.objects.values_list(
+            'waterconsumptionzone_id', 'sensordevice_id',
+            'sensordevice__sensor_type', 'sensordevice__deployment_type',
+        )
+    ):
+        roles = meters.setdefault(zone_id, {'inflow': [], 'outflow': [], 'all': []})
+        roles['all'].append(sensor_id)
+        role = METER_ROLES.get(deployment_type)
+        if role and sensor_type == 'FLOW':
+            roles[role].append(sensor_id)
+    return meters
+
+
+def _sensor_volumes(sensor_ids, origin, bucket_seconds, buckets, end):
+    """{sensor_id: liters per bucket} for the given flow meters"""
+    from sensors.models import SensorReading
+
+    start = datetime.fromtimestamp(origin, tz=dt_timezone.utc)
+    volumes = {}
+    for offset in range(0, len(sensor_ids), SENSOR_BATCH):
+        batch = sensor_ids[offset:offset + SENSOR_BATCH]
+        # Reach back one gap so the first bucket can interpolate from its left
+        rows = list(
+            SensorReading.objects.filter(
+                sensor_id__in=batch,
+                timestamp__gte=start - timedelta(seconds=MAX_GAP),
+                timestamp__lte=end,
+                flow_rate__isnull=False,
+            ).order_by('sensor_id', 'timestamp')
+            .values_list('sensor_id', 'timestamp', 'flow_rate')
+        )
+        if not rows:
+            continue
+        # Typed columns (epoch seconds for time), never an object array
+        sensor_col, time_col, rate_col = zip(*rows)
+        sensors = np.fromiter(sensor_col, np.int64, len(rows))
+        times = np.fromiter((t.timestamp() for t in time_col), np.float64, len(rows))
+        rates = np.fromiter(rate_col, np.float64, len(rows))
+
+        # Rows are grouped by sensor; split at each change of sensor_id
+        splits = np.flatnonzero(np.diff(sensors)) + 1
+        for ids, t, f in zip(np.split(sensors, splits), np.split(times, splits), np.split(rates, splits)):
+            # Duplicate timestamps would make a zero-width segment; keep the last
+            last = np.append(np.diff(t) > 0, True)
+            volumes[int(ids[0])] = integrate_flow(t[last], f[last], origin, bucket_seconds, buckets)
+    return volumes
+
+
+def compute_zone_balances(start, end=None):
+    """
+    Recompute the HOUR balances of every zone for the buckets covering
+    [start, end), then the DAY balances of the days they fall in. Returns
+    the number of hourly rows written.
+    """
+    end = end or timezone.now()
+    bucket_seconds = RESOLUTION_SECONDS['HOUR']
+    first = floor_to_resolution(start, 'HOUR')
+    origin = first.timestamp()
+    buckets = max(int(np.ceil((end.timestamp() - origin) / bucket_seconds)), 1)
+
+    meters = _zone_meters()
+    if not meters:
+        return 0
+    flow_sensors = sorted({
+        sensor_id for roles in meters.values()
+        for sensor_id in roles['inflow'] + roles['outflow']
+    })
+    volumes = _sensor_volumes(flow_sensors, origin, bucket_seconds, buckets, end)
+
+    leaks = {}
+    for sensor_id, detected_at, resolved_at, loss_rate in LeakDetection.objects.filter(
+        ACTIVE_LEAKS | Q(resolved_at__gt=first),
+        sensor_id__in={sensor_id for roles in meters.values() for sensor_id in roles['all']},
+        detected_at__lt=end,
+    ).values_list('sensor_id', 'detected_at', 'resolved_at', 'estimated_loss_rate'):
+        leaks.setdefault(sensor_id, []).append((detected_at, resolved_at, loss_rate))
+
+    zero = np.zeros(buckets)
+    rows = []
+    for zone_id, roles in meters.items():
+        inflow = sum((volumes.get(s, zero) for s in roles['inflow']), zero)
+        outflow = sum((volumes.get(s, zero) for s in roles['outflow']), zero)
+        loss = leak_losses(
+            [leak for s in set(roles['all']) for leak in leaks.get(s, [])],
+            origin, bucket_seconds, buckets, end,
+        )
+        for i in np.flatnonzero(inflow + outflow + loss):
+            rows.append(ZoneBalance(
+                zone_id=zone_id,
+                resolution='HOUR',
+                bucket=first + timedelta(seconds=int(i) * bucket_seconds),
+                inflow_volume=float(inflow[i]),
+                outflow_volume=float(outflow[i]),
+                leak_loss_volume=float(loss[i]),
+            ))
+
+    with transaction.atomic():
+        # Buckets that came out empty this time must not keep old totals
+        ZoneBalance.objects.filter(resolution='HOUR', bucket__gte=first, bucket__lt=end).delete()
+        _upsert(rows)
+        refresh_daily_balances(floor_to_resolution(first, 'DAY'), end)
+    return len(rows)
+
+
+def refresh_daily_balances(start, end):
+    """Sum the HOUR balances in [start, end) into DAY rows"""
+    daily = ZoneBalance.objects.filter(
+        resolution='HOUR', bucket__gte=start, bucket__lt=end,
+    ).annotate(day=TruncDay('bucket', tzinfo=dt_timezone.utc)).values('zone_id', 'day').annotate(
+        **{field: Sum(field) for field in VOLUME_FIELDS}
+    ).order_by()
+    rows = [
+        ZoneBalance(
+            zone_id=row['zone_id'],
+            resolution='DAY',
+            bucket=row['day'],
+            **{field: row[field] for field in VOLUME_FIELDS},
+        )
+        for row in daily
+    ]
+    with transaction.atomic():
+        ZoneBalance.objects.filter(resolution='DAY', bucket__gte=start, bucket__lt=end).delete()
+        _upsert(rows)
+    return len(rows)
+
+
+def _upsert(rows):
+    # Upsert rather than insert, in case a concurrent run got there first
+    ZoneBalance.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=['zone', 'resolution', 'bucket'],
+        update_fields=VOLUME_FIELDS + ['computed_at'],
+        batch_size=1000,
+    )
+
+
+# Buckets without inflow are left out of NRW: with no metered supply there
+# is nothing to compare consumption against
+TOTALS = {
+    'inflow': Sum('inflow_volume'),
+    'outflow': Sum('outflow_volume'),
+    'leak_loss': Sum('leak_loss_volume'),
+    'metered_outflow': Sum('outflow_volume', filter=Q(inflow_volume__gt=0)),
+}
+
+
+def balance_totals(balances):
+    """Summed volumes and NRW of a ZoneBalance queryset"""
+    return with_nrw(balances.aggregate(**TOTALS))
+
+
+def zone_totals(start, end=None):
+    """{zone_id: summed volumes and NRW} over the HOUR balances in [start, end)"""
+    balances = ZoneBalance.objects.filter(
+        resolution='HOUR', bucket__gte=floor_to_resolution(start, 'HOUR'), bucket__lt=end or timezone.now(),
+    )
+    return {
+        row.pop('zone_id'): with_nrw(row)
+        for row in balances.values('zone_id').annotate(**TOTALS).order_by()
+    }
+
+
+def with_nrw(totals):
+    """Add 'nrw' (liters) and 'nrw_percentage' (None when nothing was metered in)"""
+    totals = {key: value or 0.0 for key, value in totals.items()}
+    inflow = totals['inflow']
+    totals['nrw'] = max(inflow - totals.pop('metered_outflow'), 0.0)
+    totals['nrw_percentage'] = totals['nrw'] / inflow * 100 if inflow else None
+    return totals
@@ -0,0 +1,45 @@
+"""
+Celery application for jalraksha.
+
+Tasks are routed to three queues (see ``CELERY_TASK_ROUTES``):
+
+- ``scoring``: draining the reading outbox and scoring readings, short
+  and latency sensitive;
+- ``training``: model fits, which can run for minutes on 30 days of data;
+- ``reports``: rollups, consumption patterns, zone balances and the
+  fleet health sweep.
+
+Run one worker per queue so a long fit never holds up scoring, e.g.
+``celery -A jalraksha worker -Q training``. A worker consuming a single
+queue takes its concurrency and prefetch from ``CELERY_WORKER_PROFILES``,
+over any ``-c``/``--prefetch-multiplier`` flags. Periodic jobs come from
+``CELERY_BEAT_SCHEDULE`` (``celery -A jalraksha beat``).
+
+By default (``CELERY_TASK_ALWAYS_EAGER=1``) tasks run in the calling
+process, so local development needs neither Redis nor a worker.
+Deployed services set it to 0, and settings refuse to load without a
+``CELERY_BROKER_URL`` then, rather than queue tasks no worker will see.
+"""
+import os
+from celery import Celery
+from celery.signals import worker_init
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'jalraksha.settings')
+
+app = Celery('jalraksha')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
+
+
+@worker_init.connect
+def apply_queue_profile(sender=None, **kwargs):
+    """Size a worker for the one queue it consumes, before its pool starts"""
+    from django.conf import settings
+
+    consuming = sender.app.amqp.queues.consume_from or {}
+    if len(consuming) != 1:
+        return
+    profile = getattr(settings, 'CELERY_WORKER_PROFILES', {}).get(next(iter(consuming)))
+    if profile:
+        sender.concurrency = profile['concurrency']
+        sender.prefetch_multiplier = profile['prefetch_multiplier']
@@ -1,11 +1,13 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from . import api_views
+from . import api_views, export_views
 
 router = DefaultRouter()
 router.register(r'sensors', api_views.SensorDeviceViewSet)
 router.register(r'readings', api_views.SensorReadingViewSet)
 
 urlpatterns = [
+    path('metrics/', api_views.ingest_metrics, name='ingest_metrics'),
+    path('readings/export/', export_views.export_readings, name='export_readings'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
@@ -1,10 +1,20 @@
 from rest_framework import viewsets, status
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from django.utils import timezone
 from datetime import timedelta
 from .models import SensorDevice, SensorReading
-from .serializers import SensorDeviceSerializer, SensorReadingSerializer, SensorReadingCreateSerializer
+from .serializers import (
+    SensorDeviceSerializer, SensorReadingSerializer, SensorReadingListSerializer, SensorReadingCreateSerializer
+)
+from .ingest import find_duplicate, ingest_batch, store_readings, validate_rows, MAX_BATCH_SIZE
+from .registry import device_registry
+from .writebehind import WRITE_BEHIND_SETTINGS, reading_buffer, to_row
+from .parsers import MessagePackParser, PackedReadingParser
+from .filters import filter_readings, split_param
+from .pagination import ReadingCursorPagination
 
 class SensorDeviceViewSet(viewsets.ModelViewSet):
     queryset = SensorDevice.objects.all()
@@ -13,16 +23,131 @@ class SensorDeviceViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def recent_readings(self, request, pk=None):
         sensor = self.get_object()
-        hours = int(request.query_params.get('hours', 24))
-        since = timezone.now() - timedelta(hours=hours)
-        readings = sensor.readings.filter(timestamp__gte=since)
-        serializer = SensorReadingSerializer(readings, many=True)
-        return Response(serializer.data)
+        readings = filter_readings(sensor.readings.all(), request.query_params)
+        if 'since' not in request.query_params:
+            try:
+                hours = int(request.query_params.get('hours', 24))
+            except ValueError:
+                raise ValidationError({'hours': ['A valid integer is required.']})
+            readings = readings.filter(timestamp__gte=timezone.now() - timedelta(hours=hours))
+        
+        serializer = SensorReadingListSerializer(fields=requested_fields(request))
+        paginator = ReadingCursorPagination()
+        page = paginator.paginate_queryset(serializer.values(readings), request, view=self)
+        return paginator.get_paginated_response(serializer.to_representation(page))
+
+def requested_fields(request):
+    return split_param(request.query_params.get('fields')) or None
 
 class SensorReadingViewSet(viewsets.ModelViewSet):
-    queryset = SensorReading.objects.all()
+    """
+    Readings, newest first. The list is cursor-paginated and accepts
+    ``sensor`` (device ids), ``since``, ``until`` (ISO-8601 or epoch
+    seconds), ``fields`` and ``page_size`` query parameters.
+    """
+    queryset = SensorReading.objects.select_related('sensor')
+    pagination_class = ReadingCursorPagination
+    # JSON, MessagePack or packed binary records for create and batch
+    parser_classes = api_settings.DEFAULT_PARSER_CLASSES + [MessagePackParser, PackedReadingParser]
+    
+    def list(self, request, *args, **kwargs):
+        serializer = SensorReadingListSerializer(fields=requested_fields(request))
+        readings = filter_readings(SensorReading.objects.all(), request.query_params)
+        page = self.paginate_queryset(serializer.values(readings))
+        return self.get_paginated_response(serializer.to_representation(page))
     
     def get_serializer_class(self):
         if self.action == 'create':
             return SensorReadingCreateSerializer
-        return SensorReadingSerializer
\ No newline at end of file
+        return SensorReadingSerializer
+    
+    def get_serializer(self, *args, **kwargs):
+        if self.action == 'retrieve':
+            kwargs['fields'] = requested_fields(self.request)
+        return super().get_serializer(*args, **kwargs)
+    
+    def create(self, request, *args, **kwargs):
+        """
+        Store one reading, validated exactly like a batch row. A replay of
+        a stored (device_ts, seq) answers 200 with status 'duplicate'. With
+        the write-behind buffer enabled a new reading is acknowledged with
+        202 and written with other buffered readings a moment later.
+        """
+        data = request.data
+        if isinstance(data, list):
+            # A packed body always parses to a list of records
+            if len(data) != 1:
+                return Response(
+                    {'detail': 'Expected one reading; post several to the batch endpoint.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            data = data[0]
+        now = timezone.now()
+        results, pending = validate_rows([data], now)
+        if not pending:
+            raise ValidationError(results[0]['errors'])
+        _, reading = pending[0]
+        
+        if WRITE_BEHIND_SETTINGS.get('ENABLED', False):
+            reading.pk = find_duplicate(reading)
+            if reading.pk is not None:
+                return self.created(reading, 'duplicate')
+            reading_buffer.submit(to_row(reading, now))
+            return self.created(reading, 'queued')
+        
+        row_status, = store_readings([reading])
+        return self.created(reading, row_status)
+    
+    def created(self, reading, row_status):
+        response_status = {
+            'accepted': status.HTTP_201_CREATED,
+            'queued': status.HTTP_202_ACCEPTED,
+        }.get(row_status, status.HTTP_200_OK)
+        return Response(
+            {**SensorReadingCreateSerializer(reading).data, 'status': row_status},
+            status=response_status
+        )
+    
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """Ingest an array of readings from one or many devices"""
+        rows = request.data
+        if isinstance(rows, dict):
+            rows = rows.get('readings')
+        if not isinstance(rows, list) or not rows:
+            return Response(
+                {'detail': 'Expected a non-empty list of readings.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(rows) > MAX_BATCH_SIZE:
+            return Response(
+                {'detail': f'Batch too large, at most {MAX_BATCH_SIZE} readings per request.'},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+        
+        results = ingest_batch(rows)
+        accepted = sum(1 for r in results if r['status'] == 'accepted')
+        duplicates = sum(1 for r in results if r['status'] == 'duplicate')
+        rejected = len(results) - accepted - duplicates
+        
+        if not rejected:
+            response_status = status.HTTP_201_CREATED
+        elif accepted or duplicates:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        
+        return Response({
+            'accepted': accepted,
+            'duplicates': duplicates,
+            'rejected': rejected,
+            'results': results,
+        }, status=response_status)
+
+@api_view(['GET'])
+def ingest_metrics(request):
+    """Runtime counters for the ingest path of this worker process"""
+    return Response({
+        'device_registry': device_registry.stats(),
+        'write_behind': reading_buffer.stats(),
+    })
@@ -0,0 +1,81 @@
+import asyncio
+import json
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
+from .events import broker, EVENT_TYPES, PRIORITY_ORDER
+from .models import SensorDevice
+
+# Comment line sent when idle so proxies keep the connection open
+HEARTBEAT_SECONDS = 15
+
+
+def _split(value):
+    return [item.strip() for item in value.split(',') if item.strip()] if value else []
+
+
+def resolve_sensor_ids(device_ids, zone_ids):
+    """Primary keys for the requested sensors and zones, or None for all sensors"""
+    if not device_ids and not zone_ids:
+        return None
+    sensor_ids = set()
+    if device_ids:
+        sensor_ids.update(
+            SensorDevice.objects.filter(device_id__in=device_ids).values_list('id', flat=True)
+        )
+    if zone_ids:
+        sensor_ids.update(
+            SensorDevice.objects.filter(zones__id__in=zone_ids).values_list('id', flat=True)
+        )
+    return sensor_ids
+
+
+async def event_stream(request):
+    """
+    Server-Sent Events stream of new readings, leaks and alerts.
+    
+    Query parameters (all optional):
+      types     comma list of reading, leak, alert
+      sensor    comma list of device ids
+      zone      comma list of zone ids
+      priority  minimum alert priority (LOW, MEDIUM, HIGH, URGENT)
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(
+            'Live events need the ASGI server (jalraksha.asgi:application).',
+            status=501,
+            content_type='text/plain'
+        )
+    
+    types = _split(request.GET.get('types')) or list(EVENT_TYPES)
+    if any(t not in EVENT_TYPES for t in types):
+        return HttpResponseBadRequest(f'types must be drawn from {", ".join(EVENT_TYPES)}')
+    
+    priority = request.GET.get('priority', '').upper() or None
+    if priority and priority not in PRIORITY_ORDER:
+        return HttpResponseBadRequest(f'priority must be one of {", ".join(PRIORITY_ORDER)}')
+    
+    zone_ids = _split(request.GET.get('zone'))
+    if not all(z.isdigit() for z in zone_ids):
+        return HttpResponseBadRequest('zone must be a comma list of zone ids')
+    
+    sensor_ids = await sync_to_async(resolve_sensor_ids)(_split(request.GET.get('sensor')), zone_ids)
+    
+    async def stream():
+        subscription = broker.subscribe(types=types, sensor_ids=sensor_ids, min_priority=priority)
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event['data'], default=str)}\n\n"
+        finally:
+            broker.unsubscribe(subscription)
+    
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
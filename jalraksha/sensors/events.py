@@ -0,0 +1,178 @@
+"""
+Live event fan-out for the Server-Sent Events endpoint.
+
+Writers call ``publish`` from any thread. Each process holds one
+``EventBroker`` that hands every event to the subscribed SSE streams in
+that process, so an event costs one fan-out however many dashboards are
+open. When ``LIVE_EVENTS['REDIS_URL']`` is set, events go through a Redis
+pub/sub channel instead, and each process runs a single listener that
+feeds its local subscribers. This way events written by Celery workers
+and other web workers reach every browser.
+"""
+import asyncio
+import json
+import threading
+from django.conf import settings
+
+EVENT_SETTINGS = getattr(settings, 'LIVE_EVENTS', {})
+EVENT_TYPES = ('reading', 'leak', 'alert')
+PRIORITY_ORDER = {'LOW': 0, 'MEDIUM': 1, 'HIGH': 2, 'URGENT': 3}
+
+
+class Subscription:
+    """One SSE client: a bounded queue plus the filters it asked for"""
+
+    def __init__(self, loop, types=None, sensor_ids=None, min_priority=None, max_queue=256):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.types = set(types or EVENT_TYPES)
+        self.sensor_ids = set(sensor_ids) if sensor_ids is not None else None
+        self.min_priority = PRIORITY_ORDER.get(min_priority) if min_priority else None
+        self.dropped = 0
+
+    def matches(self, event):
+        if event['type'] not in self.types:
+            return False
+        data = event['data']
+        if self.sensor_ids is not None and 'sensor_id' in data and data['sensor_id'] not in self.sensor_ids:
+            return False
+        if self.min_priority is not None and event['type'] == 'alert':
+            return PRIORITY_ORDER.get(data.get('priority'), 0) >= self.min_priority
+        return True
+
+    def offer(self, event):
+        """Called on the subscriber's loop; slow clients lose their oldest events"""
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+
+class EventBroker:
+    def __init__(self, redis_url=None, channel='jalraksha:events'):
+        self.redis_url = redis_url
+        self.channel = channel
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self._redis = None
+        self._listener = None
+
+    def publish(self, event_type, data):
+        """Publish an event from any thread or process"""
+        event = {'type': event_type, 'data': data}
+        if self.redis_url:
+            self._redis_client().publish(self.channel, json.dumps(event, default=str))
+        else:
+            self.dispatch(event)
+
+    def publish_many(self, event_type, items):
+        """Publish several events of one type with a single Redis round-trip"""
+        events = [{'type': event_type, 'data': data} for data in items]
+        if not events:
+            return
+        if self.redis_url:
+            pipe = self._redis_client().pipeline(transaction=False)
+            for event in events:
+                pipe.publish(self.channel, json.dumps(event, default=str))
+            pipe.execute()
+        else:
+            for event in events:
+                self.dispatch(event)
+
+    def dispatch(self, event):
+        """Hand an event to every matching local subscriber"""
+        with self._lock:
+            targets = [s for s in self._subscriptions if s.matches(event)]
+        for subscription in targets:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, event)
+            except RuntimeError:
+                # Loop already closed; the stream's finally block will unsubscribe
+                pass
+
+    def subscribe(self, **filters):
+        subscription = Subscription(asyncio.get_running_loop(), **filters)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        if self.redis_url and (self._listener is None or self._listener.done()):
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscriptions)
+
+    def _redis_client(self):
+        if self._redis is None:
+            import redis
+
+            self._redis = redis.Redis.from_url(self.redis_url)
+        return self._redis
+
+    async def _listen(self):
+        """Single per-process Redis subscriber feeding local streams"""
+        import redis.asyncio as aioredis
+
+        client = aioredis.Redis.from_url(self.redis_url)
+        pubsub = client.pubsub()
+        await pubsub.subscribe(self.channel)
+        try:
+            async for message in pubsub.listen():
+                if message['type'] == 'message':
+                    self.dispatch(json.loads(message['data']))
+                if not self.subscriber_count():
+                    break
+        finally:
+            await pubsub.unsubscribe(self.channel)
+            await client.aclose()
+
+
+broker = EventBroker(redis_url=EVENT_SETTINGS.get('REDIS_URL'))
+
+
+def publish(event_type, data):
+    broker.publish(event_type, data)
+
+
+def publish_many(event_type, items):
+    broker.publish_many(event_type, items)
+
+
+def reading_event(reading):
+    return {
+        'id': reading.pk,
+        'sensor_id': reading.sensor_id,
+        'timestamp': reading.timestamp.isoformat(),
+        'flow_rate': reading.flow_rate,
+        'pressure': reading.pressure,
+        'temperature': reading.temperature,
+        'battery_level': reading.battery_level,
+    }
+
+
+def leak_event(leak):
+    return {
+        'id': leak.pk,
+        'sensor_id': leak.sensor_id,
+        'severity': leak.severity,
+        'status': leak.status,
+        'estimated_loss_rate': leak.estimated_loss_rate,
+        'confidence_score': leak.confidence_score,
+    }
+
+
+def alert_event(alert):
+    return {
+        'id': alert.pk,
+        'sensor_id': alert.sensor_id,
+        'alert_type': alert.alert_type,
+        'priority': alert.priority,
+        'message': alert.message,
+        'is_read': alert.is_read,
+        'is_resolved': alert.is_resolved,
+        'occurrence_count': alert.occurrence_count,
+    }
@@ -0,0 +1,176 @@
+"""
+Streaming reading exports as CSV, Parquet or Arrow IPC.
+
+Rows come off a server-side cursor (``values_list().iterator()``) in
+chunks of ``EXPORT_CHUNK_SIZE``. Each chunk is encoded and handed to the
+response before the next one is fetched, so memory use depends on the
+chunk size and not on how many rows the export covers.
+
+Under ASGI the encoder is wrapped in ``iterate_async``: Django consumes a
+sync iterator there with ``sync_to_async(list)``, which would build the
+whole file in memory before sending the first byte.
+"""
+import csv
+import io
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet/Arrow exports are unavailable without pyarrow
+    pa = pq = None
+
+EXPORT_CHUNK_SIZE = getattr(settings, 'READING_EXPORT_CHUNK_SIZE', 10000)
+
+# (column name, values_list source)
+EXPORT_COLUMNS = (
+    ('device_id', 'sensor__device_id'),
+    ('timestamp', 'timestamp'),
+    ('flow_rate', 'flow_rate'),
+    ('pressure', 'pressure'),
+    ('temperature', 'temperature'),
+    ('battery_level', 'battery_level'),
+    ('device_ts', 'device_ts'),
+    ('seq', 'seq'),
+)
+
+
+def export_chunks(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield lists of row tuples in (timestamp, id) order"""
+    rows = queryset.order_by('timestamp', 'id').values_list(
+        *(source for _, source in EXPORT_COLUMNS)
+    ).iterator(chunk_size=chunk_size)
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+_DONE = object()
+
+
+def _next_chunk(chunks):
+    return next(chunks, _DONE)
+
+
+async def iterate_async(chunks):
+    """Async iterator over a sync chunk iterator, fetching one chunk per thread hop"""
+    chunks = iter(chunks)
+    # Thread-sensitive, so every step runs on the thread holding the cursor's connection
+    next_chunk = sync_to_async(_next_chunk, thread_sensitive=True)
+    try:
+        while (chunk := await next_chunk(chunks)) is not _DONE:
+            yield chunk
+    finally:
+        # A client that disconnects early still releases the server-side cursor
+        if hasattr(chunks, 'close'):
+            await sync_to_async(chunks.close, thread_sensitive=True)()
+
+
+def stream_csv(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in EXPORT_COLUMNS])
+    for chunk in chunks:
+        writer.writerows(
+            [
+                value.isoformat() if hasattr(value, 'isoformat') else value
+                for value in row
+            ]
+            for row in chunk
+        )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def arrow_schema():
+    timestamp = pa.timestamp('us', tz='UTC')
+    return pa.schema([
+        ('device_id', pa.string()),
+        ('timestamp', timestamp),
+        ('flow_rate', pa.float64()),
+        ('pressure', pa.float64()),
+        ('temperature', pa.float64()),
+        ('battery_level', pa.int32()),
+        ('device_ts', timestamp),
+        ('seq', pa.int64()),
+    ])
+
+
+def to_record_batch(chunk, schema):
+    columns = zip(*chunk)
+    return pa.RecordBatch.from_arrays(
+        [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+        schema=schema,
+    )
+
+
+class ChunkSink:
+    """Write-only file object that hands over what was written since the last drain"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.buffer += data
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def drain(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def stream_arrow(chunks):
+    schema = arrow_schema()
+    sink = ChunkSink()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for chunk in chunks:
+            writer.write_batch(to_record_batch(chunk, schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+def stream_parquet(chunks):
+    """One Parquet row group per chunk; the footer goes out last"""
+    schema = arrow_schema()
+    sink = ChunkSink()
+    with pq.ParquetWriter(sink, schema, compression='snappy') as writer:
+        for chunk in chunks:
+            writer.write_batch(to_record_batch(chunk, schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+# format -> (encoder, content type, file extension, needs pyarrow)
+FORMATS = {
+    'csv': (stream_csv, 'text/csv', 'csv', False),
+    'parquet': (stream_parquet, 'application/vnd.apache.parquet', 'parquet', True),
+    'arrow': (stream_arrow, 'application/vnd.apache.arrow.stream', 'arrows', True),
+}
@@ -0,0 +1,41 @@
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import ValidationError
+from .export import FORMATS, export_chunks, iterate_async, pa
+from .filters import filter_readings
+from .models import SensorReading
+
+
+@require_GET
+def export_readings(request):
+    """
+    Stream readings oldest first as a downloadable file.
+
+    Query parameters (all optional):
+      format  csv (default), parquet or arrow (Arrow IPC stream)
+      sensor  comma list of device ids
+      since   inclusive start, ISO-8601 or epoch seconds
+      until   exclusive end, ISO-8601 or epoch seconds
+    """
+    export_format = request.GET.get('format', 'csv').lower()
+    if export_format not in FORMATS:
+        return JsonResponse({'format': [f'Must be one of {", ".join(FORMATS)}.']}, status=400)
+    encode, content_type, extension, needs_arrow = FORMATS[export_format]
+    if needs_arrow and pa is None:
+        return JsonResponse({'format': [f'{export_format} export needs pyarrow installed.']}, status=400)
+
+    try:
+        readings = filter_readings(SensorReading.objects.all(), request.GET)
+    except ValidationError as e:
+        return JsonResponse(e.detail, status=400)
+
+    content = encode(export_chunks(readings))
+    if isinstance(request, ASGIRequest):
+        content = iterate_async(content)
+    response = StreamingHttpResponse(content, content_type=content_type)
+    filename = f'readings-{timezone.now():%Y%m%dT%H%M%S}.{extension}'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,45 @@
+from rest_framework.exceptions import ValidationError
+from .ingest import parse_timestamp
+from .registry import device_registry
+
+
+def split_param(value):
+    return [item.strip() for item in value.split(',') if item.strip()] if value else []
+
+
+def parse_time_param(params, name):
+    """Read an ISO-8601 or epoch-seconds query parameter, or None if absent"""
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        value = float(value)
+    except ValueError:
+        pass
+    try:
+        return parse_timestamp(value)
+    except ValueError as e:
+        raise ValidationError({name: [str(e)]})
+
+
+def filter_readings(queryset, params):
+    """
+    Apply the ``sensor`` (comma list of device ids), ``since`` (inclusive)
+    and ``until`` (exclusive) query parameters to a reading queryset.
+    """
+    device_ids = split_param(params.get('sensor'))
+    if device_ids:
+        # Resolve through the registry so the filter hits the
+        # (sensor, -timestamp) index without joining SensorDevice
+        sensors = device_registry.get_many(device_ids)
+        queryset = queryset.filter(sensor_id__in=[s.pk for s in sensors.values()])
+
+    since = parse_time_param(params, 'since')
+    until = parse_time_param(params, 'until')
+    if since and until and since >= until:
+        raise ValidationError({'until': ['Must be later than since.']})
+    if since:
+        queryset = queryset.filter(timestamp__gte=since)
+    if until:
+        queryset = queryset.filter(timestamp__lt=until)
+    return queryset
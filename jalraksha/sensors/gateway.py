@@ -0,0 +1,438 @@
+"""
+Streaming ingest gateway for always-on meters.
+
+The ``ingest_gateway`` command runs an ``IngestGateway`` on one asyncio
+loop. Devices keep a connection open and stream readings over it, in
+place of an HTTP request per reading:
+
+- raw TCP: newline-delimited JSON, back-to-back packed records (see
+  ``parsers``) or a MessagePack stream, with no acknowledgements
+- UDP: one JSON, packed or MessagePack message per datagram
+- MQTT: the gateway is a minimal MQTT 3.1.1 endpoint devices publish to
+  directly (QoS 0-2, no retained messages or subscriptions), or a
+  subscriber on an external broker such as mosquitto (needs aiomqtt)
+
+Every transport decodes to the row dicts ``ingest_batch`` takes and
+queues them on one bounded queue. Writer tasks take up to ``batch_size``
+rows, waiting at most ``flush_interval`` seconds for a batch to fill, and
+run ``ingest_batch`` in a thread, so validation, dedup, last-seen and the
+scoring outbox all work as for the HTTP API.
+
+A full queue is the backpressure: TCP and MQTT handlers stop reading
+their socket until there is room, which stalls the devices through TCP
+flow control. Datagrams cannot be held back, so UDP readings that find
+the queue full are dropped and counted. An MQTT QoS 1/2 publish is
+acknowledged once it is queued, not once it is written.
+
+A failed write (the database is down) is retried with backoff for about
+15 seconds while the queue fills behind it, then given up and counted as
+failed. Readings still queued when the process is killed are lost; stop
+it with SIGTERM or Ctrl+C to drain the queue first.
+"""
+import asyncio
+import functools
+import json
+import time
+from urllib.parse import urlsplit
+from django.db import close_old_connections
+from rest_framework.exceptions import ParseError
+from .loadgen import IngestStats
+from .parsers import PACKED_READING, unpack_readings
+
+try:
+    import msgpack
+except ImportError:  # MessagePack framing is unavailable without msgpack
+    msgpack = None
+
+try:
+    import aiomqtt
+except ImportError:  # subscribing to an external broker needs aiomqtt
+    aiomqtt = None
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# A stream whose framing is lost is closed
+STREAM_ERRORS = (ValueError, msgpack.BufferFull) if msgpack else (ValueError,)
+
+FORMATS = ('json', 'packed', 'msgpack')
+RECORD_SIZE = PACKED_READING.itemsize
+READ_SIZE = 64 * 1024
+# Longest JSON line or MQTT packet, and most bytes a MessagePack stream may buffer
+MAX_MESSAGE = 1024 * 1024
+# Connections the kernel may queue before they are accepted
+BACKLOG = 4096
+# Seconds a new MQTT connection gets to send CONNECT
+CONNECT_TIMEOUT = 10
+# Seconds between attempts to write a batch the database refused
+RETRY_DELAYS = (0.5, 1, 2, 4, 8)
+
+# MQTT control packet types
+MQTT_CONNECT = 1
+MQTT_PUBLISH = 3
+MQTT_PUBREL = 6
+MQTT_SUBSCRIBE = 8
+MQTT_PINGREQ = 12
+MQTT_DISCONNECT = 14
+
+
+class DecodeError(ValueError):
+    pass
+
+
+def decode(payload, fmt):
+    """Reading dicts from one message: an object, a list or {"readings": [...]}"""
+    try:
+        if fmt == 'packed':
+            return unpack_readings(bytes(payload))
+        if fmt == 'msgpack':
+            data = msgpack.unpackb(payload, raw=False, timestamp=3)
+        else:
+            data = json.loads(payload)
+    except (ValueError, ParseError) as exc:
+        raise DecodeError(str(exc) or type(exc).__name__)
+    return as_rows(data)
+
+
+def as_rows(data):
+    if isinstance(data, dict) and 'readings' in data:
+        data = data['readings']
+    if isinstance(data, dict):
+        return [data]
+    if isinstance(data, list):
+        return data
+    raise DecodeError('Expected a reading, a list of readings or {"readings": [...]}.')
+
+
+def raise_file_limit():
+    """Lift the open-file soft limit to the hard limit; returns the limit in effect"""
+    if resource is None:
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            soft = hard
+        except (ValueError, OSError):
+            pass
+    return soft
+
+
+class IngestGateway:
+    def __init__(self, queue_size=50000, batch_size=1000, flush_interval=0.25, writers=1):
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.writers = writers
+        self.queue = None
+        self._tasks = []
+        self._streams = set()
+        self.connections = 0
+        self.peak_connections = 0
+        self.received = 0
+        self.dropped = 0
+        self.decode_errors = 0
+        self.write_errors = 0
+        self.last_error = None
+        self.totals = dict.fromkeys(('accepted', 'duplicates', 'rejected', 'failed'), 0)
+        self.started = time.monotonic()
+        # Rate and flush latency since the last report
+        self.window = IngestStats()
+
+    async def start(self):
+        """Create the queue and the writer tasks; call from inside the running loop"""
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._write()) for _ in range(self.writers)]
+
+    async def put(self, rows):
+        """Queue rows, waiting while the queue is full"""
+        for row in rows:
+            await self.queue.put(row)
+        self.received += len(rows)
+
+    def offer(self, rows):
+        """Queue rows without waiting; rows that do not fit are dropped"""
+        for index, row in enumerate(rows):
+            try:
+                self.queue.put_nowait(row)
+            except asyncio.QueueFull:
+                self.dropped += len(rows) - index
+                rows = rows[:index]
+                break
+        self.received += len(rows)
+
+    async def accept(self, payload, fmt):
+        try:
+            rows = decode(payload, fmt)
+        except DecodeError as exc:
+            self._decode_failed(exc)
+            return
+        await self.put(rows)
+
+    def _decode_failed(self, exc):
+        self.decode_errors += 1
+        self.last_error = f'decode: {exc}'
+
+    async def _collect(self):
+        """Wait for a row, then gather up to batch_size for at most flush_interval"""
+        loop = asyncio.get_running_loop()
+        rows = [await self.queue.get()]
+        deadline = loop.time() + self.flush_interval
+        while len(rows) < self.batch_size:
+            if not self.queue.empty():
+                rows.append(self.queue.get_nowait())
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                rows.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return rows
+
+    async def _write(self):
+        while True:
+            rows = await self._collect()
+            await self._flush(rows)
+            for _ in rows:
+                self.queue.task_done()
+
+    async def _flush(self, rows):
+        for delay in RETRY_DELAYS + (None,):
+            started = time.perf_counter()
+            try:
+                results = await asyncio.to_thread(_store, rows)
+            except Exception as exc:
+                self.write_errors += 1
+                self.last_error = f'write: {exc!r}'
+                if delay is None:
+                    break
+                # Hold the batch and retry; the queue backs up meanwhile
+                await asyncio.sleep(delay)
+            else:
+                self.window.record_results(time.perf_counter() - started, results)
+                for result in results:
+                    self.totals['duplicates' if result['status'] == 'duplicate' else result['status']] += 1
+                return
+        self.window.failed += len(rows)
+        self.totals['failed'] += len(rows)
+
+    async def close(self, timeout=30.0):
+        """Write out the queue (waiting at most ``timeout`` seconds) and stop the writers"""
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        return self.queue.qsize()
+
+    def stats(self):
+        """Counters since start, plus ingest rate and flush latency since the previous call"""
+        window, self.window = self.window, IngestStats()
+        summary = window.summary()
+        stats = {
+            'connections': self.connections,
+            'peak_connections': self.peak_connections,
+            'received': self.received,
+            'queue_depth': self.queue.qsize() if self.queue else 0,
+            'queue_size': self.queue_size,
+            'dropped': self.dropped,
+            'decode_errors': self.decode_errors,
+            'write_errors': self.write_errors,
+            'last_error': self.last_error,
+            'rate': summary['throughput'],
+            'flushes': summary['calls'],
+            'elapsed': time.monotonic() - self.started,
+            **self.totals,
+        }
+        stats.update({key: summary[key] for key in ('p50_ms', 'p99_ms', 'max_ms') if key in summary})
+        return stats
+
+    def _connected(self, writer=None):
+        self.connections += 1
+        self.peak_connections = max(self.peak_connections, self.connections)
+        if writer is not None:
+            self._streams.add(writer)
+
+    def _disconnected(self, writer=None):
+        self.connections -= 1
+        if writer is not None:
+            self._streams.discard(writer)
+            writer.close()
+
+    def disconnect(self):
+        """Hang up on every device; what they already sent is still queued"""
+        for writer in list(self._streams):
+            writer.close()
+
+    # Raw TCP
+
+    async def serve_tcp(self, host, port, fmt):
+        return await asyncio.start_server(
+            functools.partial(self._tcp_client, fmt=fmt), host, port, backlog=BACKLOG, limit=MAX_MESSAGE,
+        )
+
+    async def _tcp_client(self, reader, writer, fmt):
+        self._connected(writer)
+        try:
+            if fmt == 'json':
+                while line := await reader.readline():
+                    if line.strip():
+                        await self.accept(line, fmt)
+            elif fmt == 'packed':
+                pending = b''
+                while chunk := await reader.read(READ_SIZE):
+                    pending += chunk
+                    whole = len(pending) - len(pending) % RECORD_SIZE
+                    if whole:
+                        await self.accept(pending[:whole], fmt)
+                        pending = pending[whole:]
+            else:
+                unpacker = msgpack.Unpacker(raw=False, timestamp=3, max_buffer_size=MAX_MESSAGE)
+                while chunk := await reader.read(READ_SIZE):
+                    unpacker.feed(chunk)
+                    for message in unpacker:
+                        try:
+                            rows = as_rows(message)
+                        except DecodeError as exc:
+                            self._decode_failed(exc)
+                            continue
+                        await self.put(rows)
+        except STREAM_ERRORS as exc:
+            # An over-long line or undecodable stream; the framing is lost, so hang up
+            self._decode_failed(exc)
+        except ConnectionError:
+            pass
+        finally:
+            self._disconnected(writer)
+
+    # UDP
+
+    async def serve_udp(self, host, port, fmt):
+        transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: _DatagramProtocol(self, fmt), local_addr=(host, port),
+        )
+        return transport
+
+    # MQTT
+
+    async def serve_mqtt(self, host, port, fmt):
+        return await asyncio.start_server(
+            functools.partial(self._mqtt_client, fmt=fmt), host, port, backlog=BACKLOG,
+        )
+
+    async def _mqtt_client(self, reader, writer, fmt):
+        self._connected(writer)
+        try:
+            kind, body = await asyncio.wait_for(_read_mqtt_packet(reader), CONNECT_TIMEOUT)
+            if kind >> 4 != MQTT_CONNECT:
+                return
+            # Protocol name, level and flags precede the keep-alive seconds
+            name_length = int.from_bytes(body[:2], 'big')
+            keepalive = int.from_bytes(body[name_length + 4:name_length + 6], 'big')
+            writer.write(_mqtt_packet(0x20, b'\x00\x00'))
+
+            while True:
+                packet = _read_mqtt_packet(reader)
+                # A client silent for 1.5x its keep-alive is gone
+                kind, body = await (asyncio.wait_for(packet, keepalive * 1.5) if keepalive else packet)
+                packet_type, flags = kind >> 4, kind & 0x0F
+                if packet_type == MQTT_PUBLISH:
+                    qos = (flags >> 1) & 0x03
+                    offset = 2 + int.from_bytes(body[:2], 'big')
+                    packet_id = body[offset:offset + 2] if qos else b''
+                    await self.accept(body[offset + len(packet_id):], fmt)
+                    if qos == 1:
+                        writer.write(_mqtt_packet(0x40, packet_id))
+                    elif qos == 2:
+                        writer.write(_mqtt_packet(0x50, packet_id))
+                elif packet_type == MQTT_PUBREL:
+                    writer.write(_mqtt_packet(0x70, body[:2]))
+                elif packet_type == MQTT_SUBSCRIBE:
+                    # Nothing is ever published to devices; refuse every topic filter
+                    codes, offset = b'', 2
+                    while offset < len(body):
+                        offset += 2 + int.from_bytes(body[offset:offset + 2], 'big') + 1
+                        codes += b'\x80'
+                    writer.write(_mqtt_packet(0x90, body[:2] + codes))
+                elif packet_type == MQTT_PINGREQ:
+                    writer.write(_mqtt_packet(0xD0, b''))
+                elif packet_type == MQTT_DISCONNECT:
+                    return
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError, ValueError):
+            pass
+        finally:
+            self._disconnected(writer)
+
+    async def subscribe_mqtt(self, url, topic, fmt):
+        """Consume ``topic`` on an external broker, reconnecting until cancelled"""
+        parts = urlsplit(url)
+        while True:
+            try:
+                async with aiomqtt.Client(
+                    parts.hostname, parts.port or 1883, username=parts.username, password=parts.password,
+                ) as client:
+                    await client.subscribe(topic, qos=1)
+                    self._connected()
+                    try:
+                        async for message in client.messages:
+                            await self.accept(message.payload, fmt)
+                    finally:
+                        self._disconnected()
+            except aiomqtt.MqttError as exc:
+                self.last_error = f'broker: {exc}'
+                await asyncio.sleep(RETRY_DELAYS[-1])
+
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, gateway, fmt):
+        self.gateway = gateway
+        self.fmt = fmt
+
+    def datagram_received(self, data, addr):
+        try:
+            rows = decode(data, self.fmt)
+        except DecodeError as exc:
+            self.gateway._decode_failed(exc)
+            return
+        self.gateway.offer(rows)
+
+
+def _store(rows):
+    from .ingest import ingest_batch
+
+    # Runs in a worker thread, which keeps its own database connection
+    close_old_connections()
+    return ingest_batch(rows)
+
+
+async def _read_mqtt_packet(reader):
+    """(first header byte, body) of the next MQTT control packet"""
+    kind = (await reader.readexactly(1))[0]
+    length = shift = 0
+    for _ in range(4):
+        byte = (await reader.readexactly(1))[0]
+        length |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            break
+    else:
+        raise ValueError('Malformed MQTT remaining length.')
+    if length > MAX_MESSAGE:
+        raise ValueError('MQTT packet too large.')
+    return kind, await reader.readexactly(length)
+
+
+def _mqtt_packet(kind, body):
+    length, encoded = len(body), bytearray()
+    while True:
+        byte, length = length & 0x7F, length >> 7
+        encoded.append(byte | (0x80 if length else 0))
+        if not length:
+            return bytes([kind]) + bytes(encoded) + body
@@ -0,0 +1,82 @@
+"""
+Fleet health from the denormalized ``SensorDevice.last_*`` fields.
+
+Ingest keeps each device's ``last_seen`` and ``last_battery`` current, so
+finding silent or low-battery devices is an indexed scan of the device
+table rather than of the readings. ``sweep_fleet_health`` runs
+periodically: it raises SENSOR_OFFLINE and LOW_BATTERY alerts through the
+alert coalescer, which folds repeat sweeps into the open alert, and
+resolves the alerts of devices that have recovered.
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+HEALTH_SETTINGS = getattr(settings, 'FLEET_HEALTH', {})
+
+# Seconds without a reading before an active device counts as offline
+OFFLINE_AFTER = HEALTH_SETTINGS.get('OFFLINE_AFTER', 3600)
+# Battery percentage below which a device needs maintenance
+LOW_BATTERY = HEALTH_SETTINGS.get('LOW_BATTERY', 30)
+
+
+def offline_cutoff(now=None):
+    return (now or timezone.now()) - timedelta(seconds=OFFLINE_AFTER)
+
+
+def offline_q(cutoff):
+    """Active devices silent since ``cutoff``, or never heard from since installation"""
+    return Q(is_active=True) & (
+        Q(last_seen__lt=cutoff) | Q(last_seen__isnull=True, installation_date__lt=cutoff)
+    )
+
+
+def low_battery_q():
+    return Q(is_active=True, last_battery__lt=LOW_BATTERY)
+
+
+def sweep_fleet_health(now=None):
+    """Raise and resolve offline/low-battery alerts; returns a summary dict"""
+    from alerts.coalescing import Occurrence, alert_coalescer
+    from alerts.inbox import mark_alerts_resolved
+    from alerts.models import Alert
+    from .models import SensorDevice
+
+    now = now or timezone.now()
+    cutoff = offline_cutoff(now)
+
+    occurrences = []
+    offline = SensorDevice.objects.filter(offline_q(cutoff))
+    for sensor in offline:
+        if sensor.last_seen is None:
+            message = f'{sensor.device_id} at {sensor.location} has not reported since installation.'
+        else:
+            message = f'{sensor.device_id} at {sensor.location} last reported {sensor.last_seen:%d %b %Y %H:%M} UTC.'
+        occurrences.append(Occurrence(
+            sensor=sensor, alert_type='SENSOR_OFFLINE', priority='HIGH',
+            message=message, loss_rate=None, leak=None,
+        ))
+    low_battery = SensorDevice.objects.filter(low_battery_q())
+    for sensor in low_battery:
+        occurrences.append(Occurrence(
+            sensor=sensor, alert_type='LOW_BATTERY',
+            priority='HIGH' if sensor.last_battery < LOW_BATTERY / 2 else 'MEDIUM',
+            message=f'{sensor.device_id} at {sensor.location} battery at {sensor.last_battery}%. Schedule maintenance.',
+            loss_rate=None, leak=None,
+        ))
+    opened, updated = alert_coalescer.record(occurrences, now=now)
+
+    open_alerts = Alert.objects.filter(is_resolved=False)
+    recovered = mark_alerts_resolved(open_alerts.filter(
+        Q(alert_type='SENSOR_OFFLINE', sensor__last_seen__gte=cutoff)
+        | Q(alert_type='LOW_BATTERY', sensor__last_battery__gte=LOW_BATTERY)
+        | Q(alert_type__in=['SENSOR_OFFLINE', 'LOW_BATTERY'], sensor__is_active=False)
+    ))
+    return {
+        'offline': sum(o.alert_type == 'SENSOR_OFFLINE' for o in occurrences),
+        'low_battery': sum(o.alert_type == 'LOW_BATTERY' for o in occurrences),
+        'opened': len(opened),
+        'updated': len(updated),
+        'resolved': recovered,
+    }
@@ -0,0 +1,294 @@
+"""
+Synthetic sensor traffic for the ``simulate_sensor`` load generator.
+
+``VirtualDevice`` produces readings that follow a household demand
+curve, with an optional constant leak on top. ``TrafficGenerator`` paces
+readings from many devices to a target rate. ``IngestStats`` records the
+outcome and latency of each ingest call. The command drives these
+against ``ingest_batch`` directly or against the HTTP batch API.
+"""
+import asyncio
+import json
+import math
+import random
+import ssl
+import time
+from datetime import timedelta
+from urllib.parse import urlsplit
+import numpy as np
+from django.utils import timezone
+
+PROFILES = ('diurnal', 'flat')
+
+
+def demand_factor(hour):
+    """Share of peak household demand at a local hour (0-24): morning and evening peaks, idle at night"""
+    return min(1.0, 0.04
+               + 0.95 * math.exp(-((hour - 7.5) ** 2) / 3.0)
+               + 0.75 * math.exp(-((hour - 19.5) ** 2) / 4.5))
+
+
+class VirtualDevice:
+    def __init__(self, device_id, profile='diurnal', leak_rate=0.0,
+                 base_flow=25.0, base_pressure=45.0, rng=None):
+        self.device_id = device_id
+        self.profile = profile
+        # Constant extra flow in L/min; 0 for a healthy pipe
+        self.leak_rate = leak_rate
+        self.base_flow = base_flow
+        self.base_pressure = base_pressure
+        self.rng = rng or random.Random()
+        self.battery = self.rng.uniform(75, 100)
+        self.seq = 0
+
+    def sample(self, ts):
+        """Return one reading row for ``ts`` in the batch ingest format"""
+        rng = self.rng
+        if self.profile == 'flat':
+            demand = 0.6
+            flow = rng.uniform(self.base_flow - 10, self.base_flow + 15)
+        else:
+            local = timezone.localtime(ts)
+            demand = demand_factor(local.hour + local.minute / 60)
+            # Taps are either open or shut; demand sets how often they are open
+            in_use = rng.random() < demand
+            flow = self.base_flow * rng.uniform(0.6, 1.4) if in_use else 0.0
+        pressure = self.base_pressure - 10 * demand + rng.gauss(0, 1.5)
+
+        if self.leak_rate:
+            flow += self.leak_rate * (1 + rng.gauss(0, 0.03))
+            pressure -= 8
+
+        self.battery = max(0.0, self.battery - 0.0005)
+        self.seq += 1
+        return {
+            'device_id': self.device_id,
+            'device_ts': ts.timestamp(),
+            'seq': self.seq,
+            'flow_rate': round(max(flow, 0.0), 2),
+            'pressure': round(pressure, 2),
+            'temperature': round(rng.uniform(20, 30), 1),
+            'battery_level': int(self.battery),
+        }
+
+
+class TrafficGenerator:
+    """
+    Round-robin readings from ``devices`` at ``rate`` readings/second
+    (0 = as fast as the sink accepts them).
+
+    In live mode every reading is stamped with the current time. With
+    ``backfill`` (a timedelta) each device instead starts that far in the
+    past and steps forward by ``interval`` seconds per reading until it
+    catches up with the present.
+    """
+
+    def __init__(self, devices, rate, count=0, duration=0, backfill=None, interval=5):
+        self.devices = devices
+        self.rate = rate
+        self.count = count
+        self.duration = duration
+        self.interval = timedelta(seconds=interval)
+        self.sent = 0
+        self._next_device = 0
+        self._started = time.monotonic()
+        if backfill:
+            self._clock = timezone.now() - backfill
+            self._clock_end = timezone.now()
+        else:
+            self._clock = self._clock_end = None
+
+    @property
+    def finished(self):
+        if self.count and self.sent >= self.count:
+            return True
+        if self.duration and time.monotonic() - self._started >= self.duration:
+            return True
+        return self._clock is not None and self._clock >= self._clock_end
+
+    def due(self):
+        """Return (readings due now, seconds until the next one is due)"""
+        if not self.rate:
+            return math.inf, 0.0
+        target = int((time.monotonic() - self._started) * self.rate)
+        if target > self.sent:
+            return target - self.sent, 0.0
+        return 0, (self.sent + 1) / self.rate - (time.monotonic() - self._started)
+
+    def take(self, n):
+        """Return up to n reading rows"""
+        if self.count:
+            n = min(n, self.count - self.sent)
+        rows = []
+        now = timezone.now()
+        for _ in range(int(n)):
+            if self._clock is not None:
+                if self._clock >= self._clock_end:
+                    break
+                now = self._clock
+            rows.append(self.devices[self._next_device].sample(now))
+            self._next_device += 1
+            if self._next_device == len(self.devices):
+                self._next_device = 0
+                if self._clock is not None:
+                    self._clock += self.interval
+        self.sent += len(rows)
+        return rows
+
+
+# Latencies kept for percentiles; a long run samples them uniformly
+MAX_LATENCY_SAMPLES = 10000
+
+
+class IngestStats:
+    """Per-call latencies and per-reading outcomes for a load run"""
+
+    def __init__(self, max_samples=MAX_LATENCY_SAMPLES):
+        # A reservoir sample of call latencies, so memory stays flat however long the run
+        self.latencies = []
+        self.max_samples = max_samples
+        self.calls = 0
+        self.max_latency = 0.0
+        self._rng = random.Random()
+        self.accepted = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.failed = 0
+        self.started = time.monotonic()
+
+    def record(self, latency, accepted=0, duplicates=0, rejected=0, failed=0):
+        self.calls += 1
+        self.max_latency = max(self.max_latency, latency)
+        if len(self.latencies) < self.max_samples:
+            self.latencies.append(latency)
+        else:
+            slot = self._rng.randrange(self.calls)
+            if slot < self.max_samples:
+                self.latencies[slot] = latency
+        self.accepted += accepted
+        self.duplicates += duplicates
+        self.rejected += rejected
+        self.failed += failed
+
+    def record_results(self, latency, results):
+        """Record one ingest_batch-style list of per-row results"""
+        statuses = [r['status'] for r in results]
+        self.record(
+            latency,
+            accepted=statuses.count('accepted'),
+            duplicates=statuses.count('duplicate'),
+            rejected=statuses.count('rejected'),
+        )
+
+    @property
+    def readings(self):
+        return self.accepted + self.duplicates + self.rejected + self.failed
+
+    def summary(self):
+        elapsed = time.monotonic() - self.started
+        summary = {
+            'elapsed': elapsed,
+            'calls': self.calls,
+            'readings': self.readings,
+            'accepted': self.accepted,
+            'duplicates': self.duplicates,
+            'rejected': self.rejected,
+            'failed': self.failed,
+            'throughput': self.accepted / elapsed if elapsed else 0.0,
+        }
+        if self.latencies:
+            p50, p90, p99 = np.percentile(self.latencies, [50, 90, 99]) * 1000
+            summary.update(p50_ms=p50, p90_ms=p90, p99_ms=p99, max_ms=self.max_latency * 1000)
+        return summary
+
+
+class HttpConnection:
+    """
+    Minimal keep-alive HTTP/1.1 client on asyncio streams, so the load
+    generator needs no third-party HTTP library. Each concurrent worker
+    owns one connection.
+    """
+
+    def __init__(self, url, timeout=30.0):
+        parts = urlsplit(url)
+        self.https = parts.scheme == 'https'
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.https else 80)
+        self.path = parts.path or '/'
+        self.timeout = timeout
+        self._reader = self._writer = None
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(
+            self.host, self.port, ssl=ssl.create_default_context() if self.https else None
+        )
+
+    async def post_json(self, payload):
+        """POST ``payload`` and return (status, decoded JSON body or None)"""
+        body = json.dumps(payload).encode()
+        head = (
+            f'POST {self.path} HTTP/1.1\r\n'
+            f'Host: {self.host}:{self.port}\r\n'
+            'Content-Type: application/json\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            '\r\n'
+        ).encode()
+        for attempt in (0, 1):
+            if self._writer is None:
+                await self._connect()
+            try:
+                self._writer.write(head + body)
+                await self._writer.drain()
+                return await asyncio.wait_for(self._read_response(), self.timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # Server closed an idle keep-alive connection; reconnect once
+                await self.close()
+                if attempt:
+                    raise
+            except Exception:
+                # A timed-out or garbled exchange leaves the stream at an
+                # unknown position; the late response would be read as the
+                # answer to the next request, so start over on a new socket
+                await self.close()
+                raise
+
+    async def _read_response(self):
+        status_line = await self._reader.readuntil(b'\r\n')
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self._reader.readuntil(b'\r\n')
+            if line == b'\r\n':
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await self._reader.readuntil(b'\r\n')).split(b';')[0], 16)
+                chunk = await self._reader.readexactly(size + 2)
+                if not size:
+                    break
+                chunks.append(chunk[:-2])
+            data = b''.join(chunks)
+        elif 'content-length' in headers:
+            data = await self._reader.readexactly(int(headers['content-length']))
+        else:
+            data = await self._reader.read()
+
+        if headers.get('connection', '').lower() == 'close':
+            await self.close()
+        try:
+            return status, json.loads(data) if data else None
+        except ValueError:
+            return status, None
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except (ConnectionError, ssl.SSLError):
+                pass
+        self._reader = self._writer = None
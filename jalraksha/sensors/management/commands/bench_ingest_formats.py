@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.parsers import JSONParser
+from sensors.loadgen import VirtualDevice
+from sensors.parsers import MessagePackParser, PackedReadingParser, msgpack, pack_readings
+from datetime import timedelta
+import io
+import json
+import random
+import statistics
+import time
+
+
+class Command(BaseCommand):
+    help = 'Compare bytes and parse time per reading of the JSON, MessagePack and packed ingest formats'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-sizes',
+            default='1,100,1000',
+            help='Comma-separated readings per request body'
+        )
+        parser.add_argument('--devices', type=int, default=50, help='Virtual devices the readings come from')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed parses per body (the median is reported)')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for reproducible runs')
+
+    def handle(self, *args, **options):
+        try:
+            batch_sizes = [int(size) for size in options['batch_sizes'].split(',')]
+        except ValueError:
+            raise CommandError('--batch-sizes must be comma-separated integers')
+        if min(batch_sizes) < 1 or options['repeat'] < 1 or options['devices'] < 1:
+            raise CommandError('--batch-sizes, --devices and --repeat must be at least 1')
+
+        rng = random.Random(options['seed'])
+        devices = [VirtualDevice(f'SENSOR{i:04d}', rng=rng) for i in range(options['devices'])]
+
+        # format -> (encode rows, parser)
+        formats = {
+            'json': (lambda rows: json.dumps(rows).encode(), JSONParser()),
+            'packed': (pack_readings, PackedReadingParser()),
+        }
+        if msgpack is not None:
+            formats['msgpack'] = (msgpack.packb, MessagePackParser())
+        else:
+            self.stdout.write(self.style.WARNING('msgpack is not installed; skipping MessagePack'))
+
+        self.stdout.write(f'{"format":<10} {"batch":>6} {"bytes/reading":>14} {"us/reading":>11} {"vs json":>8}')
+        for size in batch_sizes:
+            now = timezone.now()
+            rows = [
+                devices[i % len(devices)].sample(now - timedelta(seconds=5 * (size - i)))
+                for i in range(size)
+            ]
+            baseline = None
+            for name, (encode, parser) in formats.items():
+                body = encode(rows)
+                parsed = parser.parse(io.BytesIO(body), parser.media_type)
+                if len(parsed) != size:
+                    raise CommandError(f'{name} round trip returned {len(parsed)} of {size} readings')
+
+                samples = []
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    parser.parse(io.BytesIO(body), parser.media_type)
+                    samples.append(time.perf_counter() - started)
+                per_reading = statistics.median(samples) / size * 1e6
+                if baseline is None:
+                    baseline = per_reading
+                self.stdout.write(
+                    f'{name:<10} {size:>6} {len(body) / size:>14.1f} {per_reading:>11.2f} '
+                    f'{baseline / per_reading:>7.1f}x'
+                )
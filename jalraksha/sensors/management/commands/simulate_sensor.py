@@ -1,20 +1,30 @@
-from django.core.management.base import BaseCommand
-from django.utils import timezone
-from sensors.models import SensorDevice, SensorReading
+from django.core.management.base import BaseCommand, CommandError
+from sensors.models import SensorDevice
+from sensors.loadgen import PROFILES, VirtualDevice, TrafficGenerator, IngestStats, HttpConnection
 from analytics.models import LeakDetection
-from alerts.models import Alert
+from alerts.coalescing import Occurrence, alert_coalescer
+from datetime import timedelta
+import asyncio
 import random
+import signal
 import time
 
+# Typical flow (L/min) and pressure (PSI) by deployment type
+BASELINES = {
+    'MUNICIPAL': (120.0, 60.0),
+    'RESIDENTIAL': (25.0, 45.0),
+}
+
+
 class Command(BaseCommand):
-    help = 'Simulate sensor data for testing'
-    
+    help = 'Simulate sensor traffic: a live demo feed or a load test of the ingest path'
+
     def add_arguments(self, parser):
         parser.add_argument(
             '--interval',
             type=int,
             default=5,
-            help='Interval between readings in seconds'
+            help='Seconds between readings from each device (sets the default --rate)'
         )
         parser.add_argument(
             '--count',
@@ -22,84 +32,313 @@ class Command(BaseCommand):
             default=0,
             help='Number of readings to generate (0 for infinite)'
         )
-    
-    def handle(self, *args, **kwargs):
-        interval = kwargs['interval']
-        count = kwargs['count']
-        
-        sensors = SensorDevice.objects.filter(is_active=True)
-        
-        if not sensors.exists():
-            self.stdout.write(self.style.ERROR('No active sensors found. Please create sensors first.'))
-            return
-        
-        self.stdout.write(self.style.SUCCESS(f'Starting simulation for {sensors.count()} sensors'))
-        
-        readings_generated = 0
-        
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=0,
+            help='Stop after this many seconds (0 for no limit)'
+        )
+        parser.add_argument(
+            '--devices',
+            type=int,
+            default=0,
+            help='Number of virtual devices (default: every active sensor)'
+        )
+        parser.add_argument(
+            '--create-devices',
+            action='store_true',
+            help='Register SIM-NNNNN sensors when --devices exceeds the active sensors'
+        )
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=None,
+            help='Target readings per second across all devices (0 for unthrottled)'
+        )
+        parser.add_argument(
+            '--profile',
+            choices=PROFILES,
+            default='diurnal',
+            help='Demand profile for generated flow'
+        )
+        parser.add_argument(
+            '--leak-fraction',
+            type=float,
+            default=0.05,
+            help='Share of devices given a constant leak'
+        )
+        parser.add_argument(
+            '--backfill',
+            type=float,
+            default=0,
+            help='Generate this many hours of history up to now instead of live readings'
+        )
+        parser.add_argument(
+            '--mode',
+            choices=['orm', 'http'],
+            default='orm',
+            help='Ingest through ingest_batch in-process, or through the HTTP batch API'
+        )
+        parser.add_argument(
+            '--url',
+            default='http://127.0.0.1:8000/api/readings/batch/',
+            help='Batch API endpoint for --mode http'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=8,
+            help='Concurrent HTTP connections for --mode http'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=200,
+            help='Maximum readings per ingest call'
+        )
+        parser.add_argument(
+            '--report-every',
+            type=float,
+            default=5,
+            help='Seconds between progress reports'
+        )
+        parser.add_argument(
+            '--demo-leaks',
+            action='store_true',
+            help='Also record leak detections and alerts for leaking devices (demo feed, orm mode only)'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=None,
+            help='Random seed for reproducible runs'
+        )
+
+    def handle(self, *args, **options):
+        if options['demo_leaks'] and options['mode'] != 'orm':
+            raise CommandError('--demo-leaks is only available with --mode orm')
+        if options['batch_size'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--batch-size and --concurrency must be at least 1')
+
+        self.verbosity = options['verbosity']
+        self.rng = random.Random(options['seed'])
+        self.demo_leaks = options['demo_leaks']
+        self.report_every = options['report_every']
+        self.last_report = time.monotonic()
+
+        devices = self.build_devices(options)
+        self.sensors = {
+            s.device_id: s for s in SensorDevice.objects.filter(device_id__in=[d.device_id for d in devices])
+        } if self.demo_leaks else {}
+
+        rate = options['rate']
+        if rate is None:
+            rate = len(devices) / max(options['interval'], 1)
+        generator = TrafficGenerator(
+            devices,
+            rate=rate,
+            count=options['count'],
+            duration=options['duration'],
+            backfill=timedelta(hours=options['backfill']) if options['backfill'] else None,
+            interval=options['interval'],
+        )
+
+        leaking = sum(1 for d in devices if d.leak_rate)
+        self.stdout.write(self.style.SUCCESS(
+            f'Starting simulation for {len(devices)} sensors ({leaking} leaking) '
+            f'at {f"{rate:g}/s" if rate else "max rate"} via {options["mode"]}'
+        ))
+
+        # Let "stop simulation" (SIGTERM) end the run with a final report
+        signal.signal(signal.SIGTERM, self.interrupt)
+
+        stats = IngestStats()
         try:
-            while count == 0 or readings_generated < count:
-                for sensor in sensors:
-                    # Normal operation ranges
-                    base_flow = 25.0
-                    base_pressure = 45.0
-                    
-                    # Simulate different scenarios
-                    scenario = random.random()
-                    
-                    if scenario < 0.7:  # Normal operation (70%)
-                        flow_rate = random.uniform(base_flow - 10, base_flow + 15)
-                        pressure = random.uniform(base_pressure - 10, base_pressure + 10)
-                    elif scenario < 0.85:  # High consumption (15%)
-                        flow_rate = random.uniform(45, 65)
-                        pressure = random.uniform(40, 55)
-                    elif scenario < 0.95:  # Low pressure issue (10%)
-                        flow_rate = random.uniform(15, 25)
-                        pressure = random.uniform(20, 30)
-                    else:  # Potential leak (5%)
-                        flow_rate = random.uniform(5, 15)
-                        pressure = random.uniform(15, 25)
-                        
-                        # Create leak detection
-                        if random.random() < 0.5:  # 50% chance to detect
-                            leak = LeakDetection.objects.create(
-                                sensor=sensor,
-                                severity=random.choice(['LOW', 'MEDIUM', 'HIGH']),
-                                estimated_loss_rate=flow_rate * 60,  # Convert to L/hr
-                                confidence_score=random.uniform(0.7, 0.95)
-                            )
-                            
-                            # Create alert
-                            Alert.objects.create(
-                                alert_type='LEAK',
-                                priority='HIGH' if leak.severity in ['HIGH', 'CRITICAL'] else 'MEDIUM',
-                                sensor=sensor,
-                                leak=leak,
-                                message=f"Potential leak detected at {sensor.location}. Flow: {flow_rate:.1f} L/min"
-                            )
-                            
-                            self.stdout.write(self.style.WARNING(f'LEAK DETECTED: {sensor.device_id}'))
-                    
-                    # Create reading
-                    reading = SensorReading.objects.create(
-                        sensor=sensor,
-                        flow_rate=round(flow_rate, 2),
-                        pressure=round(pressure, 2),
-                        temperature=round(random.uniform(20, 30), 1),
-                        battery_level=random.randint(75, 100)
-                    )
-                    
-                    readings_generated += 1
-                    
-                    self.stdout.write(
-                        f'{sensor.device_id}: Flow={flow_rate:.2f} L/min, '
-                        f'Pressure={pressure:.2f} PSI, '
-                        f'Battery={reading.battery_level}%'
-                    )
-                
-                if count == 0 or readings_generated < count:
-                    self.stdout.write(f'Waiting {interval} seconds...\n')
-                    time.sleep(interval)
-                
+            if options['mode'] == 'http':
+                asyncio.run(self.run_http(generator, stats, options['url'], options['concurrency'], options['batch_size']))
+            else:
+                self.run_orm(generator, stats, options['batch_size'])
         except KeyboardInterrupt:
-            self.stdout.write(self.style.SUCCESS(f'\nSimulation stopped. Generated {readings_generated} readings.'))
\ No newline at end of file
+            self.stdout.write('\nSimulation stopped.')
+
+        self.report(stats, final=True)
+
+    def interrupt(self, signum, frame):
+        raise KeyboardInterrupt
+
+    def build_devices(self, options):
+        sensors = list(
+            SensorDevice.objects.filter(is_active=True).order_by('id').values_list('device_id', 'deployment_type')
+        )
+        wanted = options['devices'] or len(sensors)
+
+        if wanted > len(sensors):
+            if not options['create_devices']:
+                raise CommandError(
+                    f'Only {len(sensors)} active sensors exist; pass --create-devices to register '
+                    f'{wanted - len(sensors)} simulated ones.'
+                )
+            # Number new devices after any earlier runs' (possibly deactivated) ones
+            first = SensorDevice.objects.filter(device_id__startswith='SIM-').count() + 1
+            SensorDevice.objects.bulk_create([
+                SensorDevice(
+                    device_id=f'SIM-{i:05d}',
+                    sensor_type='FLOW',
+                    deployment_type='RESIDENTIAL',
+                    location=f'Simulated device {i}',
+                )
+                for i in range(first, first + wanted - len(sensors))
+            ], ignore_conflicts=True)
+            sensors = list(
+                SensorDevice.objects.filter(is_active=True).order_by('id').values_list('device_id', 'deployment_type')
+            )
+
+        if not sensors:
+            raise CommandError('No active sensors found. Please create sensors first.')
+
+        sensors = sensors[:wanted]
+        leaking = set(self.rng.sample(range(len(sensors)), round(len(sensors) * options['leak_fraction'])))
+        devices = []
+        for i, (device_id, deployment_type) in enumerate(sensors):
+            base_flow, base_pressure = BASELINES.get(deployment_type, BASELINES['RESIDENTIAL'])
+            devices.append(VirtualDevice(
+                device_id,
+                profile=options['profile'],
+                leak_rate=self.rng.uniform(2, 12) if i in leaking else 0.0,
+                base_flow=base_flow,
+                base_pressure=base_pressure,
+                rng=random.Random(self.rng.random()),
+            ))
+        return devices
+
+    def run_orm(self, generator, stats, batch_size):
+        from sensors.ingest import ingest_batch
+
+        devices = {d.device_id: d for d in generator.devices}
+        while not generator.finished:
+            due, wait = generator.due()
+            if not due:
+                time.sleep(min(wait, 0.5))
+                self.maybe_report(stats)
+                continue
+            rows = generator.take(min(due, batch_size))
+            if not rows:
+                break
+
+            started = time.perf_counter()
+            results = ingest_batch(rows)
+            stats.record_results(time.perf_counter() - started, results)
+
+            self.log_rows(rows)
+            if self.demo_leaks:
+                self.record_demo_leaks(rows, devices)
+            self.maybe_report(stats)
+
+    async def run_http(self, generator, stats, url, concurrency, batch_size):
+        queue = asyncio.Queue(maxsize=concurrency * 2)
+
+        async def produce():
+            try:
+                while not generator.finished:
+                    due, wait = generator.due()
+                    if not due:
+                        await asyncio.sleep(min(wait, 0.5))
+                        self.maybe_report(stats)
+                        continue
+                    rows = generator.take(min(due, batch_size))
+                    if not rows:
+                        break
+                    # Blocks while every connection is busy, so a saturated
+                    # server shows up as achieved rate below target
+                    await queue.put(rows)
+            finally:
+                for _ in range(concurrency):
+                    await queue.put(None)
+
+        async def send():
+            connection = HttpConnection(url)
+            try:
+                while (rows := await queue.get()) is not None:
+                    started = time.perf_counter()
+                    try:
+                        status, body = await connection.post_json(rows)
+                    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                        stats.record(time.perf_counter() - started, failed=len(rows))
+                        self.stderr.write(f'Request failed: {e!r}')
+                        continue
+                    latency = time.perf_counter() - started
+                    if isinstance(body, dict) and 'results' in body:
+                        stats.record_results(latency, body['results'])
+                    else:
+                        stats.record(latency, failed=len(rows))
+                        self.stderr.write(f'HTTP {status}: {body}')
+                    self.log_rows(rows)
+                    self.maybe_report(stats)
+            finally:
+                await connection.close()
+
+        await asyncio.gather(produce(), *(send() for _ in range(concurrency)))
+
+    def log_rows(self, rows):
+        if self.verbosity < 2:
+            return
+        for row in rows:
+            self.stdout.write(
+                f'{row["device_id"]}: Flow={row["flow_rate"]:.2f} L/min, '
+                f'Pressure={row["pressure"]:.2f} PSI, '
+                f'Battery={row["battery_level"]}%'
+            )
+
+    def record_demo_leaks(self, rows, devices):
+        occurrences = []
+        for row in rows:
+            device = devices[row['device_id']]
+            sensor = self.sensors.get(row['device_id'])
+            if not device.leak_rate or sensor is None or self.rng.random() >= 0.5:
+                continue
+
+            severity = self.rng.choice(['LOW', 'MEDIUM', 'HIGH'])
+            loss_rate = device.leak_rate * 60  # Convert to L/hr
+            occurrences.append(Occurrence(
+                sensor=sensor,
+                alert_type='LEAK',
+                priority='HIGH' if severity in ['HIGH', 'CRITICAL'] else 'MEDIUM',
+                message=f"Potential leak detected at {sensor.location}. Flow: {row['flow_rate']:.1f} L/min",
+                loss_rate=loss_rate,
+                leak=LeakDetection(
+                    sensor=sensor,
+                    severity=severity,
+                    estimated_loss_rate=loss_rate,
+                    confidence_score=self.rng.uniform(0.7, 0.95),
+                ),
+            ))
+
+        # A leaking device keeps firing; repeats fold into its open alert
+        opened, updated = alert_coalescer.record(occurrences)
+        for alert in opened:
+            self.stdout.write(self.style.WARNING(f'LEAK DETECTED: {alert.sensor.device_id}'))
+        if updated and self.verbosity >= 2:
+            self.stdout.write(f'{len(updated)} ongoing leak alert(s) updated')
+
+    def maybe_report(self, stats):
+        if time.monotonic() - self.last_report >= self.report_every:
+            self.last_report = time.monotonic()
+            self.report(stats)
+
+    def report(self, stats, final=False):
+        s = stats.summary()
+        line = (
+            f'[{s["elapsed"]:7.1f}s] sent={s["readings"]} accepted={s["accepted"]} '
+            f'duplicates={s["duplicates"]} rejected={s["rejected"]} failed={s["failed"]} '
+            f'throughput={s["throughput"]:.1f}/s'
+        )
+        if 'p50_ms' in s:
+            line += (
+                f' latency p50={s["p50_ms"]:.1f}ms p90={s["p90_ms"]:.1f}ms '
+                f'p99={s["p99_ms"]:.1f}ms max={s["max_ms"]:.1f}ms ({s["calls"]} calls)'
+            )
+        if final:
+            self.stdout.write(self.style.SUCCESS(f'Simulation finished. Generated {s["readings"]} readings.'))
+            self.stdout.write(self.style.SUCCESS(line))
+        else:
+            self.stdout.write(line)
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:31
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sensors', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='sensorreading',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sensors', '0002_reading_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sensorreading',
+            name='device_ts',
+            field=models.DateTimeField(blank=True, help_text='Sample time reported by the device', null=True),
+        ),
+        migrations.AddField(
+            model_name='sensorreading',
+            name='seq',
+            field=models.PositiveIntegerField(default=0, help_text='Device-side sequence number'),
+        ),
+        migrations.AddConstraint(
+            model_name='sensorreading',
+            constraint=models.UniqueConstraint(fields=('sensor', 'device_ts', 'seq'), name='unique_device_sample'),
+        ),
+    ]
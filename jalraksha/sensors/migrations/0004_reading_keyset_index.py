@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sensors', '0003_reading_device_ts_seq'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sensorreading',
+            index=models.Index(fields=['-timestamp', '-id'], name='reading_ts_id_idx'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:07
+
+from django.db import migrations, models
+
+
+def backfill_last_seen(apps, schema_editor):
+    """Copy each device's latest reading onto it (one indexed lookup per device)"""
+    SensorDevice = apps.get_model('sensors', 'SensorDevice')
+    SensorReading = apps.get_model('sensors', 'SensorReading')
+    for device in SensorDevice.objects.all():
+        latest = SensorReading.objects.filter(sensor=device).order_by('-timestamp').first()
+        if latest is None:
+            continue
+        device.last_seen = latest.timestamp
+        device.last_battery = latest.battery_level
+        device.last_flow = latest.flow_rate
+        device.last_pressure = latest.pressure
+        device.save(update_fields=['last_seen', 'last_battery', 'last_flow', 'last_pressure'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sensors', '0004_reading_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sensordevice',
+            name='last_battery',
+            field=models.IntegerField(blank=True, help_text='Percentage', null=True),
+        ),
+        migrations.AddField(
+            model_name='sensordevice',
+            name='last_flow',
+            field=models.FloatField(blank=True, help_text='Liters per minute', null=True),
+        ),
+        migrations.AddField(
+            model_name='sensordevice',
+            name='last_pressure',
+            field=models.FloatField(blank=True, help_text='PSI', null=True),
+        ),
+        migrations.AddField(
+            model_name='sensordevice',
+            name='last_seen',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_last_seen, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='sensordevice',
+            index=models.Index(fields=['last_seen'], name='device_last_seen_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sensordevice',
+            index=models.Index(fields=['last_battery'], name='device_last_battery_idx'),
+        ),
+    ]
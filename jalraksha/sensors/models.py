@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 class SensorDevice(models.Model):
     SENSOR_TYPES = [
@@ -19,22 +20,45 @@ class SensorDevice(models.Model):
     installation_date = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField(default=True)
     last_maintenance = models.DateTimeField(null=True, blank=True)
+    # Latest reading, kept up to date by ingest so fleet health never scans readings
+    last_seen = models.DateTimeField(null=True, blank=True)
+    last_battery = models.IntegerField(null=True, blank=True, help_text='Percentage')
+    last_flow = models.FloatField(null=True, blank=True, help_text='Liters per minute')
+    last_pressure = models.FloatField(null=True, blank=True, help_text='PSI')
+    
+    class Meta:
+        indexes = [
+            # The health sweeper finds silent and low-battery devices from these
+            models.Index(fields=['last_seen'], name='device_last_seen_idx'),
+            models.Index(fields=['last_battery'], name='device_last_battery_idx'),
+        ]
     
     def __str__(self):
         return f"{self.device_id} - {self.location}"
 
 class SensorReading(models.Model):
     sensor = models.ForeignKey(SensorDevice, on_delete=models.CASCADE, related_name='readings')
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now)
     flow_rate = models.FloatField(null=True, blank=True, help_text='Liters per minute')
     pressure = models.FloatField(null=True, blank=True, help_text='PSI')
     temperature = models.FloatField(null=True, blank=True, help_text='Celsius')
     battery_level = models.IntegerField(default=100, help_text='Percentage')
+    device_ts = models.DateTimeField(null=True, blank=True, help_text='Sample time reported by the device')
+    seq = models.PositiveIntegerField(default=0, help_text='Device-side sequence number')
     
     class Meta:
         ordering = ['-timestamp']
         indexes = [
             models.Index(fields=['sensor', '-timestamp']),
+            # Keyset pagination across all sensors orders on (timestamp, id).
+            # The (sensor, timestamp) index above serves pages for one sensor,
+            # but without a sensor filter every page would sort the table.
+            models.Index(fields=['-timestamp', '-id'], name='reading_ts_id_idx'),
+        ]
+        constraints = [
+            # Replayed device samples are absorbed instead of duplicated.
+            # Rows without device_ts never conflict (NULLs are distinct).
+            models.UniqueConstraint(fields=['sensor', 'device_ts', 'seq'], name='unique_device_sample'),
         ]
     
     def __str__(self):
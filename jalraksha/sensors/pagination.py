@@ -0,0 +1,107 @@
+import base64
+from datetime import datetime
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def encode_position(timestamp, pk):
+    """Opaque cursor for a (timestamp, id) keyset position"""
+    position = f'{timestamp.isoformat()}|{pk}'
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_position(encoded):
+    """(timestamp, id) from ``encode_position``; raises ValueError when malformed"""
+    try:
+        timestamp, pk = base64.urlsafe_b64decode(encoded.encode()).decode().rsplit('|', 1)
+        timestamp = parse_datetime(timestamp)
+        pk = int(pk)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise ValueError(f'Invalid cursor: {encoded!r}')
+    if not isinstance(timestamp, datetime):
+        raise ValueError(f'Invalid cursor: {encoded!r}')
+    return timestamp, pk
+
+
+class ReadingCursorPagination(BasePagination):
+    """
+    Keyset pagination over readings, newest first, keyed on (timestamp, id).
+
+    Each page is one indexed range scan: ``WHERE (timestamp, id) < cursor
+    ORDER BY timestamp DESC, id DESC LIMIT n``. It costs the same however
+    deep the page is and never runs COUNT(*). Rows inserted while a
+    client pages through do not shift later pages. Paging is forward
+    only; ``next`` is null on the last page.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 100
+    max_page_size = 10000
+    ordering = ('-timestamp', '-id')
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def encode_cursor(self, reading):
+        # Pages hold model instances or values() rows
+        if isinstance(reading, dict):
+            timestamp, pk = reading['timestamp'], reading['id']
+        else:
+            timestamp, pk = reading.timestamp, reading.pk
+        return encode_position(timestamp, pk)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            return decode_position(encoded)
+        except ValueError:
+            raise NotFound('Invalid cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        size = self.get_page_size(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request)
+        if position is not None:
+            timestamp, pk = position
+            queryset = queryset.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk))
+
+        # One extra row tells us whether there is a next page
+        page = list(queryset[:size + 1])
+        self.has_next = len(page) > size
+        page = page[:size]
+        self.next_cursor = self.encode_cursor(page[-1]) if self.has_next else None
+        return page
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,164 @@
+"""
+Compact request bodies for reading ingest.
+
+``application/msgpack`` takes the same objects as the JSON API (one
+reading, a list, or ``{"readings": [...]}``), MessagePack-encoded.
+Timestamps may be MessagePack timestamps, epoch seconds or ISO-8601.
+
+``application/vnd.jalraksha.readings.v1`` is a sequence of fixed-width
+37-byte little-endian records, with no header and no padding:
+
+    offset  size  type     field
+         0    16  char[]   device_id, ASCII, NUL-padded, at most 15 bytes
+        16     4  uint32   device_ts, epoch seconds (0: not set)
+        20     4  uint32   seq
+        24     4  float32  flow_rate   (NaN: not measured)
+        28     4  float32  pressure    (NaN: not measured)
+        32     4  float32  temperature (NaN: not measured)
+        36     1  uint8    battery_level (255: not reported)
+
+The last device_id byte is always NUL, so an id a device cut short to
+fit the field is refused rather than stored under a different (maybe
+another device's) id. ``pack_readings`` raises ValueError for longer ids.
+
+A body is decoded with one ``numpy.frombuffer`` call and per-column
+conversions, and parses to the same row dicts as the JSON API, so both
+formats go through the same validation in ``ingest``. That includes the
+range of ``seq``: the column is a signed 32-bit integer, so a record whose
+seq is above 2**31 - 1 is rejected like any other invalid row, and
+devices should wrap their counter there.
+
+A body always parses to a list of rows. The single-reading endpoint
+accepts a list holding exactly one and refuses longer ones.
+"""
+from datetime import datetime
+import numpy as np
+from rest_framework.exceptions import ParseError, UnsupportedMediaType
+from rest_framework.parsers import BaseParser
+
+try:
+    import msgpack
+except ImportError:  # MessagePack bodies are refused without msgpack
+    msgpack = None
+
+PACKED_READING = np.dtype([
+    ('device_id', 'S16'),
+    ('device_ts', '<u4'),
+    ('seq', '<u4'),
+    ('flow_rate', '<f4'),
+    ('pressure', '<f4'),
+    ('temperature', '<f4'),
+    ('battery_level', 'u1'),
+])
+NO_BATTERY = 255
+# The last byte of the device_id field is reserved as a terminator
+MAX_PACKED_DEVICE_ID = PACKED_READING['device_id'].itemsize - 1
+FLOAT_COLUMNS = ('flow_rate', 'pressure', 'temperature')
+# float32 keeps ~7 significant digits; rounding drops the widening noise
+# (25.43 -> 25.43000030517578) while staying within float32 precision
+FLOAT_DECIMALS = 4
+
+
+# The three float fields as one (n, 3) block, so they convert in one pass
+FLOAT_BLOCK = np.dtype({
+    'names': ['values'],
+    'formats': [('<f4', len(FLOAT_COLUMNS))],
+    'offsets': [PACKED_READING.fields['flow_rate'][1]],
+    'itemsize': PACKED_READING.itemsize,
+})
+
+
+def _float_rows(records):
+    """Per-record [flow_rate, pressure, temperature] lists with NaN as None"""
+    block = np.round(records.view(FLOAT_BLOCK)['values'].astype(np.float64), FLOAT_DECIMALS)
+    missing = np.isnan(block)
+    if missing.any():
+        block = block.astype(object)
+        block[missing] = None
+    return block.tolist()
+
+
+def unpack_readings(data):
+    """Decode packed records into ingest row dicts"""
+    if len(data) % PACKED_READING.itemsize:
+        raise ParseError(f'Body length is not a multiple of the {PACKED_READING.itemsize}-byte record.')
+    records = np.frombuffer(data, dtype=PACKED_READING)
+    terminators = np.frombuffer(data, dtype=np.uint8).reshape(-1, PACKED_READING.itemsize)[:, MAX_PACKED_DEVICE_ID]
+    if terminators.any():
+        raise ParseError(
+            f'device_id is longer than {MAX_PACKED_DEVICE_ID} bytes in record {int(terminators.argmax())}.'
+        )
+    try:
+        # tolist() already drops the NUL padding
+        device_ids = [device_id.decode('ascii') for device_id in records['device_id'].tolist()]
+    except UnicodeDecodeError:
+        raise ParseError('device_id must be ASCII.')
+
+    rows = []
+    for device_id, device_ts, seq, (flow_rate, pressure, temperature), battery in zip(
+        device_ids,
+        records['device_ts'].tolist(),
+        records['seq'].tolist(),
+        _float_rows(records),
+        records['battery_level'].tolist(),
+    ):
+        row = {
+            'device_id': device_id,
+            'seq': seq,
+            'flow_rate': flow_rate,
+            'pressure': pressure,
+            'temperature': temperature,
+        }
+        if device_ts:
+            row['device_ts'] = device_ts
+        if battery != NO_BATTERY:
+            row['battery_level'] = battery
+        rows.append(row)
+    return rows
+
+
+def pack_readings(rows):
+    """Encode ingest row dicts as packed records (for devices, tests and benchmarks)"""
+    records = np.zeros(len(rows), dtype=PACKED_READING)
+    device_ids = [row['device_id'].encode('ascii') for row in rows]
+    for device_id in device_ids:
+        # numpy would silently cut it to the field width
+        if len(device_id) > MAX_PACKED_DEVICE_ID:
+            raise ValueError(f'device_id {device_id.decode()!r} is longer than {MAX_PACKED_DEVICE_ID} bytes.')
+    records['device_id'] = device_ids
+    records['device_ts'] = [_epoch(row.get('device_ts')) for row in rows]
+    records['seq'] = [row.get('seq', 0) for row in rows]
+    for name in FLOAT_COLUMNS:
+        records[name] = [np.nan if row.get(name) is None else row[name] for row in rows]
+    records['battery_level'] = [row.get('battery_level', NO_BATTERY) for row in rows]
+    return records.tobytes()
+
+
+def _epoch(value):
+    if value is None:
+        return 0
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    return int(value)
+
+
+class PackedReadingParser(BaseParser):
+    media_type = 'application/vnd.jalraksha.readings.v1'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return unpack_readings(stream.read() if stream is not None else b'')
+
+
+class MessagePackParser(BaseParser):
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if msgpack is None:
+            raise UnsupportedMediaType(media_type, detail='MessagePack bodies need msgpack installed.')
+        if stream is None:
+            raise ParseError('Empty request body.')
+        try:
+            # timestamp=3 decodes MessagePack timestamps to aware datetimes
+            return msgpack.unpackb(stream.read(), raw=False, timestamp=3)
+        except (ValueError, msgpack.ExtraData, msgpack.FormatError, msgpack.StackError) as exc:
+            raise ParseError(f'MessagePack parse error - {str(exc) or type(exc).__name__}')
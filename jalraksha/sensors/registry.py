@@ -0,0 +1,135 @@
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+
+REGISTRY_SETTINGS = getattr(settings, 'SENSOR_REGISTRY_CACHE', {})
+
+# Kept current by ingest with plain UPDATEs (update_last_seen) that do not
+# invalidate the registry, so cached devices are loaded without them
+LIVE_FIELDS = ('last_seen', 'last_battery', 'last_flow', 'last_pressure')
+
+
+class DeviceRegistry:
+    """
+    Bounded, TTL-based in-process cache of SensorDevice rows.
+
+    Devices are indexed by both primary key and device_id. Entries are
+    evicted least-recently-used once ``max_size`` is reached and expire
+    after ``ttl`` seconds; signal handlers in ``sensors.signals`` drop
+    entries as soon as a device is saved or deleted.
+
+    ``LIVE_FIELDS`` are deferred on cached devices. Reading one loads the
+    current value from the database, and ``save()`` leaves them alone,
+    so a cached device can be saved without writing back stale values.
+    """
+
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._by_pk = OrderedDict()
+        self._pk_by_device_id = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get_cached(self, pk):
+        entry = self._by_pk.get(pk)
+        if entry is None:
+            return None
+        device, expires_at = entry
+        if expires_at < time.monotonic():
+            self._drop(pk)
+            return None
+        self._by_pk.move_to_end(pk)
+        return device
+
+    def _drop(self, pk):
+        entry = self._by_pk.pop(pk, None)
+        if entry is not None:
+            self._pk_by_device_id.pop(entry[0].device_id, None)
+
+    def _store(self, device):
+        self._drop(device.pk)
+        self._by_pk[device.pk] = (device, time.monotonic() + self.ttl)
+        self._pk_by_device_id[device.device_id] = device.pk
+        while len(self._by_pk) > self.max_size:
+            pk, (evicted, _) = self._by_pk.popitem(last=False)
+            self._pk_by_device_id.pop(evicted.device_id, None)
+
+    def get_many(self, device_ids):
+        """Return {device_id: SensorDevice} for known ids, one query for all misses"""
+        from .models import SensorDevice
+
+        found = {}
+        missing = set()
+        with self._lock:
+            for device_id in set(device_ids):
+                pk = self._pk_by_device_id.get(device_id)
+                device = self._get_cached(pk) if pk is not None else None
+                if device is None:
+                    missing.add(device_id)
+                else:
+                    found[device_id] = device
+            self.hits += len(found)
+            self.misses += len(missing)
+
+        if missing:
+            fetched = SensorDevice.objects.defer(*LIVE_FIELDS).in_bulk(missing, field_name='device_id')
+            with self._lock:
+                for device in fetched.values():
+                    self._store(device)
+            found.update(fetched)
+        return found
+
+    def get_by_device_id(self, device_id):
+        """Return the SensorDevice for ``device_id`` or raise DoesNotExist"""
+        from .models import SensorDevice
+
+        device = self.get_many([device_id]).get(device_id)
+        if device is None:
+            raise SensorDevice.DoesNotExist(f'No sensor with device_id {device_id!r}')
+        return device
+
+    def get_by_id(self, pk):
+        """Return the SensorDevice with primary key ``pk`` or raise DoesNotExist"""
+        from .models import SensorDevice
+
+        with self._lock:
+            device = self._get_cached(pk)
+            if device is not None:
+                self.hits += 1
+                return device
+            self.misses += 1
+
+        device = SensorDevice.objects.defer(*LIVE_FIELDS).get(pk=pk)
+        with self._lock:
+            self._store(device)
+        return device
+
+    def invalidate(self, pk=None):
+        """Drop one device, or the whole registry when ``pk`` is None"""
+        with self._lock:
+            if pk is None:
+                self._by_pk.clear()
+                self._pk_by_device_id.clear()
+            else:
+                self._drop(pk)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._by_pk),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+device_registry = DeviceRegistry(
+    max_size=REGISTRY_SETTINGS.get('MAX_SIZE', 10000),
+    ttl=REGISTRY_SETTINGS.get('TTL', 300),
+)
@@ -1,3 +1,5 @@
+from django.db.models import F
+from django.utils import timezone
 from rest_framework import serializers
 from .models import SensorDevice, SensorReading
 
@@ -12,15 +14,68 @@ class SensorReadingSerializer(serializers.ModelSerializer):
     class Meta:
         model = SensorReading
         fields = '__all__'
+    
+    def __init__(self, *args, fields=None, **kwargs):
+        """``fields`` limits the output to the named fields"""
+        super().__init__(*args, **kwargs)
+        if fields:
+            unknown = set(fields) - set(self.fields)
+            if unknown:
+                raise serializers.ValidationError({'fields': [f'Unknown field(s): {", ".join(sorted(unknown))}.']})
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+class SensorReadingListSerializer:
+    """
+    Read-only fast path producing the same output as SensorReadingSerializer
+    from ``values()`` rows. The sensor location comes from a JOIN in the same
+    query, and rows become dicts without per-field serializer dispatch.
+    """
+    # Output order matches SensorReadingSerializer
+    FIELDS = (
+        'id', 'sensor_location', 'timestamp', 'flow_rate', 'pressure', 'temperature',
+        'battery_level', 'device_ts', 'seq', 'sensor',
+    )
+    DATETIME_FIELDS = ('timestamp', 'device_ts')
+    # Always fetched: the cursor paginator keys on them
+    KEY_FIELDS = ('id', 'timestamp')
+    
+    def __init__(self, fields=None):
+        if fields:
+            unknown = set(fields) - set(self.FIELDS)
+            if unknown:
+                raise serializers.ValidationError({'fields': [f'Unknown field(s): {", ".join(sorted(unknown))}.']})
+        self.fields = [name for name in self.FIELDS if not fields or name in fields]
+    
+    def values(self, queryset):
+        columns = [name for name in self.FIELDS if name in self.fields or name in self.KEY_FIELDS]
+        if 'sensor_location' in columns:
+            columns.remove('sensor_location')
+            return queryset.values(*columns, sensor_location=F('sensor__location'))
+        return queryset.values(*columns)
+    
+    def to_representation(self, rows):
+        # Same ISO-8601 output as DRF's DateTimeField, minus its per-value
+        # settings lookups and validity checks
+        tz = timezone.get_current_timezone()
+        datetimes = [name for name in self.DATETIME_FIELDS if name in self.fields]
+        data = []
+        for row in rows:
+            for name in datetimes:
+                if row[name] is not None:
+                    value = row[name].astimezone(tz).isoformat()
+                    row[name] = value[:-6] + 'Z' if value.endswith('+00:00') else value
+            data.append({name: row[name] for name in self.fields})
+        return data
 
 class SensorReadingCreateSerializer(serializers.ModelSerializer):
-    device_id = serializers.CharField(write_only=True)
+    """
+    Shape of a single reading POST. Validation happens in
+    ``ingest.validate_rows``, as for the batch endpoint; this serializer
+    renders the response and the browsable API form.
+    """
+    device_id = serializers.CharField(source='sensor.device_id')
     
     class Meta:
         model = SensorReading
-        fields = ['device_id', 'flow_rate', 'pressure', 'temperature', 'battery_level']
-    
-    def create(self, validated_data):
-        device_id = validated_data.pop('device_id')
-        sensor = SensorDevice.objects.get(device_id=device_id)
-        return SensorReading.objects.create(sensor=sensor, **validated_data)
\ No newline at end of file
+        fields = ['id', 'device_id', 'flow_rate', 'pressure', 'temperature', 'battery_level', 'device_ts', 'seq']
@@ -0,0 +1,10 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import SensorDevice
+from .registry import device_registry
+
+
+@receiver([post_save, post_delete], sender=SensorDevice)
+def invalidate_device_registry(sender, instance, **kwargs):
+    """Keep the in-process device registry in step with the database"""
+    device_registry.invalidate(instance.pk)
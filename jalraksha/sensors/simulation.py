@@ -0,0 +1,137 @@
+"""
+Background simulator process shared by every web worker.
+
+The running simulator is tracked through a pid file and its output goes
+to a log file, both in ``SIMULATION_RUN_DIR``. Any gunicorn or uvicorn
+worker can therefore start it, stop it or tail its output, whichever
+worker handled the previous request.
+"""
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from django.conf import settings
+
+
+class SimulationManager:
+    def __init__(self, run_dir, name='simulation'):
+        self.run_dir = str(run_dir)
+        self.pid_path = os.path.join(self.run_dir, f'{name}.pid')
+        self.log_path = os.path.join(self.run_dir, f'{name}.log')
+
+    def _read_pid(self):
+        try:
+            with open(self.pid_path) as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _alive(self, pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        except OSError:
+            return False
+        return True
+
+    def pid(self):
+        """Pid of the running simulator, clearing a stale pid file"""
+        pid = self._read_pid()
+        if pid is None:
+            return None
+        if not self._alive(pid):
+            try:
+                os.remove(self.pid_path)
+            except FileNotFoundError:
+                pass
+            return None
+        return pid
+
+    def is_running(self):
+        return self.pid() is not None
+
+    def start(self, args):
+        """Start ``manage.py simulate_sensor`` with args. Returns the pid, or None if one is already running."""
+        if self.is_running():
+            return None
+        os.makedirs(self.run_dir, exist_ok=True)
+
+        env = os.environ.copy()
+        env['PYTHONUNBUFFERED'] = '1'
+        command = [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'simulate_sensor', *args]
+        # Truncate the previous run's log; readers track their own offsets
+        with open(self.log_path, 'w') as log:
+            if sys.platform == 'win32':
+                process = subprocess.Popen(
+                    command, stdout=log, stderr=subprocess.STDOUT, env=env,
+                    creationflags=subprocess.CREATE_NEW_PROCESS_GROUP
+                )
+            else:
+                process = subprocess.Popen(
+                    command, stdout=log, stderr=subprocess.STDOUT, env=env,
+                    start_new_session=True
+                )
+
+        # Reap the child when it exits so it does not linger as a zombie
+        threading.Thread(target=process.wait, daemon=True).start()
+
+        tmp_path = f'{self.pid_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(str(process.pid))
+        os.replace(tmp_path, self.pid_path)
+        return process.pid
+
+    def stop(self, timeout=3.0):
+        """Terminate the simulator, killing it if it ignores SIGTERM. Returns False if none was running."""
+        pid = self.pid()
+        if pid is None:
+            return False
+
+        try:
+            os.kill(pid, signal.SIGTERM)
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                if not self._alive(pid):
+                    break
+                time.sleep(0.1)
+            else:
+                os.kill(pid, getattr(signal, 'SIGKILL', signal.SIGTERM))
+        except ProcessLookupError:
+            pass
+
+        try:
+            os.remove(self.pid_path)
+        except FileNotFoundError:
+            pass
+        return True
+
+    def read_output(self, offset=0, max_bytes=64 * 1024):
+        """Return (text, next_offset) for log output written after ``offset``"""
+        try:
+            with open(self.log_path, 'rb') as log:
+                log.seek(0, os.SEEK_END)
+                size = log.tell()
+                if offset > size:
+                    # Log was truncated by a new run
+                    offset = 0
+                log.seek(offset)
+                data = log.read(max_bytes)
+        except FileNotFoundError:
+            return '', 0
+        # Only hand out complete lines so a reader never sees half of one
+        end = data.rfind(b'\n') + 1
+        if end == 0 and len(data) < max_bytes:
+            return '', offset
+        if end == 0:
+            end = len(data)
+        return data[:end].decode('utf-8', errors='replace'), offset + end
+
+
+simulation_manager = SimulationManager(
+    getattr(settings, 'SIMULATION_RUN_DIR', os.path.join(settings.BASE_DIR, 'run'))
+)
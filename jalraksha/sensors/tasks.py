@@ -0,0 +1,7 @@
+from celery import shared_task
+from . import health
+
+@shared_task
+def sweep_fleet_health():
+    """Raise offline/low-battery alerts from the device last-seen index"""
+    return health.sweep_fleet_health()
@@ -1,3 +1,641 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import os
+import time
+from datetime import timedelta
+from unittest import mock, skipUnless
+from django.core.cache import cache
+from django.db import IntegrityError, OperationalError, connection
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from alerts.models import Alert
+from .export import export_chunks, pa, pq, stream_parquet
+from .gateway import DecodeError, IngestGateway, _mqtt_packet, decode
+from .health import LOW_BATTERY, OFFLINE_AFTER, sweep_fleet_health
+from .ingest import MAX_SEQ, update_last_seen
+from .loadgen import HttpConnection, IngestStats
+from .models import SensorDevice, SensorReading
+from .parsers import PACKED_READING, msgpack, pack_readings, unpack_readings
+from .registry import DeviceRegistry, device_registry
+from .writebehind import WRITE_BEHIND_SETTINGS, MemoryBackend, ReadingWriteBehind, RedisBackend
 
-# Create your tests here.
+
+class IngestTestCase(TestCase):
+    def setUp(self):
+        # The registry outlives each test's rolled-back transaction
+        device_registry.invalidate()
+        self.sensor = SensorDevice.objects.create(
+            device_id='D1', sensor_type='FLOW', deployment_type='RESIDENTIAL', location='Test street',
+        )
+
+    def post_batch(self, body, content_type='application/json'):
+        return self.client.post('/api/readings/batch/', body, content_type=content_type)
+
+    def post_reading(self, body, content_type='application/json'):
+        return self.client.post('/api/readings/', body, content_type=content_type)
+
+
+class DeviceRegistryTests(IngestTestCase):
+    def setUp(self):
+        super().setUp()
+        self.registry = DeviceRegistry(ttl=60)
+
+    def test_hits_and_misses_are_counted(self):
+        self.registry.get_many(['D1', 'UNKNOWN'])
+        self.registry.get_many(['D1', 'UNKNOWN'])
+        self.registry.get_by_id(self.sensor.pk)
+        stats = self.registry.stats()
+        # Unknown ids are not cached, so they miss every time
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (2, 3, 1))
+
+    def test_entries_expire_after_the_ttl(self):
+        self.registry.get_by_id(self.sensor.pk)
+        with mock.patch('sensors.registry.time.monotonic', return_value=time.monotonic() + 61):
+            with self.assertNumQueries(1):
+                self.registry.get_by_id(self.sensor.pk)
+        self.assertEqual(self.registry.stats()['misses'], 2)
+
+    def test_saved_device_is_dropped(self):
+        cached = device_registry.get_by_device_id('D1')
+        SensorDevice.objects.filter(pk=self.sensor.pk).update(location='Moved street')
+        self.assertIs(device_registry.get_by_device_id('D1'), cached)
+        self.sensor.location = 'Moved street'
+        self.sensor.save()
+        self.assertEqual(device_registry.get_by_device_id('D1').location, 'Moved street')
+
+    def test_cached_device_does_not_save_back_stale_last_seen(self):
+        cached = self.registry.get_by_device_id('D1')
+        reading = SensorReading.objects.create(sensor=self.sensor, flow_rate=3.0, battery_level=80)
+        update_last_seen([reading])
+        cached.location = 'Moved street'
+        cached.save()
+        self.sensor.refresh_from_db()
+        self.assertEqual((self.sensor.location, self.sensor.last_battery), ('Moved street', 80))
+        self.assertEqual(self.sensor.last_seen, reading.timestamp)
+
+
+class FleetHealthTests(TestCase):
+    def setUp(self):
+        # Alert counters and KPI generations live in the cache
+        cache.clear()
+        self.now = timezone.now()
+        self.sensor = SensorDevice.objects.create(
+            device_id='H1', sensor_type='FLOW', deployment_type='RESIDENTIAL', location='Health street',
+            last_seen=self.now - timedelta(seconds=OFFLINE_AFTER + 60), last_battery=90,
+        )
+
+    def test_stale_device_is_alerted_once(self):
+        first = sweep_fleet_health(self.now)
+        second = sweep_fleet_health(self.now + timedelta(minutes=5))
+        self.assertEqual((first['offline'], first['opened'], first['updated']), (1, 1, 0))
+        self.assertEqual((second['offline'], second['opened'], second['updated']), (1, 0, 1))
+
+        alert = Alert.objects.get()
+        self.assertEqual((alert.alert_type, alert.sensor, alert.occurrence_count), ('SENSOR_OFFLINE', self.sensor, 2))
+        self.assertFalse(alert.is_resolved)
+
+    def test_device_silent_since_installation_is_offline(self):
+        SensorDevice.objects.filter(pk=self.sensor.pk).update(
+            last_seen=None, installation_date=self.now - timedelta(days=1),
+        )
+        self.assertEqual(sweep_fleet_health(self.now)['offline'], 1)
+        self.assertIn('has not reported since installation', Alert.objects.get().message)
+
+    def test_recovered_device_has_its_alerts_resolved(self):
+        SensorDevice.objects.filter(pk=self.sensor.pk).update(last_battery=LOW_BATTERY - 1)
+        self.assertEqual(sweep_fleet_health(self.now)['opened'], 2)
+
+        SensorDevice.objects.filter(pk=self.sensor.pk).update(last_seen=self.now, last_battery=LOW_BATTERY)
+        summary = sweep_fleet_health(self.now)
+        self.assertEqual((summary['offline'], summary['low_battery'], summary['resolved']), (0, 0, 2))
+        self.assertFalse(Alert.objects.filter(is_resolved=False).exists())
+        self.assertFalse(Alert.objects.filter(resolved_at__isnull=True).exists())
+
+    def test_healthy_device_raises_nothing(self):
+        SensorDevice.objects.filter(pk=self.sensor.pk).update(last_seen=self.now)
+        summary = sweep_fleet_health(self.now)
+        self.assertEqual((summary['opened'], summary['resolved']), (0, 0))
+        self.assertFalse(Alert.objects.exists())
+
+
+class BatchValidationTests(IngestTestCase):
+    def assertRejected(self, body, field):
+        response = self.post_batch(body)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(field, response.json()['results'][0]['errors'])
+        self.assertFalse(SensorReading.objects.exists())
+
+    def test_overflowing_battery_level_is_rejected(self):
+        # 1e400 parses to float infinity, which int() cannot convert
+        self.assertRejected('[{"device_id": "D1", "battery_level": 1e400}]', 'battery_level')
+
+    def test_overflowing_seq_is_rejected(self):
+        self.assertRejected('[{"device_id": "D1", "seq": 1e400}]', 'seq')
+
+    def test_seq_beyond_integer_column_is_rejected(self):
+        self.assertRejected([{'device_id': 'D1', 'seq': MAX_SEQ + 1}], 'seq')
+
+    def test_bad_row_does_not_fail_the_batch(self):
+        response = self.post_batch([
+            {'device_id': 'D1', 'flow_rate': 3.5, 'seq': MAX_SEQ},
+            {'device_id': 'D1', 'seq': -1},
+        ])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([r['status'] for r in response.json()['results']], ['accepted', 'rejected'])
+        self.assertEqual(SensorReading.objects.get().seq, MAX_SEQ)
+
+
+class ReadingFilterTests(IngestTestCase):
+    def test_out_of_range_times_are_rejected(self):
+        for value in ('nan', 'inf', '1e20', '-1e20'):
+            with self.subTest(since=value):
+                response = self.client.get('/api/readings/', {'since': value})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'since': ['Epoch seconds out of range.']})
+
+    def test_epoch_seconds_filter(self):
+        SensorReading.objects.create(sensor=self.sensor, flow_rate=1.0)
+        response = self.client.get('/api/readings/', {'since': timezone.now().timestamp() - 60})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 1)
+
+    def test_offset_past_year_9999_is_rejected(self):
+        response = self.client.get('/api/readings/', {'until': '9999-12-31T23:59:59-14:00'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'until': ['Timestamp out of range.']})
+
+
+class AfterCommitTests(IngestTestCase):
+    def test_broker_outage_after_commit_does_not_fail_the_request(self):
+        with mock.patch('sensors.events.publish_many', side_effect=ConnectionError('broker down')), \
+                self.assertLogs('sensors.ingest', 'ERROR'), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.post_batch([{'device_id': 'D1', 'flow_rate': 2.5}])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(SensorReading.objects.count(), 1)
+
+
+    def test_ingest_leaves_the_flow_state_to_the_drainer(self):
+        with mock.patch('analytics.streaming.flow_detector.update') as update, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.post_batch([{'device_id': 'D1', 'flow_rate': 2.5}])
+        update.assert_not_called()
+
+
+class BatchDedupTests(IngestTestCase):
+    def test_replayed_batch_is_reported_as_duplicates(self):
+        rows = [{'device_id': 'D1', 'device_ts': 1790000000 + i, 'seq': i} for i in range(3)]
+        first = self.post_batch(rows)
+        self.assertEqual(first.status_code, 201)
+        replay = self.post_batch(rows)
+        self.assertEqual(replay.status_code, 201)
+        self.assertEqual([r['status'] for r in replay.json()['results']], ['duplicate'] * 3)
+        self.assertEqual(
+            [r['id'] for r in replay.json()['results']], [r['id'] for r in first.json()['results']]
+        )
+        self.assertEqual(SensorReading.objects.count(), 3)
+
+    def test_repeat_inside_one_batch_is_stored_once(self):
+        row = {'device_id': 'D1', 'device_ts': 1790000000, 'seq': 9}
+        response = self.post_batch([row, row])
+        self.assertEqual([r['status'] for r in response.json()['results']], ['accepted', 'duplicate'])
+        self.assertEqual(SensorReading.objects.count(), 1)
+
+    def test_readings_without_device_ts_are_not_deduplicated(self):
+        row = {'device_id': 'D1', 'flow_rate': 2.5, 'seq': 1}
+        self.post_batch([row])
+        self.post_batch([row])
+        self.assertEqual(SensorReading.objects.count(), 2)
+
+
+class ReadingPaginationTests(IngestTestCase):
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        # Two readings share a timestamp, so the id breaks the tie
+        stamps = [now, now - timedelta(minutes=1), now - timedelta(minutes=1), now - timedelta(minutes=2)]
+        self.ids = [
+            SensorReading.objects.create(sensor=self.sensor, flow_rate=1.0, timestamp=ts).pk for ts in stamps
+        ]
+        # Newest first, ties by id descending
+        self.expected = [self.ids[0], self.ids[2], self.ids[1], self.ids[3]]
+
+    def walk(self, url):
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(reading['id'] for reading in response.json()['results'])
+            url = response.json()['next']
+        return seen
+
+    def test_pages_cover_every_reading_once(self):
+        self.assertEqual(self.walk('/api/readings/?page_size=1'), self.expected)
+        self.assertEqual(self.walk('/api/readings/?page_size=3'), self.expected)
+
+    def test_new_readings_do_not_shift_later_pages(self):
+        response = self.client.get('/api/readings/', {'page_size': 2})
+        SensorReading.objects.create(sensor=self.sensor, flow_rate=1.0)
+        rest = self.walk(response.json()['next'])
+        self.assertEqual(rest, self.expected[2:])
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get('/api/readings/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    @skipUnless(connection.vendor == 'sqlite', 'query plans are checked on SQLite')
+    def test_pages_are_index_range_scans(self):
+        def plan(params):
+            statements = []
+
+            def record(execute, sql, sql_params, many, context):
+                statements.append((sql, sql_params))
+                return execute(sql, sql_params, many, context)
+
+            with connection.execute_wrapper(record):
+                self.client.get('/api/readings/', params)
+            sql, sql_params = next(s for s in statements if 'sensors_sensorreading' in s[0])
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', sql_params)
+                return ' '.join(row[-1] for row in cursor.fetchall())
+
+        # Fleet-wide pages need (timestamp, id); (sensor, timestamp) cannot order them
+        fleet = plan({'page_size': 2})
+        self.assertIn('reading_ts_id_idx', fleet)
+        self.assertNotIn('TEMP B-TREE', fleet)
+        # Pages for one sensor keep using the existing (sensor, timestamp) index
+        sensor_index = next(i.name for i in SensorReading._meta.indexes if i.fields == ['sensor', '-timestamp'])
+        self.assertIn(sensor_index, plan({'page_size': 2, 'sensor': 'D1'}))
+
+
+
+class ExportTests(IngestTestCase):
+    def setUp(self):
+        super().setUp()
+        start = timezone.now() - timedelta(hours=1)
+        self.readings = [
+            SensorReading.objects.create(
+                sensor=self.sensor, flow_rate=1.5 * i, pressure=40.0, battery_level=90,
+                timestamp=start + timedelta(minutes=i), device_ts=start + timedelta(minutes=i), seq=i,
+            )
+            for i in range(5)
+        ]
+
+    def export(self, export_format):
+        response = self.client.get('/api/readings/export/', {'format': export_format})
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_csv_round_trip(self):
+        rows = list(csv.DictReader(io.StringIO(self.export('csv').decode())))
+        self.assertEqual([row['seq'] for row in rows], ['0', '1', '2', '3', '4'])
+        self.assertEqual({row['device_id'] for row in rows}, {'D1'})
+        self.assertEqual(float(rows[3]['flow_rate']), 4.5)
+
+    @skipUnless(pa, 'needs pyarrow')
+    def test_parquet_round_trip(self):
+        table = pq.read_table(io.BytesIO(self.export('parquet')))
+        self.assertEqual(table.column('seq').to_pylist(), [0, 1, 2, 3, 4])
+        self.assertEqual(
+            table.column('timestamp').to_pylist(), [reading.timestamp for reading in self.readings]
+        )
+
+    @skipUnless(pa, 'needs pyarrow')
+    def test_arrow_round_trip(self):
+        table = pa.ipc.open_stream(self.export('arrow')).read_all()
+        self.assertEqual(table.column('flow_rate').to_pylist(), [1.5 * i for i in range(5)])
+
+    @skipUnless(pa, 'needs pyarrow')
+    def test_parquet_writes_one_row_group_per_chunk(self):
+        body = b''.join(stream_parquet(export_chunks(SensorReading.objects.all(), chunk_size=2)))
+        self.assertEqual(pq.ParquetFile(io.BytesIO(body)).num_row_groups, 3)
+
+    async def test_asgi_export_is_streamed_asynchronously(self):
+        response = await self.async_client.get('/api/readings/export/', {'format': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(body.decode().splitlines()), 6)
+
+
+class SingleReadingTests(IngestTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.dict(WRITE_BEHIND_SETTINGS, {'ENABLED': False})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_stored_and_acknowledged(self):
+        response = self.post_reading({'device_id': 'D1', 'flow_rate': 2.5, 'device_ts': 1790000000, 'seq': 1})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['status'], 'accepted')
+        reading = SensorReading.objects.get()
+        self.assertEqual(response.json()['id'], reading.pk)
+        self.assertEqual(reading.timestamp.timestamp(), 1790000000)
+
+    def test_inactive_device_is_refused(self):
+        SensorDevice.objects.filter(pk=self.sensor.pk).update(is_active=False)
+        response = self.post_reading({'device_id': 'D1', 'flow_rate': 2.5})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'device_id': ['Device is inactive.']})
+        self.assertFalse(SensorReading.objects.exists())
+
+    def test_future_timestamp_is_refused(self):
+        response = self.post_reading({'device_id': 'D1', 'device_ts': '2099-01-01T00:00:00Z'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('device_ts', response.json())
+        self.assertFalse(SensorReading.objects.exists())
+
+    def test_replay_is_reported_as_duplicate(self):
+        reading = {'device_id': 'D1', 'flow_rate': 2.5, 'device_ts': '2026-01-01T00:00:00Z', 'seq': 4}
+        first = self.post_reading(reading)
+        replay = self.post_reading(reading)
+        self.assertEqual(replay.status_code, 200)
+        self.assertEqual(replay.json()['status'], 'duplicate')
+        self.assertEqual(replay.json()['id'], first.json()['id'])
+        self.assertEqual(SensorReading.objects.count(), 1)
+
+
+class BinaryBodyTests(IngestTestCase):
+    PACKED = 'application/vnd.jalraksha.readings.v1'
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.dict(WRITE_BEHIND_SETTINGS, {'ENABLED': False})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_packed_round_trip(self):
+        rows = unpack_readings(pack_readings([
+            {'device_id': 'D1', 'device_ts': 1790000000, 'seq': 3, 'flow_rate': 25.43, 'battery_level': 80},
+            {'device_id': 'D1', 'seq': 4, 'pressure': 41.5},
+        ]))
+        self.assertEqual(rows, [
+            {'device_id': 'D1', 'device_ts': 1790000000, 'seq': 3, 'flow_rate': 25.43,
+             'pressure': None, 'temperature': None, 'battery_level': 80},
+            {'device_id': 'D1', 'seq': 4, 'flow_rate': None, 'pressure': 41.5, 'temperature': None},
+        ])
+
+    def test_packed_single_reading(self):
+        body = pack_readings([{'device_id': 'D1', 'device_ts': 1790000000, 'seq': 7, 'flow_rate': 2.5}])
+        response = self.post_reading(body, content_type=self.PACKED)
+        self.assertEqual(response.status_code, 201)
+        reading = SensorReading.objects.get()
+        self.assertEqual((reading.seq, reading.flow_rate), (7, 2.5))
+        self.assertEqual(reading.timestamp.timestamp(), 1790000000)
+
+    def test_single_endpoint_refuses_several_readings(self):
+        body = pack_readings([{'device_id': 'D1', 'seq': 1}, {'device_id': 'D1', 'seq': 2}])
+        self.assertEqual(self.post_reading(body, content_type=self.PACKED).status_code, 400)
+        self.assertEqual(self.post_reading([{'device_id': 'D1'}, {'device_id': 'D1'}]).status_code, 400)
+        self.assertFalse(SensorReading.objects.exists())
+
+    def test_json_list_of_one_reading(self):
+        response = self.post_reading([{'device_id': 'D1', 'flow_rate': 2.5}])
+        self.assertEqual(response.status_code, 201)
+
+    def test_packed_seq_beyond_integer_column_is_rejected(self):
+        body = pack_readings([{'device_id': 'D1', 'seq': MAX_SEQ + 1}])
+        response = self.post_batch(body, content_type=self.PACKED)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('seq', response.json()['results'][0]['errors'])
+
+    def test_packed_device_id_must_fit_the_field(self):
+        with self.assertRaisesMessage(ValueError, 'longer than 15 bytes'):
+            pack_readings([{'device_id': 'D' * 16}])
+        # A device that cut its id to the field width
+        body = bytearray(pack_readings([{'device_id': 'D1'}, {'device_id': 'D' * 15}]))
+        body[PACKED_READING.itemsize + 15:PACKED_READING.itemsize + 16] = b'X'
+        response = self.post_batch(bytes(body), content_type=self.PACKED)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('longer than 15 bytes in record 1', response.json()['detail'])
+        self.assertFalse(SensorReading.objects.exists())
+
+    def test_truncated_packed_body(self):
+        body = pack_readings([{'device_id': 'D1'}])[:-1]
+        self.assertEqual(self.post_batch(body, content_type=self.PACKED).status_code, 400)
+
+    @skipUnless(msgpack, 'needs msgpack')
+    def test_msgpack_batch(self):
+        body = msgpack.packb({'readings': [{'device_id': 'D1', 'device_ts': 1790000000, 'seq': 1}]})
+        response = self.post_batch(body, content_type='application/msgpack')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(SensorReading.objects.get().seq, 1)
+
+    def test_msgpack_refused_without_msgpack(self):
+        with mock.patch('sensors.parsers.msgpack', None):
+            response = self.post_batch(b'\x90', content_type='application/msgpack')
+        self.assertEqual(response.status_code, 415)
+
+
+class BufferedSingleReadingTests(IngestTestCase):
+    def setUp(self):
+        super().setUp()
+        self.buffer = ReadingWriteBehind(MemoryBackend())
+        for patcher in (
+            mock.patch.dict(WRITE_BEHIND_SETTINGS, {'ENABLED': True}),
+            mock.patch('sensors.api_views.reading_buffer', self.buffer),
+            # Flushed by the test, not by a background thread
+            mock.patch.object(self.buffer, '_ensure_started'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_queued_then_written_on_flush(self):
+        response = self.post_reading({'device_id': 'D1', 'flow_rate': 2.5})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['status'], 'queued')
+        self.assertFalse(SensorReading.objects.exists())
+
+        self.assertEqual(self.buffer.flush(), 1)
+        reading = SensorReading.objects.get()
+        self.assertEqual((reading.flow_rate, reading.battery_level), (2.5, 100))
+
+    def test_inactive_device_is_refused(self):
+        SensorDevice.objects.filter(pk=self.sensor.pk).update(is_active=False)
+        response = self.post_reading({'device_id': 'D1', 'flow_rate': 2.5})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.buffer.backend.depth(), 0)
+
+    def test_failed_flush_keeps_rows_for_the_next_one(self):
+        self.post_reading({'device_id': 'D1', 'flow_rate': 2.5})
+        with mock.patch('sensors.ingest.store_readings', side_effect=OperationalError):
+            with self.assertRaises(OperationalError):
+                self.buffer.flush()
+        self.assertEqual(self.buffer.backend.depth(), 1)
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(SensorReading.objects.count(), 1)
+
+    def test_poison_row_is_dead_lettered_and_the_rest_written(self):
+        from .ingest import store_readings
+
+        def store(readings):
+            if any(r.flow_rate == 9.9 for r in readings):
+                raise IntegrityError('FOREIGN KEY constraint failed')
+            return store_readings(readings)
+
+        for flow_rate in (1.0, 2.0, 9.9, 3.0, 4.0):
+            self.post_reading({'device_id': 'D1', 'flow_rate': flow_rate})
+        with mock.patch('sensors.ingest.store_readings', side_effect=store):
+            self.buffer.flush()
+
+        self.assertEqual(sorted(SensorReading.objects.values_list('flow_rate', flat=True)), [1.0, 2.0, 3.0, 4.0])
+        self.assertEqual(self.buffer.backend.depth(), 0)
+        self.assertEqual([row['flow_rate'] for row in self.buffer.backend.dead_letters()], [9.9])
+        stats = self.buffer.stats()
+        self.assertEqual((stats['written'], stats['dead']), (4, 1))
+        self.assertIn('FOREIGN KEY', stats['last_error'])
+
+    def test_future_timestamp_is_refused(self):
+        future = timezone.now() + timedelta(days=1)
+        response = self.post_reading({'device_id': 'D1', 'device_ts': future.isoformat()})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.buffer.backend.depth(), 0)
+
+    def test_replay_of_stored_reading_is_not_buffered(self):
+        reading = {'device_id': 'D1', 'device_ts': '2026-01-01T00:00:00Z', 'seq': 4}
+        self.post_batch([reading])
+        response = self.post_reading(reading)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'duplicate')
+        self.assertEqual(self.buffer.backend.depth(), 0)
+
+
+@skipUnless(os.environ.get('TEST_REDIS_URL'), 'set TEST_REDIS_URL to a scratch Redis database')
+class RedisBackendTests(SimpleTestCase):
+    def setUp(self):
+        self.backend = RedisBackend(os.environ['TEST_REDIS_URL'], key='test:write-behind', lease=0)
+        self.addCleanup(self.clear)
+        self.clear()
+        for i in range(3):
+            self.backend.push({'seq': i})
+
+    def clear(self):
+        client = self.backend.client
+        client.delete(self.backend.key, self.backend.batches_key, self.backend.dead_key, *client.keys(f'{self.backend.key}:processing:*'))
+
+    def test_unacknowledged_batch_is_requeued(self):
+        _, rows = self.backend.take(2)
+        self.assertEqual(rows, [{'seq': 0}, {'seq': 1}])
+        # The flusher died before acknowledging its batch
+        self.assertEqual(self.backend.recover(), 2)
+        self.assertEqual(self.backend.take(3)[1], [{'seq': 0}, {'seq': 1}, {'seq': 2}])
+
+    def test_acknowledged_batch_is_gone(self):
+        batch, _ = self.backend.take(2)
+        self.backend.ack(batch)
+        self.assertEqual(self.backend.recover(), 0)
+        self.assertEqual(self.backend.depth(), 1)
+
+    def test_putback_keeps_order(self):
+        batch, rows = self.backend.take(2)
+        self.backend.putback(batch, rows)
+        self.assertEqual(self.backend.take(3)[1], [{'seq': 0}, {'seq': 1}, {'seq': 2}])
+
+
+class IngestStatsTests(SimpleTestCase):
+    def test_latency_samples_are_bounded(self):
+        stats = IngestStats(max_samples=100)
+        for i in range(1000):
+            stats.record(i / 1000, accepted=1)
+        self.assertEqual(len(stats.latencies), 100)
+        summary = stats.summary()
+        self.assertEqual((summary['calls'], summary['accepted']), (1000, 1000))
+        self.assertAlmostEqual(summary['max_ms'], 999)
+
+
+class TerminalOutputTests(TestCase):
+    def test_footer_polls_from_the_returned_offset(self):
+        # The footer is on every page; polling without ?offset= replays the log each tick
+        response = self.client.get('/')
+        self.assertContains(response, 'output/?offset=${outputOffset}')
+
+
+class HttpConnectionTests(SimpleTestCase):
+    async def serve(self, reader, writer):
+        # Answers each request with its number, the very first one late
+        self.handlers.add(asyncio.current_task())
+        try:
+            while True:
+                await reader.readuntil(b'\r\n\r\n')
+                self.served += 1
+                request = self.served
+                if request == 1:
+                    await asyncio.sleep(0.3)
+                body = json.dumps({'request': request}).encode()
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n%s' % (len(body), body))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+
+    async def exchange(self):
+        self.served, self.handlers = 0, set()
+        server = await asyncio.start_server(self.serve, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        connection = HttpConnection(f'http://127.0.0.1:{port}/api/readings/batch/', timeout=0.1)
+        try:
+            with self.assertRaises(asyncio.TimeoutError):
+                await connection.post_json([])
+            return await connection.post_json([])
+        finally:
+            await connection.close()
+            server.close()
+            await asyncio.gather(*self.handlers)
+
+    def test_timed_out_connection_is_not_reused(self):
+        # On the old socket the late first response would answer the second request
+        self.assertEqual(asyncio.run(self.exchange()), (200, {'request': 2}))
+
+
+class GatewayFramingTests(SimpleTestCase):
+    def test_decode_accepts_object_list_and_envelope(self):
+        reading = {'device_id': 'D1', 'flow_rate': 2.5}
+        for payload in (json.dumps(reading), json.dumps([reading]), json.dumps({'readings': [reading]})):
+            with self.subTest(payload=payload):
+                self.assertEqual(decode(payload.encode(), 'json'), [reading])
+
+    def test_decode_errors(self):
+        for payload, fmt in ((b'{not json', 'json'), (b'42', 'json'), (b'\x00' * 5, 'packed')):
+            with self.subTest(payload=payload):
+                with self.assertRaises(DecodeError):
+                    decode(payload, fmt)
+
+    def stream(self, handler, chunks, fmt):
+        async def run():
+            gateway = IngestGateway()
+            gateway.queue = asyncio.Queue()
+            reader = asyncio.StreamReader()
+            for chunk in chunks:
+                reader.feed_data(chunk)
+            reader.feed_eof()
+            await getattr(gateway, handler)(reader, mock.Mock(drain=mock.AsyncMock()), fmt)
+            rows = []
+            while not gateway.queue.empty():
+                rows.append(gateway.queue.get_nowait())
+            return gateway, rows
+        return asyncio.run(run())
+
+    def test_tcp_json_lines(self):
+        gateway, rows = self.stream('_tcp_client', [
+            b'{"device_id": "D1", "seq": 1}\n\n{"device_id": "D1", ', b'"seq": 2}\nnot json\n',
+        ], 'json')
+        self.assertEqual([row['seq'] for row in rows], [1, 2])
+        self.assertEqual(gateway.decode_errors, 1)
+
+    def test_tcp_packed_records_split_across_reads(self):
+        body = pack_readings([{'device_id': 'D1', 'seq': seq} for seq in range(3)])
+        gateway, rows = self.stream('_tcp_client', [body[:50], body[50:90], body[90:]], 'packed')
+        self.assertEqual([row['seq'] for row in rows], [0, 1, 2])
+        self.assertEqual(gateway.decode_errors, 0)
+
+    def test_mqtt_publish(self):
+        payload = json.dumps({'device_id': 'D1', 'seq': 5}).encode()
+        topic = b'jalraksha/readings/D1'
+        connect = _mqtt_packet(0x10, b'\x00\x04MQTT\x04\x02\x00\x3c\x00\x02D1')
+        # QoS 1 publish: topic, packet id, payload
+        publish = _mqtt_packet(0x32, len(topic).to_bytes(2, 'big') + topic + b'\x00\x07' + payload)
+        gateway, rows = self.stream('_mqtt_client', [connect, publish, _mqtt_packet(0xE0, b'')], 'json')
+        self.assertEqual(rows, [{'device_id': 'D1', 'seq': 5}])
+        self.assertEqual(gateway.connections, 0)
@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import views, event_views
 
 app_name = 'sensors'
 
@@ -9,6 +9,9 @@ urlpatterns = [
     path('terminal/execute/', views.execute_command, name='execute_command'),
     path('terminal/output/', views.get_output, name='get_output'),
     
+    # Live push of readings, leaks and alerts (ASGI only)
+    path('events/', event_views.event_stream, name='event_stream'),
+    
     # Dashboard and sensor routes
     path('', views.dashboard, name='dashboard'),
     path('sensors/', views.sensor_list, name='sensor_list'),
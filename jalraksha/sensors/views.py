@@ -1,9 +1,10 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib import messages
-from django.db.models import Avg, Max, Min, Count
+from django.db.models import Count
 from django.utils import timezone
 from datetime import timedelta
 from .models import SensorDevice, SensorReading, WaterConsumptionZone
+from analytics import rollups
 
 def dashboard(request):
     total_sensors = SensorDevice.objects.count()
@@ -35,14 +36,8 @@ def sensor_detail(request, device_id):
     since = timezone.now() - timedelta(hours=24)
     readings = sensor.readings.filter(timestamp__gte=since)
     
-    # Statistics
-    stats = readings.aggregate(
-        avg_flow=Avg('flow_rate'),
-        max_flow=Max('flow_rate'),
-        min_flow=Min('flow_rate'),
-        avg_pressure=Avg('pressure'),
-        total_readings=Count('id')
-    )
+    # Statistics from the hourly rollups plus readings not rolled up yet
+    stats = rollups.summarize(since, sensor_ids=[sensor.id])
     
     context = {
         'sensor': sensor,
@@ -52,7 +47,13 @@ def sensor_detail(request, device_id):
     return render(request, 'sensors/sensor_detail.html', context)
 
 def zones_list(request):
-    zones = WaterConsumptionZone.objects.all()
+    from analytics import water_balance
+
+    zones = list(WaterConsumptionZone.objects.annotate(sensor_count=Count('sensors')))
+    # Last 24 hours of the stored balances; raw readings are never read here
+    balances = water_balance.zone_totals(timezone.now() - timedelta(hours=24))
+    for zone in zones:
+        zone.balance = balances.get(zone.id)
     context = {'zones': zones}
     return render(request, 'sensors/zones_list.html', context)
 
@@ -61,17 +62,11 @@ def zones_list(request):
 from django.shortcuts import render
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
-import subprocess
-import os
 import json
-import sys
-import threading
-import queue
+from .simulation import simulation_manager
 
-# Store the process globally
-simulation_process = None
-output_queue = queue.Queue()
-is_running = False
+# Arguments for the demo feed started from the terminal page
+SIMULATION_ARGS = ['--interval', '5', '--demo-leaks', '--verbosity', '2']
 
 def terminal_view(request):
     """Render the terminal interface"""
@@ -110,114 +105,45 @@ def execute_command(request):
     
     return JsonResponse({'output': 'Invalid request', 'success': False})
 
-def enqueue_output(pipe, queue):
-    """Read output from pipe and put in queue"""
-    try:
-        for line in iter(pipe.readline, ''):
-            if line:
-                queue.put(line)
-        pipe.close()
-    except Exception as e:
-        queue.put(f"Error reading output: {str(e)}\n")
-
 def start_simulation():
     """Start the sensor simulation process with live output"""
-    global simulation_process, is_running, output_queue
-    
-    if is_running and simulation_process and simulation_process.poll() is None:
+    try:
+        pid = simulation_manager.start(SIMULATION_ARGS)
+    except OSError as e:
         return JsonResponse({
-            'output': 'Simulation is already running! Use "stop simulation" to stop it first.',
+            'output': f'Error starting simulation: {str(e)}',
             'success': False
         })
     
-    try:
-        # Clear output queue
-        while not output_queue.empty():
-            try:
-                output_queue.get_nowait()
-            except queue.Empty:
-                break
-        
-        # Get Python executable
-        python_exe = sys.executable
-        
-        # Start the simulation process with unbuffered output
-        env = os.environ.copy()
-        env['PYTHONUNBUFFERED'] = '1'
-        
-        # CRITICAL: Use a separate process group to isolate from parent
-        if sys.platform == 'win32':
-            # Windows: CREATE_NEW_PROCESS_GROUP flag
-            simulation_process = subprocess.Popen(
-                [python_exe, 'manage.py', 'simulate_sensor', '--interval', '5'],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1,
-                universal_newlines=True,
-                env=env,
-                creationflags=subprocess.CREATE_NEW_PROCESS_GROUP
-            )
-        else:
-            # Unix/Linux: Use preexec_fn to create new process group
-            simulation_process = subprocess.Popen(
-                [python_exe, 'manage.py', 'simulate_sensor', '--interval', '5'],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1,
-                universal_newlines=True,
-                env=env,
-                preexec_fn=os.setpgrp  # Create new process group
-            )
-        
-        is_running = True
-        
-        # Start thread to read output
-        output_thread = threading.Thread(
-            target=enqueue_output, 
-            args=(simulation_process.stdout, output_queue),
-            daemon=True
-        )
-        output_thread.start()
-        
-        return JsonResponse({
-            'output': '✓ Sensor simulation started!\n\nLive output streaming...\n' + '='*50,
-            'success': True,
-            'streaming': True
-        })
-    except Exception as e:
-        is_running = False
+    if pid is None:
         return JsonResponse({
-            'output': f'Error starting simulation: {str(e)}',
+            'output': 'Simulation is already running! Use "stop simulation" to stop it first.',
             'success': False
         })
+    
+    return JsonResponse({
+        'output': '✓ Sensor simulation started!\n\nLive output streaming...\n' + '='*50,
+        'success': True,
+        'streaming': True,
+        'offset': 0
+    })
 
 @csrf_exempt
 def get_output(request):
-    """Get buffered output from simulation"""
-    global output_queue, simulation_process, is_running
-    
+    """Get simulation output written after ?offset= (a byte offset into the log)"""
     if request.method == 'GET':
-        lines = []
-        
-        # Get all available output from queue
-        while not output_queue.empty():
-            try:
-                line = output_queue.get_nowait()
-                lines.append(line.rstrip())
-            except queue.Empty:
-                break
-        
-        # Check if process is still running
-        if simulation_process:
-            if simulation_process.poll() is not None:
-                is_running = False
+        try:
+            offset = max(int(request.GET.get('offset', 0)), 0)
+        except ValueError:
+            offset = 0
         
-        output = '\n'.join(lines) if lines else ''
+        # Check before reading so the last poll after exit still gets the final lines
+        is_running = simulation_manager.is_running()
+        output, offset = simulation_manager.read_output(offset)
         
         return JsonResponse({
-            'output': output,
+            'output': output.rstrip(),
+            'offset': offset,
             'is_running': is_running
         })
     
@@ -225,70 +151,36 @@ def get_output(request):
 
 def stop_simulation():
     """Stop the sensor simulation process"""
-    global simulation_process, is_running, output_queue
-    
-    if not is_running or not simulation_process:
+    try:
+        stopped = simulation_manager.stop()
+    except OSError as e:
         return JsonResponse({
-            'output': 'No simulation is currently running.',
+            'output': f'Error stopping simulation: {str(e)}',
             'success': False
         })
     
-    try:
-        is_running = False
-        
-        # FIXED: Use terminate() instead of sending signals
-        # This safely stops only the child process without affecting Django server
-        simulation_process.terminate()
-        
-        # Wait for graceful shutdown
-        try:
-            simulation_process.wait(timeout=3)
-        except subprocess.TimeoutExpired:
-            # Force kill if it doesn't terminate gracefully
-            simulation_process.kill()
-            simulation_process.wait(timeout=2)
-        
-        # Collect remaining output
-        remaining_lines = []
-        while not output_queue.empty():
-            try:
-                line = output_queue.get_nowait()
-                remaining_lines.append(line.rstrip())
-            except queue.Empty:
-                break
-        
-        final_output = '\n'.join(remaining_lines) if remaining_lines else ''
-        
-        simulation_process = None
-        
-        return JsonResponse({
-            'output': final_output + '\n\n' + '='*50 + '\n✓ Sensor simulation stopped successfully!',
-            'success': True
-        })
-    except Exception as e:
-        is_running = False
-        simulation_process = None
+    if not stopped:
         return JsonResponse({
-            'output': f'Error stopping simulation: {str(e)}',
+            'output': 'No simulation is currently running.',
             'success': False
         })
+    
+    return JsonResponse({
+        'output': '='*50 + '\n✓ Sensor simulation stopped successfully!',
+        'success': True
+    })
 
 def check_status():
     """Check if simulation is running"""
-    global is_running, simulation_process
+    pid = simulation_manager.pid()
     
-    # Update running status based on process state
-    if simulation_process:
-        if simulation_process.poll() is not None:
-            is_running = False
-    
-    if is_running and simulation_process:
+    if pid is not None:
         return JsonResponse({
-            'output': f'● Simulation Status: RUNNING\n\nProcess ID: {simulation_process.pid}\nInterval: 5 seconds\nMode: Live streaming\n\nGenerating sensor readings...',
+            'output': f'● Simulation Status: RUNNING\n\nProcess ID: {pid}\nInterval: 5 seconds\nMode: Live streaming\n\nGenerating sensor readings...',
             'success': True
         })
     else:
         return JsonResponse({
             'output': '● Simulation Status: STOPPED\n\nNo active simulation process.\nUse "start simulation" to begin.',
             'success': True
-        })
\ No newline at end of file
+        })
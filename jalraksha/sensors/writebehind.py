@@ -0,0 +1,357 @@
+"""
+Write-behind buffer for single-reading POSTs.
+
+Legacy firmware posts one reading per request. Instead of a transaction
+per reading, ``SensorReadingViewSet.create`` validates the reading, hands
+it to ``reading_buffer.submit`` and answers 202 right away. A flusher
+thread writes the buffer through ``store_readings`` (dedup, last-seen,
+outbox) every ``INTERVAL_MS`` milliseconds, or as soon as ``MAX_ROWS``
+readings are waiting, in batches of ``MAX_ROWS``.
+
+The buffer holds at most ``CAPACITY`` readings. A request that finds it
+full flushes a batch itself, which slows devices down rather than
+dropping readings. Rows are buffered with their arrival time, so a
+reading without device_ts is stamped when it was received, not when it
+was written.
+
+Write-behind is off unless ``ENABLED`` is set: a 202 is an acknowledgement
+for a reading that is not stored yet. The in-memory backend is per
+process and is flushed at interpreter exit (a graceful worker shutdown),
+but a killed process loses what it held. With ``REDIS_URL`` set, readings
+wait in a Redis list shared by all workers. A flush moves its batch onto
+a processing list with LMOVE and deletes that list only once the batch
+has committed; a batch left behind by a crashed worker is moved back to
+the queue after ``LEASE`` seconds. A batch that committed just before a
+crash is written again, and only readings with a device_ts are
+recognised as duplicates then.
+
+A batch that fails to store is split in half and each half retried, so
+one bad row (say, for a device deleted since it was validated) cannot
+block the rows behind it. Rows that fail on their own are moved to a
+dead-letter list (``dead_letters()``) instead of being retried forever.
+Connection errors are not the rows' fault: the whole batch goes back to
+the head of the buffer for the next tick.
+"""
+import atexit
+import json
+import threading
+import time
+import uuid
+from collections import deque
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, close_old_connections
+from django.utils.dateparse import parse_datetime
+
+WRITE_BEHIND_SETTINGS = getattr(settings, 'READING_WRITE_BEHIND', {})
+
+# Errors that say nothing about the rows: the database is unreachable
+TRANSIENT_ERRORS = (OperationalError, InterfaceError)
+
+# Buffered fields, in addition to device_id
+READING_FIELDS = ('flow_rate', 'pressure', 'temperature', 'battery_level', 'device_ts', 'seq')
+
+
+class MemoryBackend:
+    def __init__(self):
+        self._rows = deque()
+        self._dead = []
+        self._lock = threading.Lock()
+
+    def push(self, row):
+        """Append a row; returns the new depth"""
+        with self._lock:
+            self._rows.append(row)
+            return len(self._rows)
+
+    def take(self, count):
+        """Remove up to count rows; returns (batch token, rows)"""
+        with self._lock:
+            return None, [self._rows.popleft() for _ in range(min(count, len(self._rows)))]
+
+    def ack(self, batch):
+        """Forget a batch once it has been written"""
+
+    def putback(self, batch, rows):
+        """Return rows that failed to flush to the front of the buffer"""
+        with self._lock:
+            self._rows.extendleft(reversed(rows))
+
+    def recover(self):
+        return 0
+
+    def dead_letter(self, rows):
+        """Set aside rows that cannot be stored"""
+        with self._lock:
+            self._dead.extend(rows)
+
+    def dead_letters(self):
+        with self._lock:
+            return list(self._dead)
+
+    def depth(self):
+        return len(self._rows)
+
+
+class RedisBackend:
+    def __init__(self, redis_url, key='jalraksha:readings:write-behind', lease=60):
+        self.redis_url = redis_url
+        self.key = key
+        # Processing lists by the time they were taken, so stale ones can be found
+        self.batches_key = f'{key}:batches'
+        # Seconds a taken batch may stay unacknowledged before it is requeued
+        self.lease = lease
+        self.dead_key = f'{key}:dead'
+        self._redis = None
+
+    @property
+    def client(self):
+        if self._redis is None:
+            import redis
+
+            self._redis = redis.Redis.from_url(self.redis_url)
+        return self._redis
+
+    def push(self, row):
+        return self.client.rpush(self.key, json.dumps(row))
+
+    def _move(self, source, destination, count, pop='LEFT', append='RIGHT'):
+        pipe = self.client.pipeline(transaction=False)
+        for _ in range(count):
+            pipe.lmove(source, destination, pop, append)
+        return [item for item in pipe.execute() if item is not None]
+
+    def take(self, count):
+        """Move up to count rows onto a new processing list; returns (its key, rows)"""
+        count = min(count, self.client.llen(self.key))
+        if not count:
+            return None, []
+        batch = f'{self.key}:processing:{uuid.uuid4().hex}'
+        self.client.zadd(self.batches_key, {batch: time.time()})
+        items = self._move(self.key, batch, count)
+        if not items:
+            self.ack(batch)
+        return batch, [json.loads(item) for item in items]
+
+    def ack(self, batch):
+        """Drop a processing list once its rows have committed"""
+        if batch is not None:
+            pipe = self.client.pipeline()
+            pipe.delete(batch)
+            pipe.zrem(self.batches_key, batch)
+            pipe.execute()
+
+    def putback(self, batch, rows):
+        """Move a batch's rows back to the head of the queue, in order"""
+        if batch is not None:
+            self._move(batch, self.key, len(rows), pop='RIGHT', append='LEFT')
+            self.ack(batch)
+
+    def recover(self):
+        """Requeue batches whose flusher died before acknowledging them; returns rows moved"""
+        moved = 0
+        stale = self.client.zrangebyscore(self.batches_key, 0, time.time() - self.lease)
+        for batch in stale:
+            batch = batch.decode()
+            while self.client.lmove(batch, self.key, 'RIGHT', 'LEFT') is not None:
+                moved += 1
+            self.client.zrem(self.batches_key, batch)
+        return moved
+
+    def dead_letter(self, rows):
+        if rows:
+            self.client.rpush(self.dead_key, *(json.dumps(row) for row in rows))
+
+    def dead_letters(self):
+        return [json.loads(item) for item in self.client.lrange(self.dead_key, 0, -1)]
+
+    def depth(self):
+        return self.client.llen(self.key)
+
+
+def to_row(reading, received_at):
+    """A JSON-safe buffer row from an unsaved SensorReading that passed validate_rows"""
+    row = {'device_id': reading.sensor.device_id, 'received_at': received_at.isoformat()}
+    for field in READING_FIELDS:
+        value = getattr(reading, field)
+        row[field] = value.isoformat() if hasattr(value, 'isoformat') else value
+    return row
+
+
+def build_readings(rows):
+    """SensorReading instances for buffered rows; devices gone or deactivated since are skipped"""
+    from .models import SensorReading
+    from .registry import device_registry
+
+    sensors = device_registry.get_many({row['device_id'] for row in rows})
+    readings = []
+    for row in rows:
+        sensor = sensors.get(row['device_id'])
+        if sensor is None or not sensor.is_active:
+            continue
+        values = {field: row[field] for field in READING_FIELDS if field in row}
+        values['device_ts'] = parse_datetime(row['device_ts']) if row.get('device_ts') else None
+        values['timestamp'] = values['device_ts'] or parse_datetime(row['received_at'])
+        readings.append(SensorReading(sensor=sensor, **values))
+    return readings
+
+
+class ReadingWriteBehind:
+    def __init__(self, backend, max_rows=500, interval=0.25, capacity=10000):
+        self.backend = backend
+        self.max_rows = max_rows
+        self.interval = interval
+        self.capacity = capacity
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.submitted = 0
+        self.written = 0
+        self.duplicates = 0
+        self.skipped = 0
+        self.flushes = 0
+        self.sync_flushes = 0
+        self.errors = 0
+        self.dead = 0
+        self.last_error = None
+        self.last_flush_ms = None
+
+    def submit(self, row):
+        """Buffer one row; blocks to flush a batch only when the buffer is full"""
+        self._ensure_started()
+        if self.backend.depth() >= self.capacity:
+            with self._stats_lock:
+                self.sync_flushes += 1
+            self.flush_batch()
+        depth = self.backend.push(row)
+        with self._stats_lock:
+            self.submitted += 1
+        if depth >= self.max_rows:
+            self._wake.set()
+        return depth
+
+    def flush(self):
+        """Write everything buffered; returns the number of rows handed to store_readings"""
+        stored = 0
+        while True:
+            count, taken = self.flush_batch()
+            stored += count
+            if taken < self.max_rows:
+                return stored
+
+    def flush_batch(self):
+        """Write one batch of up to max_rows; returns (readings built, rows taken)"""
+        batch, rows = self.backend.take(self.max_rows)
+        if not rows:
+            return 0, 0
+        started = time.perf_counter()
+        try:
+            built, statuses, dead = self._store(rows)
+        except Exception:
+            # Keep the rows for the next attempt rather than losing them
+            self.backend.putback(batch, rows)
+            with self._stats_lock:
+                self.errors += 1
+            raise
+        # Dead rows are set aside before the batch they came in is dropped
+        self.backend.dead_letter(dead)
+        self.backend.ack(batch)
+        with self._stats_lock:
+            self.flushes += 1
+            self.written += statuses.count('accepted')
+            self.duplicates += statuses.count('duplicate')
+            self.skipped += len(rows) - built - len(dead)
+            self.dead += len(dead)
+            self.last_flush_ms = (time.perf_counter() - started) * 1000
+        return built, len(rows)
+
+    def _store(self, rows):
+        """
+        Store rows through store_readings, bisecting around rows that fail.
+
+        Returns (readings built, statuses, rows that failed on their own).
+        Transient errors propagate, so the caller puts the batch back.
+        """
+        from .ingest import store_readings
+
+        try:
+            readings = build_readings(rows)
+            statuses = store_readings(readings) if readings else []
+            return len(readings), statuses, []
+        except TRANSIENT_ERRORS:
+            raise
+        except Exception as exc:
+            with self._stats_lock:
+                self.errors += 1
+                self.last_error = repr(exc)
+            if len(rows) == 1:
+                return 0, [], rows
+        middle = len(rows) // 2
+        built, statuses, dead = self._store(rows[:middle])
+        more_built, more_statuses, more_dead = self._store(rows[middle:])
+        return built + more_built, statuses + more_statuses, dead + more_dead
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='reading-write-behind', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            close_old_connections()
+            try:
+                self.backend.recover()
+                self.flush()
+            except Exception:
+                # Rows were put back; wait for the next tick before retrying
+                pass
+
+    def close(self, timeout=10.0):
+        """Stop the flusher and write whatever is still buffered"""
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.flush()
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'backend': 'redis' if isinstance(self.backend, RedisBackend) else 'memory',
+                'depth': self.backend.depth(),
+                'capacity': self.capacity,
+                'max_rows': self.max_rows,
+                'interval_ms': self.interval * 1000,
+                'submitted': self.submitted,
+                'written': self.written,
+                'duplicates': self.duplicates,
+                'skipped': self.skipped,
+                'flushes': self.flushes,
+                'sync_flushes': self.sync_flushes,
+                'errors': self.errors,
+                'dead': self.dead,
+                'last_error': self.last_error,
+                'last_flush_ms': self.last_flush_ms,
+            }
+
+
+def _backend():
+    redis_url = WRITE_BEHIND_SETTINGS.get('REDIS_URL')
+    if redis_url:
+        return RedisBackend(redis_url, lease=WRITE_BEHIND_SETTINGS.get('LEASE', 60))
+    return MemoryBackend()
+
+
+reading_buffer = ReadingWriteBehind(
+    _backend(),
+    max_rows=WRITE_BEHIND_SETTINGS.get('MAX_ROWS', 500),
+    interval=WRITE_BEHIND_SETTINGS.get('INTERVAL_MS', 250) / 1000,
+    capacity=WRITE_BEHIND_SETTINGS.get('CAPACITY', 10000),
+)
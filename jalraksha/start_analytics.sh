@@ -0,0 +1,17 @@
+#!/usr/bin/env bash
+# Scoring and training workers for one service, so both use the model
+# store on its disk (ANALYTICS_MODEL_DIR). Each queue keeps its own worker
+# and CELERY_WORKER_PROFILES sizing; if either stops, the service exits
+# and is restarted.
+set -o errexit
+
+# Exit (and be restarted) until the web deploy has migrated the shared database
+python manage.py migrate --check
+
+celery -A jalraksha worker -Q scoring -n scoring@%h &
+celery -A jalraksha worker -Q training -n training@%h &
+trap 'kill -TERM $(jobs -p) 2>/dev/null' TERM INT
+wait -n
+kill -TERM $(jobs -p) 2>/dev/null || true
+wait
+exit 1
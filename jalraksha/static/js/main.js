@@ -23,6 +23,10 @@ function initializeAnalyticsDashboard() {
     const sensorStatusData = JSON.parse(document.getElementById('sensorStatusData')?.textContent || '{"labels":[],"values":[]}');
     
     initializeCharts(flowRateData, pressureData, consumptionData, sensorStatusData);
+    // Live readings are appended after the initial history
+    [charts.flowRate, charts.pressure].forEach(chart => {
+        if (chart) chart.historyLength = chart.data.labels.length;
+    });
     setupEventListeners();
     
     console.log('Analytics Dashboard Initialized');
@@ -340,8 +344,68 @@ function initializeCharts(flowRateData, pressureData, consumptionData, sensorSta
     }
 }
 
-// Start live updates (fetch new data every 10 seconds)
+let eventSource = null;
+const MAX_LIVE_POINTS = 60;
+const RANGE_HOURS = { '24h': 24, '7d': 168, '30d': 720, '90d': 2160 };
+
+// Device id of the sensor the charts show, or null for the whole fleet
+function displayedSensor() {
+    const sensor = document.getElementById('sensorFilter')?.value;
+    return sensor && sensor !== 'all' ? sensor : null;
+}
+
+// Start live updates: pushed over Server-Sent Events, polling as a fallback.
+// Readings are only streamed while one sensor is on display: the fleet
+// charts are per-bucket aggregates, and raw readings from every sensor
+// appended to one line would mix them.
 function startLiveUpdates() {
+    if (!window.EventSource) {
+        startPolling();
+        return;
+    }
+    if (eventSource) {
+        eventSource.close();
+    }
+
+    const sensor = displayedSensor();
+    const query = sensor
+        ? `types=reading,leak,alert&sensor=${encodeURIComponent(sensor)}`
+        : 'types=leak,alert';
+    console.log('Subscribing to live sensor events...');
+    eventSource = new EventSource(`/events/?${query}`);
+
+    eventSource.addEventListener('reading', event => {
+        appendLiveReading(JSON.parse(event.data));
+    });
+
+    eventSource.addEventListener('leak', event => {
+        const leak = JSON.parse(event.data);
+        showNotification(`${leak.severity} leak detected. Estimated loss: ${leak.estimated_loss_rate.toFixed(1)} L/hr`, 'warning');
+    });
+
+    eventSource.addEventListener('alert', event => {
+        const alert = JSON.parse(event.data);
+        // Alerts read or resolved from the inbox are updates, not news
+        if (alert.is_read || alert.is_resolved) {
+            return;
+        }
+        const urgent = alert.priority === 'URGENT' || alert.priority === 'HIGH';
+        showNotification(alert.message, urgent ? 'warning' : 'info');
+    });
+
+    eventSource.onerror = () => {
+        // The browser reconnects on its own; a closed stream means the
+        // server cannot push (e.g. running under WSGI), so poll instead
+        if (eventSource.readyState === EventSource.CLOSED) {
+            eventSource = null;
+            startPolling();
+        }
+    };
+}
+
+// Poll for new data every 10 seconds
+function startPolling() {
+    if (updateInterval) return;
     console.log('Starting live updates every 10 seconds...');
     
     updateInterval = setInterval(() => {
@@ -349,6 +413,46 @@ function startLiveUpdates() {
     }, 10000); // Update every 10 seconds
 }
 
+// Append one pushed reading to the live charts
+function appendLiveReading(reading) {
+    const label = new Date(reading.timestamp).toLocaleTimeString();
+    [[charts.flowRate, reading.flow_rate], [charts.pressure, reading.pressure]].forEach(([chart, value]) => {
+        if (!chart || value === null) return;
+        chart.data.labels.push(label);
+        chart.data.datasets[0].data.push(value);
+        // Drop the oldest live point, never the downsampled history before it
+        const history = chart.historyLength || 0;
+        if (chart.data.labels.length - history > MAX_LIVE_POINTS) {
+            chart.data.labels.splice(history, 1);
+            chart.data.datasets[0].data.splice(history, 1);
+        }
+        chart.update('none');
+    });
+}
+
+// Replace the flow and pressure history with the displayed sensor's (or
+// the fleet's) downsampled series for the selected range
+function loadSeries() {
+    const hours = RANGE_HOURS[document.getElementById('timeRange')?.value] || 24;
+    const since = new Date(Date.now() - hours * 3600 * 1000).toISOString();
+    const sensor = displayedSensor();
+    return Promise.all([[charts.flowRate, 'flow_rate'], [charts.pressure, 'pressure']].map(([chart, field]) => {
+        if (!chart) return null;
+        const params = new URLSearchParams({ field, since, points: 200 });
+        if (sensor) params.set('sensor', sensor);
+        return fetch(`/analytics/series/?${params}`)
+            .then(response => response.json())
+            .then(data => {
+                chart.data.labels = data.timestamps.map(ms => new Date(ms).toLocaleString());
+                chart.data.datasets[0].data = data.values;
+                chart.historyLength = data.values.length;
+                chart.update('none');
+            });
+    })).catch(error => {
+        console.error('Error fetching sensor series:', error);
+    });
+}
+
 // Fetch latest sensor data via AJAX
 function fetchLatestSensorData() {
     const timeRange = document.getElementById('timeRange')?.value || '24h';
@@ -376,6 +480,7 @@ function updateChartsWithNewData(data) {
     if (charts.flowRate && data.flow_rate_data) {
         charts.flowRate.data.labels = data.flow_rate_data.labels;
         charts.flowRate.data.datasets[0].data = data.flow_rate_data.values;
+        charts.flowRate.historyLength = data.flow_rate_data.values.length;
         charts.flowRate.update('none'); // No animation for smoother updates
     }
     
@@ -383,6 +488,7 @@ function updateChartsWithNewData(data) {
     if (charts.pressure && data.pressure_data) {
         charts.pressure.data.labels = data.pressure_data.labels;
         charts.pressure.data.datasets[0].data = data.pressure_data.values;
+        charts.pressure.historyLength = data.pressure_data.values.length;
         charts.pressure.update('none');
     }
     
@@ -454,11 +560,14 @@ function setupEventListeners() {
         });
     }
 
-    // Sensor Filter
+    // Sensor Filter: the charts and the live stream follow the selection
     const sensorFilter = document.getElementById('sensorFilter');
     if (sensorFilter) {
         sensorFilter.addEventListener('change', function() {
             fetchLatestSensorData();
+            loadSeries().then(() => {
+                if (eventSource) startLiveUpdates();
+            });
         });
     }
 